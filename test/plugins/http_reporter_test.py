@@ -1,4 +1,6 @@
 import threading
+
+import mock
 import tornado.ioloop
 import tornado.httpserver
 import tornado.web
@@ -6,15 +8,11 @@ import tornado.web
 import six
 
 from test.test_logger_test import ExceptionInClassFixtureSampleTests
-from testify import assert_equal, assert_is, setup_teardown, TestCase
+from testify import assert_equal, assert_in, assert_is, assert_not_in, setup_teardown, TestCase
+from testify import test_runner_wire
 from testify.test_runner import TestRunner
 from testify.plugins.http_reporter import HTTPReporter
 
-try:
-    import simplejson as json  # noqa
-except ImportError:
-    import json
-
 
 class DummyTestCase(TestCase):
     __test__ = False
@@ -27,18 +25,42 @@ class HTTPReporterTestCase(TestCase):
     @setup_teardown
     def make_fake_server(self):
         self.results_reported = []
+        self.bodies_reported = []
+        self.request_headers = []
+        self.connections = set()
         self.status_codes = six.moves.queue.Queue()
+        self.drop_connections = 0
+        self.rejected = []
+        self.wire_capabilities = None
 
         class ResultsHandler(tornado.web.RequestHandler):
             def post(handler):
-                result = json.loads(handler.request.body.decode('UTF-8'))
-                self.results_reported.append(result)
+                if self.wire_capabilities:
+                    handler.set_header(test_runner_wire.WIRE_HEADER, self.wire_capabilities)
+                body = test_runner_wire.decode(
+                    handler.request.body,
+                    handler.request.headers.get('Content-Type'),
+                    handler.request.headers.get(test_runner_wire.WIRE_HEADER),
+                )
+                self.bodies_reported.append(body)
+                self.request_headers.append(handler.request.headers)
+                self.results_reported.extend(body if isinstance(body, list) else [body])
+                self.connections.add(handler.request.connection.stream)
+
+                if self.drop_connections:
+                    self.drop_connections -= 1
+                    handler.request.connection.stream.close()
+                    return
 
                 try:
                     status_code = self.status_codes.get_nowait()
                     handler.send_error(status_code)
                 except six.moves.queue.Empty:
-                    handler.finish("kthx")
+                    if self.rejected:
+                        handler.set_header('Content-Type', test_runner_wire.JSON)
+                        handler.finish(test_runner_wire.encode({'rejected': self.rejected})[0])
+                    else:
+                        handler.finish("kthx")
 
             def get_error_html(handler, status, **kwargs):
                 return "error"
@@ -79,11 +101,10 @@ class HTTPReporterTestCase(TestCase):
         assert_equal(method_result['method']['class'], 'DummyTestCase')
         assert_equal(method_result['method']['name'], 'test')
 
-    def test_http_reporter_tries_twice(self):
-        self.status_codes.put(409)
-        self.status_codes.put(409)
+    def test_http_reporter_retries_after_connection_errors(self):
+        self.drop_connections = 1
 
-        runner = TestRunner(DummyTestCase, test_reporters=[HTTPReporter(None, self.connect_addr, 'tries_twice')])
+        runner = TestRunner(DummyTestCase, test_reporters=[HTTPReporter(None, self.connect_addr, 'tries_twice', batch_size=1)])
         runner.run()
 
         (first, second, test_case_result) = self.results_reported
@@ -91,6 +112,84 @@ class HTTPReporterTestCase(TestCase):
         assert_equal(first['runner_id'], 'tries_twice')
         assert_equal(first, second)
 
+    def test_http_reporter_does_not_retry_errors_from_the_server(self):
+        self.status_codes.put(409)
+
+        runner = TestRunner(DummyTestCase, test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1', batch_size=1)])
+        with mock.patch('testify.plugins.http_reporter.logging') as logging_mock:
+            runner.run()
+
+        (test_method_result, test_case_result) = self.results_reported
+        assert_equal(logging_mock.error.call_count, 1)
+
+    def test_http_reporter_logs_only_rejected_classes(self):
+        class_path = '%s DummyTestCase' % DummyTestCase.__module__
+        self.rejected = [{'class_path': class_path, 'reason': 'not checked out'}]
+
+        runner = TestRunner(
+            ExceptionInClassFixtureSampleTests.FakeClassTeardownTestCase,
+            test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1', batch_size=1)],
+        )
+        with mock.patch('testify.plugins.http_reporter.logging') as logging_mock:
+            runner.run()
+        assert_equal(logging_mock.error.call_count, 0)
+
+        runner = TestRunner(DummyTestCase, test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1', batch_size=1)])
+        with mock.patch('testify.plugins.http_reporter.logging') as logging_mock:
+            runner.run()
+        assert_equal(logging_mock.error.call_count, 2)
+        assert_in('%s.test' % class_path, logging_mock.error.call_args_list[0][0][0])
+
+    def test_http_reporter_batches_results(self):
+        self.wire_capabilities = 'batch'
+        runner = TestRunner(
+            ExceptionInClassFixtureSampleTests.FakeClassTeardownTestCase,
+            test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1', batch_size=3, batch_window=60)],
+        )
+        runner.run()
+
+        # The first result goes alone, before the server has said it takes
+        # batches. report() sends the partial last batch without waiting out
+        # the window.
+        first_body = self.bodies_reported[0]
+        assert_equal(first_body['method']['name'], 'test1')
+        assert_equal([len(batch) for batch in self.bodies_reported[1:]], [2, 1])
+        assert_equal(len(self.connections), 1)
+
+    def test_http_reporter_sends_one_result_at_a_time_to_older_servers(self):
+        runner = TestRunner(
+            ExceptionInClassFixtureSampleTests.FakeClassTeardownTestCase,
+            test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1', batch_size=3, batch_window=60)],
+        )
+        runner.run()
+
+        assert_equal(len(self.bodies_reported), 4)
+        for body in self.bodies_reported:
+            assert isinstance(body, dict)
+
+    def test_http_reporter_uses_what_the_server_accepts(self):
+        self.wire_capabilities = 'deflate omit-pretty'
+        runner = TestRunner(DummyTestCase, test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1', batch_size=1)])
+        runner.run()
+
+        # The first batch is sent before the server has said what it accepts.
+        (test_method_result, test_case_result) = self.results_reported
+        assert_in('exception_info_pretty', test_method_result)
+        assert_not_in('exception_info_pretty', test_case_result)
+
+    def test_http_reporter_compresses_big_batches(self):
+        self.wire_capabilities = 'batch deflate'
+        runner = TestRunner(
+            ExceptionInClassFixtureSampleTests.FakeClassTeardownTestCase,
+            test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1', batch_size=3, batch_window=60)],
+        )
+        runner.run()
+
+        assert_equal(len(self.results_reported), 4)
+        assert_in('deflate', [headers.get(test_runner_wire.WIRE_HEADER) for headers in self.request_headers])
+        # tornado would warn about each of these.
+        assert_not_in('Content-Encoding', [name for headers in self.request_headers for name in headers])
+
     def test_http_reporter_completed_test_case(self):
         runner = TestRunner(DummyTestCase, test_reporters=[HTTPReporter(None, self.connect_addr, 'runner1')])
         runner.run()
@@ -1,4 +1,7 @@
 from mock import patch
+import os
+import shutil
+import tempfile
 import time
 
 try:
@@ -15,8 +18,11 @@ except ImportError:
 from test.discovery_failure_test import BrokenImportTestCase
 from test.test_logger_test import ExceptionInClassFixtureSampleTests
 from test.test_case_test import RegexMatcher
-from testify import TestCase, assert_equal, assert_gt, assert_in, assert_in_range, assert_raises, setup_teardown
-from testify.plugins.sql_reporter import add_command_line_options, SQLReporter
+from testify import (
+    TestCase, assert_equal, assert_gt, assert_in, assert_in_range, assert_lt, assert_raises, class_setup_teardown,
+    setup_teardown,
+)
+from testify.plugins.sql_reporter import add_command_line_options, LRUCache, replay_spool, ResultSpool, SQLReporter
 from testify.test_program import default_parser
 from testify.test_result import TestResult
 from testify.test_runner import TestRunner
@@ -48,10 +54,8 @@ class SQLReporterBaseTestCase(TestCase):
             msg = 'SQL Reporter plugin requires sqlalchemy and you do not have it installed in your PYTHONPATH.\n'
             raise ImportError(msg)
 
-        parser = default_parser()
-        add_command_line_options(parser)
         self.fake_buildbot_run_id = 'A' * 36
-        (options, args) = parser.parse_args([
+        (options, args) = self.parse_args(self.reporter_args() + [
             '--reporting-db-url', 'sqlite://',
             '--sql-reporting-frequency', '0.05',
             '--build-info', json.dumps({
@@ -73,6 +77,15 @@ class SQLReporterBaseTestCase(TestCase):
         yield
         # no teardown.
 
+    def reporter_args(self):
+        """Extra command line args for make_reporter's SQLReporter."""
+        return []
+
+    def parse_args(self, args):
+        parser = default_parser()
+        add_command_line_options(parser)
+        return parser.parse_args(args)
+
     def _get_test_results(self, conn):
         """Return a list of tests and their results from SA connection `conn`."""
         return list(conn.execute(SA.select(
@@ -202,6 +215,95 @@ class SQLReporterTestCase(SQLReporterBaseTestCase):
         for result in test_results:
             assert_equal(result['method_name'], 'test_pass')
 
+    def _previous_run_chains(self, conn):
+        """Return the run times of each chain of results, newest first."""
+        rows = dict((row['id'], row) for row in conn.execute(self.reporter.TestResults.select()))
+        chains = []
+        for row in rows.values():
+            if any(other['previous_run'] == row['id'] for other in rows.values()):
+                continue
+            chain = []
+            while row is not None:
+                chain.append(row['run_time'])
+                row = rows.get(row['previous_run'])
+            chains.append(chain)
+        return sorted(chains)
+
+    def _report_chains(self, *lengths):
+        run_time = 0
+        for length in lengths:
+            previous_run = None
+            for _ in range(length):
+                run_time += 1
+                result = TestResult(DummyTestCase().test_pass).to_dict()
+                result.update(end_time=time.time(), run_time=run_time, runner_id=None, previous_run=previous_run)
+                previous_run = result
+            self.reporter.test_complete(result)
+        assert self.reporter.report()
+
+    def test_previous_runs_of_many_results(self):
+        self._report_chains(3, 1, 2)
+        assert_equal(self._previous_run_chains(self.reporter.conn), [[3, 2, 1], [4], [6, 5]])
+
+    def test_previous_runs_without_multi_row_insert_ids(self):
+        self.reporter.multi_row_insert_ids = None
+        self._report_chains(2, 3)
+        assert_equal(self._previous_run_chains(self.reporter.conn), [[2, 1], [5, 4, 3]])
+
+    def test_report_flushes_without_waiting(self):
+        self.reporter.reporting_frequency = 60
+        self.reporter.batch_size = 2
+        for _ in range(5):
+            result = TestResult(DummyTestCase().test_pass)
+            result.start()
+            result.end_in_success()
+            self.reporter.test_complete(result.to_dict())
+
+        start_time = time.time()
+        assert self.reporter.report()
+        assert_lt(time.time() - start_time, 1)
+        assert_equal(len(self._get_test_results(self.reporter.conn)), 5)
+
+    def test_report_flushes_in_batches(self):
+        inserts = []
+
+        def count_inserts(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT INTO test_results'):
+                inserts.append(statement)
+        SA.event.listen(self.reporter.engine, 'before_cursor_execute', count_inserts)
+
+        self.reporter.reporting_frequency = 60
+        self.reporter.batch_size = 10
+        for _ in range(25):
+            result = TestResult(DummyTestCase().test_pass)
+            result.start()
+            result.end_in_success()
+            self.reporter.test_complete(result.to_dict())
+        assert self.reporter.report()
+
+        assert_equal(len(self._get_test_results(self.reporter.conn)), 25)
+        assert_equal(len(inserts), 3)
+
+    def test_timings_are_stored_at_full_precision(self):
+        result = TestResult(DummyTestCase().test_pass).to_dict()
+        result.update(end_time=1418845117.25, run_time=0.0, run_time_ns=1234567, runner_id=None)
+        self.reporter.test_complete(result)
+        assert self.reporter.report()
+
+        (row,) = self.reporter.conn.execute(self.reporter.TestResults.select())
+        assert_equal(row['end_time'], 1418845117.25)
+        assert_equal(row['run_time'], 0.001234567)
+
+    def test_get_class_timings(self):
+        runner = TestRunner(DummyTestCase, test_reporters=[self.reporter])
+        runner.run()
+
+        timings = self.reporter.get_class_timings(0)
+        assert_equal(list(timings.keys()), ['%s.DummyTestCase' % DummyTestCase.__module__])
+        assert_gt(timings['%s.DummyTestCase' % DummyTestCase.__module__], 0)
+
+        assert_equal(self.reporter.get_class_timings(time.time() + 60), {})
+
     def test_traceback_size_limit(self):
         """Insert a failure with a long exception and make sure it gets truncated."""
         conn = self.reporter.conn
@@ -363,4 +465,154 @@ class SQLReporterReportResultsByChunk(SQLReporterBaseTestCase):
         assert_equal(len(results), len(test_results))
 
 
+class SQLReporterPrepareIdsTestCase(SQLReporterBaseTestCase):
+    def test_ids_are_looked_up_in_bulk(self):
+        conn = self.reporter.conn
+        test_case = DummyTestCase()
+        results = []
+        for method in (test_case.test_pass, test_case.test_fail, test_case.test_fail):
+            result = TestResult(method)
+            result.start()
+            result.end_in_failure((AssertionError, AssertionError('same every time'), None))
+            results.append(result.to_dict())
+
+        self.reporter._prepare_ids(conn, results)
+        self.reporter._prepare_ids(conn, results)
+
+        assert_equal(len(conn.execute(self.reporter.Tests.select()).fetchall()), 2)
+        assert_equal(len(conn.execute(self.reporter.Failures.select()).fetchall()), 1)
+
+        # Every id is cached now, so making rows doesn't touch the database.
+        with patch.object(conn, 'execute') as mock_execute:
+            rows = [self.reporter._create_row_to_insert(conn, result) for result in results]
+        assert_equal(mock_execute.call_count, 0)
+        assert_equal(len(set(row['failure'] for row in rows)), 1)
+
+    def test_test_ids_are_cached_a_module_at_a_time(self):
+        conn = self.reporter.conn
+        conn.execute(self.reporter.Tests.insert(), [
+            {'module': DummyTestCase.__module__, 'class_name': 'DummyTestCase', 'method_name': 'test_multiline'},
+            {'module': 'other_module', 'class_name': 'OtherTestCase', 'method_name': 'test_other'},
+        ])
+        assert_equal(len(self.reporter.test_id_cache), 0)
+
+        result = TestResult(DummyTestCase().test_pass)
+        result.start()
+        result.end_in_success()
+        self.reporter._prepare_ids(conn, [result.to_dict()])
+
+        assert (DummyTestCase.__module__, 'DummyTestCase', 'test_multiline') in self.reporter.test_id_cache
+        assert ('other_module', 'OtherTestCase', 'test_other') not in self.reporter.test_id_cache
+        assert_equal(self.reporter.cached_modules, set([DummyTestCase.__module__]))
+
+
+class SQLReporterSpoolTestCase(SQLReporterBaseTestCase):
+    @class_setup_teardown
+    def make_tempdir(self):
+        self.tempdir = tempfile.mkdtemp()
+        try:
+            yield
+        finally:
+            shutil.rmtree(self.tempdir)
+
+    def reporter_args(self):
+        self.spool_path = os.path.join(tempfile.mkdtemp(dir=self.tempdir), 'spool')
+        return ['--sql-spool', self.spool_path]
+
+    def _complete_test(self):
+        result = TestResult(DummyTestCase().test_pass)
+        result.start()
+        result.end_in_success()
+        self.reporter.test_complete(result.to_dict())
+
+    def test_reported_results_leave_the_spool(self):
+        self._complete_test()
+        assert self.reporter.report()
+
+        assert_equal(len(self._get_test_results(self.reporter.conn)), 1)
+        assert_equal(ResultSpool(self.spool_path).pending(self.reporter.build_id), [])
+
+    def test_results_are_kept_when_the_database_fails(self):
+        with patch.object(self.reporter, '_create_row_to_insert', side_effect=SA.exc.OperationalError(1, 2, 3)):
+            self._complete_test()
+            assert not self.reporter.report()
+
+        assert_equal(len(self._get_test_results(self.reporter.conn)), 0)
+        ((_, result),) = ResultSpool(self.spool_path).pending(self.reporter.build_id)
+        assert_equal(result['method']['name'], 'test_pass')
+
+    def test_results_stay_spooled_when_their_previous_runs_fail(self):
+        previous_run = TestResult(DummyTestCase().test_pass)
+        previous_run.start()
+        previous_run.end_in_success()
+        result = TestResult(DummyTestCase().test_pass)
+        result.start(previous_run=previous_run.to_dict())
+        result.end_in_success()
+
+        with patch.object(self.reporter, '_insert_previous_runs', side_effect=SA.exc.OperationalError(1, 2, 3)):
+            self.reporter.test_complete(result.to_dict())
+            assert not self.reporter.report()
+
+        assert_equal(len(self._get_test_results(self.reporter.conn)), 0)
+        assert_equal(len(ResultSpool(self.spool_path).pending(self.reporter.build_id)), 1)
+
+    def test_failed_batches_are_rolled_back_and_retried(self):
+        create_row_to_insert = self.reporter._create_row_to_insert
+        failures = []
+
+        def fail_once_after_the_previous_run(conn, result, previous_run_id=None):
+            if previous_run_id is not None and not failures:
+                failures.append(result)
+                raise SA.exc.OperationalError(1, 2, 3)
+            return create_row_to_insert(conn, result, previous_run_id)
+
+        previous_run = TestResult(DummyTestCase().test_pass)
+        previous_run.start()
+        previous_run.end_in_success()
+        result = TestResult(DummyTestCase().test_pass)
+        result.start(previous_run=previous_run.to_dict())
+        result.end_in_success()
+
+        with patch.object(self.reporter, '_create_row_to_insert', side_effect=fail_once_after_the_previous_run):
+            self.reporter.test_complete(result.to_dict())
+            # report() gets the batch in from the spool, so this run is still ok.
+            assert self.reporter.report()
+
+        assert_equal(len(failures), 1)
+        # The previous run inserted before the failure was rolled back, not duplicated.
+        assert_equal(len(self._get_test_results(self.reporter.conn)), 2)
+        assert_equal(ResultSpool(self.spool_path).pending(self.reporter.build_id), [])
+
+    def test_replay_spool(self):
+        db_url = 'sqlite:///%s' % os.path.join(os.path.dirname(self.spool_path), 'db')
+        result = TestResult(DummyTestCase().test_pass)
+        result.start()
+        result.end_in_success()
+        spool = ResultSpool(self.spool_path)
+        spool.append(7, result.to_dict())
+        spool.close()
+
+        (options, _) = self.parse_args(['--reporting-db-url', db_url, '--replay-spool', self.spool_path])
+        assert replay_spool(options)
+
+        conn = SA.create_engine(db_url).connect()
+        (row,) = conn.execute(self.reporter.TestResults.select()).fetchall()
+        assert_equal(row['build'], 7)
+        assert_equal(ResultSpool(self.spool_path).builds(), [])
+
+
+class LRUCacheTestCase(TestCase):
+    def test_least_recently_used_are_forgotten(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        assert_equal(cache.get('a'), 1)
+        cache['c'] = 3
+
+        assert_equal(len(cache), 2)
+        assert_equal(cache.get('b'), None)
+        assert 'a' in cache
+        assert 'c' in cache
+
+
 # vim: set ts=4 sts=4 sw=4 et:
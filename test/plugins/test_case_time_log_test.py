@@ -8,6 +8,7 @@ import six
 
 from testify import compat
 from testify import assert_equal, TestCase
+from testify import test_result
 from testify.test_result import TestResult
 from testify.plugins.test_case_time_log import add_command_line_options, TestCaseJSONReporter
 
@@ -34,12 +35,22 @@ def mock_conf_files():
     with mock.patch.object(six.moves.builtins, 'open', _mock_conf_file_open):
         yield
 
+
+@contextlib.contextmanager
+def mock_clocks(now):
+    """Make both the wall clock and the monotonic clock read `now`."""
+    timestamp = time.mktime(now.timetuple())
+    with mock.patch.object(time, 'time', return_value=timestamp):
+        with mock.patch.object(test_result, '_monotonic_ns', return_value=int(timestamp) * 1000000000):
+            yield
+
+
 start_time = datetime.datetime(2014, 12, 17, 12, 38, 37, 0)
 end_time = datetime.datetime(2014, 12, 17, 15, 38, 37, 0)
 output_str = (
     """{"normalized_run_time": "10800.00s", """
     """"complete": true, "start_time": %s, """
-    """"runner_id": null, "failure": null, "run_time": %s, """
+    """"runner_id": null, "failure": null, "run_time": %s, "run_time_ns": %d, """
     """"previous_run": null, "success": null, "exception_info": null, """
     """"interrupted": null, """
     """"method": {"full_name": "testify.test_case TestCase.run", """
@@ -48,6 +59,7 @@ output_str = (
     """"exception_info_pretty": null, "end_time": %s, "error": null, """
     """"exception_only": ""}\n""" % (time.mktime(start_time.timetuple()),
                                      str(time.mktime(end_time.timetuple()) - time.mktime(start_time.timetuple())),
+                                     (time.mktime(end_time.timetuple()) - time.mktime(start_time.timetuple())) * 1000000000,
                                      time.mktime(end_time.timetuple())))
 
 
@@ -67,11 +79,9 @@ class TestCaseJSONReporterTestCase(TestCase):
             self.reporter = TestCaseJSONReporter(self.options)
             test_case = TestCase()
             fake_test_result = TestResult(test_case.run)
-            with mock.patch.object(
-                datetime, 'datetime', **{'now.return_value': start_time}
-            ):
+            with mock_clocks(start_time):
                 fake_test_result.start()
-            with mock.patch.object(datetime, 'datetime', **{'now.return_value': end_time}):
+            with mock_clocks(end_time):
                 fake_test_result._complete()
             self.reporter.test_case_complete(fake_test_result.to_dict())
             assert_equal(
@@ -8,6 +8,7 @@ from testify import class_teardown
 from testify import let
 from testify import run
 from testify import setup
+from testify import suite
 from testify import teardown
 from testify import TestCase
 from testify.test_case import TestifiedUnitTest
@@ -623,6 +624,51 @@ class NoAttributesNamedTest(TestCase):
         assert_equal(expected_attributes, actual_attributes)
 
 
+class RunnableTestMethodsCacheTest(TestCase):
+    class FakeTestCase(TestCase):
+        def test_one(self):
+            pass
+
+    def runnable_names(self, test_case):
+        return [test_method.__name__ for test_method in test_case.runnable_test_methods()]
+
+    def test_generated_methods_are_picked_up(self):
+        test_case = self.FakeTestCase()
+        assert_equal(self.runnable_names(test_case), ['test_one'])
+
+        def test_two(self):
+            pass
+        test_case._generate_test_method('test_two', test_two)
+        assert_equal(self.runnable_names(test_case), ['test_one', 'test_two'])
+
+    def test_class_changes_are_picked_up(self):
+        class FakeSubTestCase(self.FakeTestCase):
+            pass
+
+        test_case = FakeSubTestCase(suites_exclude=set(['excluded']))
+        assert_equal(self.runnable_names(test_case), ['test_one'])
+
+        def test_three(self):
+            pass
+        FakeSubTestCase.test_three = test_three
+        assert_equal(self.runnable_names(test_case), ['test_one', 'test_three'])
+
+        FakeSubTestCase._suites = set(['excluded'])
+        assert_equal(self.runnable_names(test_case), [])
+
+    def test_suites_added_to_methods_are_picked_up(self):
+        class FakeSubTestCase(self.FakeTestCase):
+            def test_two(self):
+                pass
+
+        test_case = FakeSubTestCase(suites_exclude=set(['excluded']))
+        assert_equal(self.runnable_names(test_case), ['test_one', 'test_two'])
+
+        # As unittest_annotate does, after the runner has already asked for them.
+        suite('excluded')(test_case.test_two.__func__)
+        assert_equal(self.runnable_names(test_case), ['test_one'])
+
+
 if __name__ == '__main__':
     run()
 
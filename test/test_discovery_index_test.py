@@ -0,0 +1,137 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+import mock
+from testify import assert_equal
+from testify import setup_teardown
+from testify import TestCase
+from testify import test_discovery_index
+from testify import test_runner
+
+
+MODULE_TEMPLATE = """
+import testify as T
+
+
+@T.suite('slow')
+class IndexedTestCase(T.TestCase):
+%s
+"""
+
+
+class DiscoveryIndexTestCase(TestCase):
+
+    @setup_teardown
+    def make_test_package(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.package_dir = os.path.join(self.tempdir, 'indexed_package')
+        os.mkdir(self.package_dir)
+        open(os.path.join(self.package_dir, '__init__.py'), 'w').close()
+        self.write_test_module(['test_one'])
+        self.index_path = os.path.join(self.tempdir, 'index.json')
+
+        sys.path.insert(0, self.tempdir)
+        try:
+            yield
+        finally:
+            sys.path.remove(self.tempdir)
+            for module_name in list(sys.modules):
+                if module_name.startswith('indexed_package'):
+                    del sys.modules[module_name]
+            shutil.rmtree(self.tempdir)
+
+    def write_test_module(self, method_names):
+        methods = ''.join(
+            '\n    @T.suite(%r)\n    def %s(self):\n        pass\n' % (method_name + '_suite', method_name)
+            for method_name in method_names
+        )
+        with open(os.path.join(self.package_dir, 'indexed_test.py'), 'w') as f:
+            f.write(MODULE_TEMPLATE % methods)
+        sys.modules.pop('indexed_package.indexed_test', None)
+
+    def discover(self):
+        return test_discovery_index.DiscoveryIndex(self.index_path).discover('indexed_package')
+
+    def test_records_classes_methods_and_suites(self):
+        assert_equal(self.discover(), [{
+            'module': 'indexed_package.indexed_test',
+            'class': 'IndexedTestCase',
+            'methods': {'test_one': ['slow', 'test_one_suite']},
+            'class_fixtures': False,
+        }])
+
+    def test_unchanged_modules_are_not_imported(self):
+        expected = self.discover()
+        sys.modules.pop('indexed_package.indexed_test')
+
+        with mock.patch.object(test_discovery_index.DiscoveryIndex, '_index_module') as index_module_mock:
+            assert_equal(self.discover(), expected)
+
+        assert not index_module_mock.called
+        assert 'indexed_package.indexed_test' not in sys.modules
+
+    def test_changed_modules_are_reindexed(self):
+        self.discover()
+        self.write_test_module(['test_one', 'test_two'])
+
+        (manifest,) = self.discover()
+        assert_equal(sorted(manifest['methods']), ['test_one', 'test_two'])
+
+    def test_runner_lists_tests_from_index(self):
+        runner = test_runner.TestRunner(
+            'indexed_package',
+            discovery_index=self.index_path,
+            suites_exclude=['test_two_suite'],
+        )
+        self.write_test_module(['test_one', 'test_two'])
+
+        with mock.patch('testify.test_runner.print', create=True):
+            assert_equal(
+                runner.list_tests(),
+                ['indexed_package.indexed_test IndexedTestCase.test_one'],
+            )
+
+    def test_plugins_which_add_testcase_info_bypass_the_index(self):
+        def uses_discovery_index(**hooks):
+            plugin_mod = types.ModuleType('plugin')
+            plugin_mod.__dict__.update(hooks)
+            return test_runner.TestRunner(
+                'indexed_package',
+                discovery_index=self.index_path,
+                plugin_modules=[plugin_mod],
+            ).uses_discovery_index()
+
+        def add_testcase_info(test_case, runner):
+            pass
+
+        assert not uses_discovery_index(add_testcase_info=add_testcase_info)
+        assert not uses_discovery_index(add_testcase_info=add_testcase_info, adds_testcase_info=lambda runner: True)
+        assert uses_discovery_index(add_testcase_info=add_testcase_info, adds_testcase_info=lambda runner: False)
+        assert uses_discovery_index(prepare_test_runner=lambda options, runner: None)
+
+    def test_buckets_only_import_their_own_modules(self):
+        with open(os.path.join(self.package_dir, 'other_test.py'), 'w') as f:
+            f.write(MODULE_TEMPLATE.replace('IndexedTestCase', 'OtherTestCase') % '\n    def test_other(self):\n        pass\n')
+        self.discover()
+        for module_name in ('indexed_package.indexed_test', 'indexed_package.other_test'):
+            sys.modules.pop(module_name)
+
+        discovered = []
+        for bucket in range(2):
+            runner = test_runner.TestRunner(
+                'indexed_package',
+                bucket=bucket,
+                bucket_count=2,
+                discovery_index=self.index_path,
+            )
+            (test_case,) = runner.discover()
+            discovered.append(type(test_case).__name__)
+
+            imported = [name for name in sys.modules if name in ('indexed_package.indexed_test', 'indexed_package.other_test')]
+            assert_equal(imported, [type(test_case).__module__])
+            sys.modules.pop(type(test_case).__module__)
+
+        assert_equal(sorted(discovered), ['IndexedTestCase', 'OtherTestCase'])
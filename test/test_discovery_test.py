@@ -1,5 +1,7 @@
 from os.path import abspath
 
+import mock
+from testify import assert_equal
 from testify import assert_length
 from testify import assert_raises
 from testify import run
@@ -56,6 +58,21 @@ class ImportTestClassCase(DiscoveryTestCase):
         assert_raises(test_discovery.DiscoveryError, self.discover, 'bad.subdir', 'DummyTestCase')
         assert_raises(test_discovery.DiscoveryError, self.discover, 'test.test_suite_subdir.define_testcase', 'IGNORE ME')
 
+    def test_classes_are_looked_up_by_name_and_cached(self):
+        with mock.patch.dict(test_discovery._test_class_cache, clear=True):
+            with mock.patch.object(test_discovery, 'discover') as discover:
+                testify_case = self.discover('test.test_suite_subdir.define_testcase', 'DummyTestCase')
+                unittest_case = self.discover('test.test_suite_subdir.define_unittestcase', 'TestifiedDummyUnitTestCase')
+                assert_equal(discover.call_count, 0)
+
+            assert_equal(testify_case.__name__, 'DummyTestCase')
+            assert_equal(unittest_case.__name__, 'TestifiedDummyUnitTestCase')
+            assert self.discover('test.test_suite_subdir.define_unittestcase', 'TestifiedDummyUnitTestCase') is unittest_case
+
+    def test_packages_are_discovered(self):
+        with mock.patch.dict(test_discovery._test_class_cache, clear=True):
+            assert self.discover('test.test_suite_subdir', 'DummyTestCase')
+
 
 if __name__ == '__main__':
     run()
@@ -1,5 +1,7 @@
 import itertools
+import sys
 
+import mock
 from testify import assert_equal
 from testify import assert_not_equal
 from testify import class_setup
@@ -11,6 +13,7 @@ from testify import setup_teardown
 from testify import suite
 from testify import teardown
 from testify import TestCase
+from testify.test_fixtures import TestFixtures
 
 
 class FixtureMethodRegistrationOrderTest(TestCase):
@@ -494,4 +497,95 @@ class SuiteDecoratorTest(TestCase):
             "suites decorator modifies the object's _suite attribute"
         )
 
+
+class FixturePlanCachingTest(TestCase):
+
+    class FakeTestCase(TestCase):
+        @setup
+        def record_setup(self):
+            self.ran.append(('setup', self))
+
+        @teardown
+        def record_teardown(self):
+            self.ran.append(('teardown', self))
+
+        def test_nothing(self):
+            pass
+
+    def test_plan_is_computed_once_per_class(self):
+        with mock.patch.object(TestFixtures, 'plan_for', wraps=TestFixtures.plan_for) as plan_for:
+            class PlannedTestCase(self.FakeTestCase):
+                pass
+
+            first, second = PlannedTestCase(), PlannedTestCase()
+            assert_equal(plan_for.call_count, 1)
+
+        for test_case in (first, second):
+            test_case.ran = []
+            test_case.run()
+            assert_equal(test_case.ran, [('setup', test_case), ('teardown', test_case)])
+
+    def test_class_changes_invalidate_the_plan(self):
+        class PlannedTestCase(self.FakeTestCase):
+            pass
+
+        def extra_setup(self):
+            self.ran.append(('extra setup', self))
+        PlannedTestCase.extra_setup = setup(extra_setup)
+
+        test_case = PlannedTestCase()
+        test_case.ran = []
+        test_case.run()
+        assert_equal(
+            test_case.ran,
+            [('setup', test_case), ('extra setup', test_case), ('teardown', test_case)],
+        )
+
+    def test_has_class_fixtures(self):
+        class ClassTeardownTestCase(self.FakeTestCase):
+            @class_teardown
+            def clean_up(self):
+                pass
+
+        class ClassSetUpTestCase(self.FakeTestCase):
+            def classSetUp(self):
+                pass
+
+        assert_equal(self.FakeTestCase._has_class_fixtures(), False)
+        assert_equal(ClassTeardownTestCase._has_class_fixtures(), True)
+        assert_equal(ClassSetUpTestCase._has_class_fixtures(), True)
+
+
+class DeepFixtureStackTest(TestCase):
+    """Fixtures are entered without recursing, so a fixture list deeper than
+    the recursion limit still runs in order."""
+
+    def test_many_setup_teardowns(self):
+        fixture_count = sys.getrecursionlimit()
+        ran = []
+
+        def make_fixture(i):
+            def fixture(self):
+                ran.append(('enter', i))
+                yield
+                ran.append(('exit', i))
+            fixture.__name__ = 'fixture_%d' % i
+            return setup_teardown(fixture)
+
+        def test_nothing(self):
+            ran.append('test')
+
+        members = dict(('fixture_%d' % i, make_fixture(i)) for i in range(fixture_count))
+        members['test_nothing'] = test_nothing
+        DeepTestCase = type(TestCase)('DeepTestCase', (TestCase,), members)
+
+        test_case = DeepTestCase()
+        test_case.run()
+
+        assert_equal([result.success for result in test_case.results()], [True])
+        assert_equal(
+            ran,
+            [('enter', i) for i in range(fixture_count)] + ['test'] + [('exit', i) for i in reversed(range(fixture_count))],
+        )
+
 # vim: set ts=4 sts=4 sw=4 et:
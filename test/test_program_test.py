@@ -4,6 +4,11 @@ import subprocess
 import tempfile
 from os.path import join, exists
 
+try:
+    import simplejson as json  # noqa
+except ImportError:
+    import json
+
 import mock
 from testify import setup_teardown, TestCase, test_program
 from testify.assertions import assert_equal, assert_raises, assert_in
@@ -65,6 +70,43 @@ class ParseTestRunnerCommandLineArgsTest(TestCase):
             test_program.parse_test_runner_command_line_args([], [])
 
 
+class GetBucketTimingsTest(TestCase):
+    @setup_teardown
+    def make_results_file(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.results_file = join(self.tempdir, 'results.json')
+        yield
+        shutil.rmtree(self.tempdir)
+
+    def write_results(self, *results):
+        with open(self.results_file, 'w') as f:
+            for module, class_name, method_name, run_time in results:
+                f.write(json.dumps({
+                    'method': {'module': module, 'class': class_name, 'name': method_name},
+                    'run_time': run_time,
+                }))
+                f.write('\n')
+            f.write('RUN COMPLETE\n')
+
+    def test_method_results_are_summed_per_class(self):
+        self.write_results(
+            ('mod', 'FooTestCase', 'test_one', 1.5),
+            ('mod', 'FooTestCase', 'test_two', 2.0),
+            ('mod', 'BarTestCase', 'test_one', 0.5),
+        )
+        assert_equal(
+            test_program.get_bucket_timings([self.results_file]),
+            {'mod.FooTestCase': 3.5, 'mod.BarTestCase': 0.5},
+        )
+
+    def test_test_case_results_are_used_as_is(self):
+        self.write_results(
+            ('mod', 'FooTestCase', 'test_one', 1.5),
+            ('mod', 'FooTestCase', 'run', 10.0),
+        )
+        assert_equal(test_program.get_bucket_timings([self.results_file]), {'mod.FooTestCase': 10.0})
+
+
 def test_call(command):
     proc = subprocess.Popen(command, stdout=subprocess.PIPE)
     stdout, stderr = proc.communicate()
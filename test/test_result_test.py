@@ -105,6 +105,54 @@ class TestResultTestCase(TestCase):
             )
         )
 
+    @mock.patch('traceback.format_exception', wraps=fake_format_exception)
+    def test_formatting_is_cached_until_exceptions_change(self, mock_format_exception):
+        self._append_exc_info(ValueError)
+        assert_equal(self.test_result.format_exception_info(), 'Traceback: ValueError\n')
+        assert_equal(self.test_result.format_exception_info(), 'Traceback: ValueError\n')
+        assert_equal(mock_format_exception.call_count, 1)
+
+        self._append_exc_info(KeyError)
+        assert_equal(
+            self.test_result.format_exception_info().split('\n')[-2],
+            'Traceback: KeyError',
+        )
+        assert_equal(mock_format_exception.call_count, 3)
+
+
+class TestResultTimingTest(TestCase):
+
+    def test_run_time_is_monotonic_and_timestamps_are_precise(self):
+        result = TestResult(mock.Mock(__name__='test_name'))
+        with mock.patch('time.time', return_value=1000.25):
+            with mock.patch('testify.test_result._monotonic_ns', return_value=5000000000):
+                result.start()
+
+        # The wall clock went backwards, but 1.5s passed.
+        with mock.patch('time.time', return_value=999.75):
+            with mock.patch('testify.test_result._monotonic_ns', return_value=6500000000):
+                result.end_in_success()
+
+        assert_equal(result.start_timestamp, 1000.25)
+        assert_equal(result.end_timestamp, 999.75)
+        assert_equal(result.run_time_ns, 1500000000)
+        assert_equal(result.run_time.total_seconds(), 1.5)
+
+    def test_to_dict_carries_the_precise_timings(self):
+        result = TestResult(TestCase().run)
+        with mock.patch('time.time', return_value=1000.25):
+            with mock.patch('testify.test_result._monotonic_ns', return_value=5000000000):
+                result.start()
+        with mock.patch('time.time', return_value=1000.5):
+            with mock.patch('testify.test_result._monotonic_ns', return_value=5000000123):
+                result.end_in_success()
+
+        result_dict = result.to_dict()
+        assert_equal(result_dict['start_time'], 1000.25)
+        assert_equal(result_dict['end_time'], 1000.5)
+        assert_equal(result_dict['run_time_ns'], 123)
+        assert_equal(result_dict['run_time'], 0.000000123)
+
 
 class TestResultStateTest(TestCase):
     """Make sure we don't have a test_result outside of a running test."""
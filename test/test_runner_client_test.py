@@ -1,5 +1,13 @@
-import testify
+import threading
+
+import mock
+import six
 
+import testify
+from testify import assert_equal
+from testify import assert_in
+from testify import test_runner_client
+from testify import test_runner_wire
 from testify.test_runner_client import TestRunnerClient
 
 
@@ -12,14 +20,14 @@ class ClientDiscoveryTestCase(testify.TestCase):
             None,
             connect_addr=None,
             runner_id=None,
-            options=testify.turtle.Turtle(),
+            options=testify.turtle.Turtle(heartbeat_interval=None),
         )
 
     def discover(self, class_path):
         def foo(*args, **kwargs):
-            return class_path, 'test_foo', True
+            return [(class_path, 'test_foo')], True
 
-        self.client.get_next_tests = foo
+        self.client.get_next_test_batch = foo
         return [x for x in self.client.discover()]
 
     def test_discover_testify_case(self):
@@ -27,3 +35,151 @@ class ClientDiscoveryTestCase(testify.TestCase):
 
     def test_discover_unittest_case(self):
         assert self.discover('test.test_suite_subdir.define_unittestcase TestifiedDummyUnitTestCase')
+
+
+class ClientBatchTestCase(testify.TestCase):
+    """TestRunnerClient asks the server for batches of tests."""
+
+    @testify.setup
+    def init_test_runner_client(self):
+        self.client = TestRunnerClient(
+            None,
+            connect_addr='localhost:9000',
+            runner_id='runner1',
+            options=testify.turtle.Turtle(revision=None, batch_size=5, batch_seconds=None),
+        )
+
+    def get_next_test_batch(self, response, prefetch=False, content_type='application/json', compress=False):
+        body, headers = test_runner_wire.encode(response, content_type, compress=compress)
+        with mock.patch.object(six.moves.urllib.request, 'urlopen') as urlopen:
+            urlopen.return_value.read.return_value = body
+            urlopen.return_value.info.return_value = headers
+            batch = self.client.get_next_test_batch(retry_interval=0, retry_limit=0, prefetch=prefetch)
+        (request,), _ = urlopen.call_args
+        return request, batch
+
+    def test_batches(self):
+        request, batch = self.get_next_test_batch({
+            'class': 'module Class1',
+            'methods': ['test_a', 'run'],
+            'classes': [
+                {'class': 'module Class1', 'methods': ['test_a', 'run']},
+                {'class': 'module Class2', 'methods': ['test_b', 'run']},
+            ],
+            'finished': False,
+        })
+        assert_in('count=5', request.get_full_url())
+        assert_equal(batch, ([('module Class1', ['test_a', 'run']), ('module Class2', ['test_b', 'run'])], False))
+
+    def test_prefetch(self):
+        request, _ = self.get_next_test_batch({'finished': True}, prefetch=True)
+        assert_in('prefetch=1', request.get_full_url())
+
+    def test_compressed_responses(self):
+        response = {
+            'classes': [{'class': 'module Class%d' % i, 'methods': ['test_a', 'run']} for i in range(100)],
+            'finished': False,
+        }
+        request, batch = self.get_next_test_batch(response, compress=True)
+        assert_equal(request.get_header('Accept-encoding'), 'deflate')
+        assert_equal(len(batch[0]), 100)
+
+    def test_older_servers(self):
+        _, batch = self.get_next_test_batch({'class': 'module Class1', 'methods': ['test_a', 'run'], 'finished': False})
+        assert_equal(batch, ([('module Class1', ['test_a', 'run'])], False))
+
+        _, batch = self.get_next_test_batch({'finished': True})
+        assert_equal(batch, ([], True))
+
+
+class ClientHeartbeatTestCase(testify.TestCase):
+    """TestRunnerClient tells the server it's alive while running tests."""
+
+    @testify.setup
+    def init_test_runner_client(self):
+        self.client = TestRunnerClient(
+            None,
+            connect_addr='localhost:9000',
+            runner_id='runner1',
+            options=testify.turtle.Turtle(revision=None, heartbeat_interval=0.01),
+        )
+
+    def test_send_heartbeats(self):
+        stop = threading.Event()
+        broken_connection = mock.Mock(request=mock.Mock(side_effect=six.moves.http_client.HTTPException('nope')))
+        connection = mock.Mock()
+        # Stop after the second heartbeat, even though the first one failed.
+        connection.getresponse.return_value.read.side_effect = stop.set
+        with mock.patch.object(test_runner_client, '_HeartbeatConnection', side_effect=[broken_connection, connection]):
+            self.client.send_heartbeats(stop)
+
+        assert broken_connection.close.called
+        connection.request.assert_called_once_with('POST', '/heartbeat?runner=runner1', b'')
+        assert connection.close.called
+
+    def test_discover_stops_heartbeats(self):
+        stop = threading.Event()
+        self.client.start_heartbeats = lambda: stop
+        self.client.get_next_test_batch = lambda *args, **kwargs: ([], True)
+
+        assert_equal(list(self.client.discover()), [])
+        assert stop.is_set()
+
+
+class ClientPrefetchTestCase(testify.TestCase):
+    """TestRunnerClient checks out the next tests while it runs the last ones it has."""
+
+    @testify.setup
+    def init_test_runner_client(self):
+        self.client = TestRunnerClient(
+            None,
+            connect_addr='localhost:9000',
+            runner_id='runner1',
+            options=testify.turtle.Turtle(
+                heartbeat_interval=None,
+                prefetch=True,
+                prefetch_imports=False,
+                retry_limit=0,
+                reconnect_retry_limit=0,
+                retry_interval=0,
+            ),
+        )
+
+    def test_discover_prefetches(self):
+        class_path = 'test.test_suite_subdir.define_testcase DummyTestCase'
+        batches = [
+            ([(class_path, ['test_foo'])], False),
+            ([(class_path, ['test_foo']), (class_path, ['test_foo'])], False),
+            ([(class_path, ['test_foo'])], True),
+        ]
+        requests = []
+        prefetched = threading.Semaphore(0)
+
+        def get_next_test_batch(retry_interval, retry_limit, prefetch=False):
+            requests.append(prefetch)
+            if prefetch:
+                prefetched.release()
+            return batches.pop(0)
+        self.client.get_next_test_batch = get_next_test_batch
+
+        discovered = self.client.discover()
+        next(discovered)
+        prefetched.acquire()
+        assert_equal(requests, [False, True])
+        next(discovered)
+        # Not prefetched until we get to the last class of the batch.
+        assert_equal(requests, [False, True])
+        next(discovered)
+        prefetched.acquire()
+        assert_equal(requests, [False, True, True])
+        assert_equal(len(list(discovered)), 1)
+        assert_equal(requests, [False, True, True])
+
+    def test_failed_prefetch_ends_discovery(self):
+        def get_next_test_batch(retry_interval, retry_limit, prefetch=False):
+            if prefetch:
+                raise ValueError('bad response')
+            return [('test.test_suite_subdir.define_testcase DummyTestCase', ['test_foo'])], False
+        self.client.get_next_test_batch = get_next_test_batch
+
+        assert_equal(len(list(self.client.discover())), 1)
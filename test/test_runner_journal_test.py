@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+
+from testify import assert_equal
+from testify import setup_teardown
+from testify import TestCase
+from testify import test_runner_journal
+
+
+def result(method, success=True):
+    return {'method': {'module': 'module', 'class': 'Class', 'name': method}, 'success': success}
+
+
+class ServerJournalTestCase(TestCase):
+
+    @setup_teardown
+    def make_tempdir(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'journal')
+        try:
+            yield
+        finally:
+            shutil.rmtree(self.tempdir)
+
+    def record_check_in(self, journal, *methods):
+        journal.record_check_in(
+            'module Class',
+            'runner1',
+            reported=[result(method) for method in methods],
+            failed=[result('test_failed', success=False)],
+            timed_out=[],
+            failure_count=1,
+        )
+
+    def test_resume(self):
+        journal = test_runner_journal.ServerJournal(self.path)
+        self.record_check_in(journal, 'test_a')
+        journal.close()
+
+        journal = test_runner_journal.ServerJournal(self.path, resume=True)
+        self.record_check_in(journal, 'test_b')
+        journal.close()
+
+        events = test_runner_journal.ServerJournal(self.path, resume=True).events
+        assert_equal(
+            [[reported['method']['name'] for reported in event['reported']] for event in events],
+            [['test_a'], ['test_b']],
+        )
+        assert_equal(events[0]['failed'], [result('test_failed', success=False)])
+        assert_equal(events[0]['runner'], 'runner1')
+        assert_equal(events[0]['failure_count'], 1)
+
+    def test_without_resume_starts_over(self):
+        journal = test_runner_journal.ServerJournal(self.path)
+        self.record_check_in(journal, 'test_a')
+        journal.close()
+
+        test_runner_journal.ServerJournal(self.path).close()
+        assert_equal(test_runner_journal.ServerJournal(self.path, resume=True).events, [])
+
+    def test_half_written_lines_are_skipped(self):
+        journal = test_runner_journal.ServerJournal(self.path)
+        self.record_check_in(journal, 'test_a')
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"class_path": "module Cla')
+
+        assert_equal(len(test_runner_journal.ServerJournal(self.path, resume=True).events), 1)
+
+    def test_check_ins_after_a_half_written_line_are_kept(self):
+        journal = test_runner_journal.ServerJournal(self.path)
+        self.record_check_in(journal, 'test_a')
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"class_path": "module Cla')
+
+        journal = test_runner_journal.ServerJournal(self.path, resume=True)
+        self.record_check_in(journal, 'test_b')
+        journal.close()
+
+        events = test_runner_journal.ServerJournal(self.path, resume=True).events
+        assert_equal([event['reported'][0]['method']['name'] for event in events], ['test_a', 'test_b'])
+
+    def test_other_versions_are_ignored(self):
+        with open(self.path, 'w') as f:
+            f.write('{"version": 0}\n{"class_path": "module Class"}\n')
+
+        journal = test_runner_journal.ServerJournal(self.path, resume=True)
+        assert_equal(journal.events, [])
+        journal.close()
+
+        with open(self.path) as f:
+            assert_equal(f.read(), '{"version": %d}\n' % test_runner_journal.JOURNAL_VERSION)
@@ -0,0 +1,75 @@
+from testify import assert_equal
+from testify import class_setup
+from testify import setup
+from testify import test_case
+from testify import test_reporter
+from testify.test_runner_multiprocess import TestRunnerMultiprocess
+from testify.utils import turtle
+
+
+class RecordingReporter(test_reporter.TestReporter):
+    def __init__(self, *args, **kwargs):
+        super(RecordingReporter, self).__init__(*args, **kwargs)
+        self.completed = []
+        self.counts = None
+
+    def test_counts(self, test_case_count, test_method_count):
+        self.counts = (test_case_count, test_method_count)
+
+    def test_complete(self, result):
+        self.completed.append((result['method']['class'], result['method']['name'], result['success']))
+
+
+class TestRunnerMultiprocessTestCase(test_case.TestCase):
+
+    @setup
+    def build_reporter(self):
+        self.reporter = RecordingReporter(turtle.Turtle())
+
+    def test_results_are_reported_in_parent(self):
+        runner = TestRunnerMultiprocess(
+            'test.test_runner_bucketing.bucketing_test',
+            workers=2,
+            test_reporters=[self.reporter],
+        )
+
+        assert runner.run()
+        assert_equal(self.reporter.counts, (4, 21))
+        assert_equal(len(self.reporter.completed), 21)
+        assert all(success for _, _, success in self.reporter.completed)
+
+    def test_failures_are_counted_in_parent(self):
+        class FailingTestCase(test_case.TestCase):
+            @class_setup
+            def count_class_setups(self_):
+                self_.class_setup_count = getattr(self_, 'class_setup_count', 0) + 1
+
+            def test_fails(self_):
+                assert False
+
+            def test_class_setup_ran_once(self_):
+                assert_equal(self_.class_setup_count, 1)
+
+        runner = TestRunnerMultiprocess(FailingTestCase, workers=2, test_reporters=[self.reporter])
+        runner.run()
+
+        assert_equal(runner.failure_count, 1)
+        assert_equal(
+            sorted(self.reporter.completed),
+            [
+                ('FailingTestCase', 'test_class_setup_ran_once', True),
+                ('FailingTestCase', 'test_fails', False),
+            ],
+        )
+
+    def test_failure_limit_stops_handing_out_test_cases(self):
+        runner = TestRunnerMultiprocess(
+            'test.lots_of_fail',
+            workers=1,
+            failure_limit=3,
+            test_reporters=[self.reporter],
+        )
+        runner.run()
+
+        assert_equal(runner.failure_count, 3)
+        assert_equal(len(self.reporter.completed), 3)
@@ -3,6 +3,7 @@ from __future__ import print_function
 import contextlib
 import logging
 import threading
+import time
 
 import mock
 import tornado.ioloop
@@ -51,6 +52,26 @@ def get_test(server, runner_id):
     return test_received
 
 
+def get_test_batch(server, runner_id, count=1, budget=None, prefetch=False):
+    """Like get_test, but for a batch of tests."""
+    sem = threading.Semaphore(0)
+    batches_received = []
+
+    def inner(test_dicts):
+        batches_received.append(test_dicts)
+        sem.release()
+
+    def inner_empty():
+        batches_received.append(None)
+        sem.release()
+
+    server.get_next_test_batch(runner_id, inner, inner_empty, count=count, budget=budget, prefetch=prefetch)
+    sem.acquire()
+
+    (batch_received,) = batches_received
+    return batch_received
+
+
 @contextlib.contextmanager
 def disable_requeueing(server):
     orig_disable_requeueing = server.disable_requeueing
@@ -97,6 +118,27 @@ class TestRunnerServerBaseTestCase(test_case.TestCase):
         return seen_methods
 
     def start_server(self, test_reporters=None, failure_limit=None):
+        self.make_server(test_reporters=test_reporters, failure_limit=failure_limit)
+        # A server which is shut down before its IOLoop starts never stops,
+        # so wait for the IOLoop (or for the server to die without one).
+        started = threading.Event()
+
+        def catch_exceptions_in_thread():
+            try:
+                self.server.run()
+            except (Exception, SystemExit) as exc:
+                _log.error("Thread threw exception: %r" % exc)
+                raise
+            finally:
+                started.set()
+
+        self.thread = threading.Thread(None, catch_exceptions_in_thread)
+        self.thread.start()
+        tornado.ioloop.IOLoop.instance().add_callback(started.set)
+        started.wait()
+
+    def make_server(self, test_reporters=None, failure_limit=None):
+        """Make self.server, without running it."""
         if test_reporters is None:
             self.test_reporter = turtle.Turtle()
             test_reporters = [self.test_reporter]
@@ -105,6 +147,11 @@ class TestRunnerServerBaseTestCase(test_case.TestCase):
             self.dummy_test_case,
             options=mock.Mock(
                 disable_requeueing=False,
+                disable_speculation=True,
+                heartbeat_timeout=10,
+                journal=None,
+                reporting_queue_size=0,
+                resume=False,
                 runner_timeout=1,
                 server_timeout=10,
                 revision=None,
@@ -117,16 +164,6 @@ class TestRunnerServerBaseTestCase(test_case.TestCase):
             failure_limit=failure_limit,
         )
 
-        def catch_exceptions_in_thread():
-            try:
-                self.server.run()
-            except (Exception, SystemExit) as exc:
-                _log.error("Thread threw exception: %r" % exc)
-                raise
-
-        self.thread = threading.Thread(None, catch_exceptions_in_thread)
-        self.thread.start()
-
     def stop_server(self):
         self.server.shutdown()
         self.thread.join()
@@ -351,6 +388,97 @@ class TestRunnerServerTestCase(TestRunnerServerBaseTestCase):
         if failures:
             raise Exception(' '.join(failures))
 
+    def add_extra_tests(self, run_time):
+        for class_name in ('Extra1', 'Extra2'):
+            class_path = 'test.fake_module %s' % class_name
+            self.server.method_run_times[class_path] = run_time
+            self.server.pair_queue.add_test(0, {'class_path': class_path, 'methods': ['test_thing', 'run']})
+
+    def test_get_next_test_batch_checks_out_each_test(self):
+        self.add_extra_tests(10)
+
+        test_dicts = get_test_batch(self.server, 'runner1', count=2)
+
+        assert_equal(
+            [test_dict['class_path'] for test_dict in test_dicts],
+            ['%s %s' % (self.dummy_test_case.__module__, self.dummy_test_case.__name__), 'test.fake_module Extra1'],
+        )
+        first, second = [self.server.checked_out[test_dict['class_path']] for test_dict in test_dicts]
+        assert_equal(first['runner'], 'runner1')
+        assert_equal(second['runner'], 'runner1')
+        # The second test's timeout allows for running the first one.
+        assert second['timeout_time'] - first['timeout_time'] >= self.server.estimate_test_run_time(test_dicts[0])
+        assert_equal(self.server.pair_queue.empty(), False)
+
+    def test_get_next_test_batch_respects_budget(self):
+        self.add_extra_tests(10)
+
+        test_dicts = get_test_batch(self.server, 'runner1', count=None, budget=5)
+
+        assert_equal(len(test_dicts), 1)
+        assert_equal(len(self.server.checked_out), 1)
+
+    def test_prefetched_tests_wait_for_the_runner(self):
+        class_path = 'test.fake_module Prefetched'
+        self.server.pair_queue.add_test(0, {'class_path': class_path, 'methods': ['test_a', 'run']})
+
+        first_test = get_test(self.server, 'runner1')
+        (prefetched_test,) = get_test_batch(self.server, 'runner1', prefetch=True)
+        assert_equal(prefetched_test['class_path'], class_path)
+        prefetched = self.server.checked_out[class_path]
+        assert_equal(prefetched['leases']['runner1']['started'], False)
+
+        # While runner1 reports results for the class it's running, the one
+        # it's prefetched doesn't time out.
+        prefetched['timeout_time'] = 0
+        self.run_test('runner1')
+        assert first_test['class_path'] not in self.server.checked_out
+        assert prefetched['timeout_time'] > time.time()
+
+        result = dict(self.server._fake_result(class_path, 'test_a', 'runner1'), success=True)
+        self.server.report_result('runner1', result)
+        assert_equal(prefetched['leases']['runner1']['started'], True)
+
+    def test_report_results_is_atomic_per_class(self):
+        self.add_extra_tests(1)
+        get_test_batch(self.server, 'runner1', count=2)
+
+        def make_fake_result(test_case_instance, method):
+            result = test_result.TestResult(getattr(test_case_instance, method))
+            result.start()
+            result.end_in_success()
+            return result.to_dict()
+
+        good = make_fake_result(self.test_case_instance, 'test')
+        bad = make_fake_result(self.test_case_instance, 'test')
+        bad['method']['class'] = 'Extra1'
+        bad['method']['module'] = 'test.fake_module'
+        bad['method']['name'] = 'test_not_checked_out'
+        thing = dict(bad, method=dict(bad['method'], name='test_thing'))
+
+        rejected = self.server.report_results('runner1', [good, thing, bad])
+
+        assert_equal(rejected, [{
+            'class_path': 'test.fake_module Extra1',
+            'reason': 'Method test_not_checked_out not checked out by runner runner1.',
+        }])
+        dummy_class_path = '%s %s' % (self.dummy_test_case.__module__, self.dummy_test_case.__name__)
+        assert_equal(list(self.server.checked_out[dummy_class_path]['passed_methods']), ['test'])
+        # test_thing arrived alongside a bad result for its class, so it wasn't recorded either.
+        extra = self.server.checked_out['test.fake_module Extra1']
+        assert_equal(extra['passed_methods'], {})
+        assert_equal(extra['methods'], set(['test_thing', 'run']))
+
+    def test_runners_told_to_finish_are_not_waited_for(self):
+        self.server.results_posted('runner1')
+        assert_equal(self.server.runners_outstanding, set(['runner1']))
+
+        # runner1 prefetched, and heard there's nothing left...
+        self.server.runner_finished('runner1')
+        # ...but is still reporting results for the class it was running.
+        self.server.results_posted('runner1')
+        assert_equal(self.server.runners_outstanding, set())
+
     def test_activity_on_method_results(self):
         """Previously, the server was not resetting last_activity_time when a client posted results.
         This could lead to an issue when the last client still running tests takes longer than the
@@ -399,6 +527,189 @@ class TestRunnerServerTestCase(TestRunnerServerBaseTestCase):
         assert_equal(fake_result, real_result)
 
 
+class TestRunnerServerSpeculationTestCase(TestRunnerServerBaseTestCase):
+    @setup
+    def enable_speculation(self):
+        self.server.disable_speculation = False
+
+    def report(self, runner_id, class_path, method):
+        result = dict(self.server._fake_result(class_path, method, runner_id), success=True)
+        self.server.report_result(runner_id, result)
+
+    def test_stragglers_are_copied_to_idle_runners(self):
+        with mock.patch.multiple(test_runner_server, STRAGGLER_FACTOR=0, STRAGGLER_MIN_SECONDS=0):
+            first_test = get_test(self.server, 'runner1')
+            second_test = get_test(self.server, 'runner2')
+
+        assert_equal(second_test['class_path'], first_test['class_path'])
+        assert_equal(second_test['methods'], ['test', 'run'])
+
+        self.run_test('runner2')
+        assert_equal(self.server.checked_out, {})
+
+        # runner1's results arrive too late, and are quietly dropped.
+        self.run_test('runner1')
+        assert_equal(
+            sorted(call[0][0]['method']['name'] for call in self.test_reporter.test_complete.calls),
+            ['classTearDown', 'run', 'test'],
+        )
+
+    def test_prefetching_runners_are_not_given_copies(self):
+        with mock.patch.multiple(test_runner_server, STRAGGLER_FACTOR=0, STRAGGLER_MIN_SECONDS=0):
+            test = get_test(self.server, 'runner1')
+            # runner2 is still busy, and only wants to know what to run next.
+            handed_out = []
+            self.server.get_next_test('runner2', handed_out.append, lambda: None, prefetch=True)
+            self.server.speculate()
+
+        assert_equal(handed_out, [])
+        assert_equal(list(self.server.checked_out[test['class_path']]['leases']), ['runner1'])
+
+    def test_classes_without_class_fixtures_are_split(self):
+        class_path = 'test.fake_module SplittableTestCase'
+        self.server.splittable_classes.add(class_path)
+        self.server.pair_queue.add_test(0, {'class_path': class_path, 'methods': ['test_a', 'test_b', 'test_c', 'run']})
+
+        with mock.patch.object(test_runner_server, 'SPLIT_MIN_SECONDS', 0):
+            get_test_batch(self.server, 'runner1', count=2)
+            split_test = get_test(self.server, 'runner2')
+
+        assert_equal(split_test, {'last_runner': 'runner1', 'class_path': class_path, 'methods': ['test_c', 'run']})
+        assert_equal(self.server.checked_out[class_path]['leases']['runner1']['methods'], ['test_a', 'test_b'])
+
+        self.report('runner2', class_path, 'test_c')
+        self.report('runner2', class_path, 'run')
+        self.report('runner1', class_path, 'test_a')
+        self.report('runner1', class_path, 'test_b')
+        assert class_path not in self.server.checked_out
+
+        # runner1 still runs test_c, which it doesn't know runner2 took.
+        self.report('runner1', class_path, 'test_c')
+        self.report('runner1', class_path, 'run')
+
+    def test_the_next_method_of_a_batched_class_is_not_split(self):
+        class_path = 'test.fake_module SplittableTestCase'
+        self.server.splittable_classes.add(class_path)
+        self.server.pair_queue.add_test(0, {'class_path': class_path, 'methods': ['test_a', 'run']})
+
+        with mock.patch.object(test_runner_server, 'SPLIT_MIN_SECONDS', 0):
+            # SplittableTestCase comes after the server's own test case in
+            # runner1's batch, so there are no results for it yet, but
+            # runner1 may already be running test_a.
+            get_test_batch(self.server, 'runner1', count=2)
+            handed_out = []
+            self.server.get_next_test('runner2', handed_out.append, lambda: None)
+            self.server.speculate()
+
+        assert_equal(handed_out, [])
+        assert_equal(list(self.server.checked_out[class_path]['leases']), ['runner1'])
+
+    def test_classes_with_class_fixtures_are_not_split(self):
+        class_path = 'test.fake_module UnsplittableTestCase'
+        self.server.pair_queue.add_test(0, {'class_path': class_path, 'methods': ['test_a', 'test_b', 'test_c', 'run']})
+
+        with mock.patch.object(test_runner_server, 'SPLIT_MIN_SECONDS', 0):
+            get_test_batch(self.server, 'runner1', count=2)
+            self.server.speculate()
+
+        assert_equal(list(self.server.checked_out[class_path]['leases']), ['runner1'])
+
+
+class TestRunnerServerHeartbeatTestCase(TestRunnerServerBaseTestCase):
+    def test_dead_runners_tests_are_requeued(self):
+        first_test = get_test(self.server, 'runner1')
+        self.server.heartbeat('runner1')
+        self.server.heartbeat_times['runner1'] -= 60
+        self.server.check_heartbeats()
+
+        assert_equal(self.server.checked_out, {})
+        second_test = get_test(self.server, 'runner2')
+        assert_equal(second_test['class_path'], first_test['class_path'])
+        assert_equal(set(second_test['methods']), set(first_test['methods']))
+
+    def test_live_runners_keep_their_tests(self):
+        test = get_test(self.server, 'runner1')
+        self.server.heartbeat('runner1')
+        self.server.check_heartbeats()
+
+        assert_in(test['class_path'], self.server.checked_out)
+
+    def test_runners_without_heartbeats_are_left_to_time_out(self):
+        test = get_test(self.server, 'runner1')
+        self.server.check_heartbeats()
+
+        assert_in(test['class_path'], self.server.checked_out)
+
+    def test_dead_runners_copies_are_dropped(self):
+        self.server.disable_speculation = False
+        with mock.patch.multiple(test_runner_server, STRAGGLER_FACTOR=0, STRAGGLER_MIN_SECONDS=0):
+            test = get_test(self.server, 'runner1')
+            get_test(self.server, 'runner2')
+
+        self.server.heartbeat('runner1')
+        self.server.heartbeat_times['runner1'] -= 60
+        self.server.check_heartbeats()
+
+        # runner2's copy covers the whole class, so it's left to finish it.
+        d = self.server.checked_out[test['class_path']]
+        assert_equal(list(d['leases']), ['runner2'])
+        assert_equal(d['runner'], 'runner2')
+
+        self.run_test('runner2')
+        assert_equal(self.server.checked_out, {})
+
+
+class TestRunnerServerJournalTestCase(TestRunnerServerBaseTestCase):
+    def start_server(self):
+        # replay_journal runs before the server starts serving. A server which
+        # is stopped before its IOLoop gets going never stops, so don't start
+        # one at all.
+        self.make_server()
+
+    def stop_server(self):
+        pass
+
+    def result(self, class_path, method, success=True):
+        return dict(self.server._fake_result(class_path, method, 'runner1'), success=success)
+
+    def test_replay_journal(self):
+        self.server.journal = turtle.Turtle(events=[
+            {
+                'class_path': 'module Done',
+                'runner': 'runner1',
+                'reported': [self.result('module Done', 'test_a'), self.result('module Done', 'run')],
+                'failed': [],
+                'timed_out': [],
+                'failure_count': 0,
+            },
+            {
+                'class_path': 'module Requeued',
+                'runner': 'runner1',
+                'reported': [self.result('module Requeued', 'test_a')],
+                'failed': [self.result('module Requeued', 'test_b', success=False)],
+                'timed_out': [],
+                'failure_count': 1,
+            },
+        ])
+
+        remaining_tests = self.server.replay_journal([
+            (0, {'class_path': 'module Done', 'methods': ['test_a']}),
+            (0, {'class_path': 'module Requeued', 'methods': ['test_a', 'test_b']}),
+            (0, {'class_path': 'module NotStarted', 'methods': ['test_a']}),
+        ])
+
+        assert_equal(remaining_tests, [
+            (-1, {'class_path': 'module Requeued', 'methods': ['test_b'], 'last_runner': 'runner1'}),
+            (0, {'class_path': 'module NotStarted', 'methods': ['test_a']}),
+        ])
+        assert_equal(self.server.failed_rerun_methods, set([('module Requeued', 'test_b')]))
+        assert_equal(self.server.failure_count, 1)
+        assert_equal(
+            [call[0][0]['method']['full_name'] for call in self.test_reporter.test_complete.calls],
+            ['module Done.test_a', 'module Done.run', 'module Requeued.test_a'],
+        )
+
+
 class TestRunnerServerExceptionInSetupPhaseBaseTestCase(TestRunnerServerBaseTestCase):
     """Child classes should set:
 
@@ -729,6 +1040,111 @@ class TestRunnerServerFailureLimitClassTeardownErrorTestCase(TestRunnerServerFai
         self.dummy_test_case = FailureLimitTestCaseMixin.FailureLimitClassTeardownErrorTestCase
 
 
+class TestsByLastRunnerTestCase(test_case.TestCase):
+
+    def test_priority_then_queue_order(self):
+        tests = test_runner_server.TestsByLastRunner()
+        tests.push(0, {'class_path': 'first'})
+        tests.push(0, {'class_path': 'second', 'last_runner': 'foo'})
+        tests.push(-1, {'class_path': 'requeued', 'last_runner': 'bar'})
+
+        popped = [tests.pop_for('baz')[1]['class_path'] for _ in range(3)]
+        assert_equal(popped, ['requeued', 'first', 'second'])
+        assert_equal(tests.pop_for('baz'), None)
+        assert_equal(len(tests), 0)
+
+    def test_runners_skip_tests_they_ran_last(self):
+        tests = test_runner_server.TestsByLastRunner()
+        tests.push(-1, {'class_path': 'foo1', 'last_runner': 'foo'})
+        tests.push(-1, {'class_path': 'foo2', 'last_runner': 'foo'})
+        tests.push(0, {'class_path': 'fresh'})
+
+        assert_equal(tests.pop_for('foo')[1]['class_path'], 'fresh')
+        assert_equal(tests.pop_for('foo'), None)
+        assert_equal(tests.pop_for('foo', exclude_last_runner=False)[1]['class_path'], 'foo1')
+        assert_equal(tests.pop_for('bar')[1]['class_path'], 'foo2')
+
+
+class AsyncDelayedQueueTestCase(test_case.TestCase):
+
+    def add_worker(self, queue, runner):
+        received = []
+        queue.add_worker(0, lambda priority, test: received.append(test), runner=runner)
+        queue.match()
+        return received
+
+    def test_waiting_workers_get_tests_they_may_run(self):
+        queue = test_runner_server.AsyncDelayedQueue()
+        foo_received = self.add_worker(queue, 'foo')
+        bar_received = self.add_worker(queue, 'bar')
+        assert_equal(queue.waiting(), False)
+
+        queue.add_test(0, {'class_path': '1', 'last_runner': 'foo'})
+        queue.match()
+        assert_equal(foo_received, [])
+        assert_equal(bar_received, [{'class_path': '1', 'last_runner': 'foo'}])
+
+        queue.add_test(0, {'class_path': '2', 'last_runner': 'foo'})
+        queue.match()
+        assert_equal(foo_received, [])
+        assert_equal(queue.empty(), False)
+
+        queue.finalize()
+        assert_equal(foo_received, [None])
+        assert_equal(queue.waiting(), True)
+
+    def test_allow_last_runner(self):
+        queue = test_runner_server.AsyncDelayedQueue(allow_last_runner=lambda: True)
+        queue.add_test(0, {'class_path': '1', 'last_runner': 'foo'})
+        assert_equal(self.add_worker(queue, 'foo'), [{'class_path': '1', 'last_runner': 'foo'}])
+
+
+class ReportingQueueTestCase(test_case.TestCase):
+
+    def result(self, name):
+        return {'method': {'full_name': name}}
+
+    def test_results_are_reported_in_order_before_join_returns(self):
+        reporter = turtle.Turtle()
+        queue = test_runner_server.ReportingQueue([reporter], 10)
+        for name in ('a', 'b', 'c'):
+            queue.put(self.result(name))
+        queue.join()
+
+        assert_equal([args[0] for args, _ in reporter.test_complete.calls], [self.result(name) for name in 'abc'])
+        assert_equal(queue.blocked_count, 0)
+
+    def test_put_blocks_when_full(self):
+        reporting, release = threading.Event(), threading.Event()
+
+        def test_start(result):
+            reporting.set()
+            release.wait()
+
+        reporter = turtle.Turtle(test_start=test_start)
+        queue = test_runner_server.ReportingQueue([reporter], 1)
+        queue.put(self.result('a'))
+        reporting.wait()
+        queue.put(self.result('b'))
+
+        threading.Timer(0.1, release.set).start()
+        queue.put(self.result('c'))
+        queue.join()
+
+        assert_equal(len(reporter.test_complete.calls), 3)
+        assert_equal(queue.blocked_count, 1)
+        assert_equal(queue.max_depth, 1)
+
+    def test_broken_reporters_dont_stop_reporting(self):
+        reporter = turtle.Turtle(test_start=mock.Mock(side_effect=[ValueError, None]))
+        queue = test_runner_server.ReportingQueue([reporter], 10)
+        queue.put(self.result('a'))
+        queue.put(self.result('b'))
+        queue.join()
+
+        assert_equal([args[0] for args, _ in reporter.test_complete.calls], [self.result('b')])
+
+
 def _replace_values_with_types(obj):
     # This makes it simple to compare the format of two dictionaries.
     if isinstance(obj, dict):
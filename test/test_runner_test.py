@@ -259,3 +259,106 @@ class TestMoreFairBucketing(test_case.TestCase):
 
         discovered = instance.discover()
         self.assert_types_of_discovered(discovered, (self.all_tests[0],))
+
+
+class TestRunTimeBucketing(test_case.TestCase):
+    """With historical run times, the longest test case goes to the bucket
+    with the least total run time so far.
+    """
+
+    all_tests = TestMoreFairBucketing.all_tests
+
+    @setup_teardown
+    def mock_out_test_discovery(self):
+        with mock.patch.object(
+            test_discovery,
+            'discover',
+            autospec=True,
+        ) as self.discover_mock:
+            yield
+
+    def assert_types_of_discovered(self, discovered, expected):
+        assert_equal(tuple(map(type, discovered)), tuple(expected))
+
+    def cmp_str(self, test_case_class):
+        return test_case.MetaTestCase._cmp_str(test_case_class)
+
+    def test_buckets_balanced_by_run_time(self):
+        self.discover_mock.return_value = self.all_tests
+        bucket_timings = dict((self.cmp_str(test_class), 1.0) for test_class in self.all_tests)
+        bucket_timings[self.cmp_str(bucketing_test.TestCaseWithFewTests)] = 100.0
+
+        instance = test_runner.TestRunner(mock.sentinel.test_path, bucket=0, bucket_count=2, bucket_timings=bucket_timings)
+        self.assert_types_of_discovered(instance.discover(), (bucketing_test.TestCaseWithFewTests,))
+
+        instance = test_runner.TestRunner(mock.sentinel.test_path, bucket=1, bucket_count=2, bucket_timings=bucket_timings)
+        self.assert_types_of_discovered(
+            instance.discover(),
+            (
+                bucketing_test.AAA_FirstTestCaseWithSameNumberOfTests,
+                bucketing_test.TestCaseWithManyTests,
+                bucketing_test.ZZZ_SecondTestCaseWithSameNumberOfTests,
+            ),
+        )
+
+    def test_unknown_run_times_estimated_from_method_count(self):
+        """Test cases without history take the median per-method time for each method."""
+        self.discover_mock.return_value = self.all_tests
+        bucket_timings = {self.cmp_str(bucketing_test.TestCaseWithFewTests): 10.0}
+
+        instance = test_runner.TestRunner(mock.sentinel.test_path, bucket=0, bucket_count=2, bucket_timings=bucket_timings)
+        self.assert_types_of_discovered(
+            instance.discover(),
+            (bucketing_test.TestCaseWithManyTests, bucketing_test.TestCaseWithFewTests),
+        )
+
+    def test_bucket_overrides_count_towards_run_time(self):
+        self.discover_mock.return_value = self.all_tests
+        bucket_timings = dict((self.cmp_str(test_class), 1.0) for test_class in self.all_tests)
+
+        instance = test_runner.TestRunner(
+            mock.sentinel.test_path,
+            bucket=1,
+            bucket_count=2,
+            bucket_timings=bucket_timings,
+            bucket_overrides={self.cmp_str(bucketing_test.TestCaseWithFewTests): 1},
+        )
+        self.assert_types_of_discovered(
+            instance.discover(),
+            (bucketing_test.TestCaseWithFewTests, bucketing_test.ZZZ_SecondTestCaseWithSameNumberOfTests),
+        )
+
+
+class TestSaltedBucketing(test_case.TestCase):
+    """A bucket salt shuffles test cases of similar size between buckets."""
+
+    @setup_teardown
+    def mock_out_test_discovery(self):
+        with mock.patch.object(
+            test_discovery,
+            'discover',
+            autospec=True,
+            return_value=TestMoreFairBucketing.all_tests,
+        ):
+            yield
+
+    def discover_bucket(self, bucket, salt):
+        instance = test_runner.TestRunner(mock.sentinel.test_path, bucket=bucket, bucket_count=3, bucket_salt=salt)
+        return tuple(type(test_case_instance) for test_case_instance in instance.discover())
+
+    def test_salted_buckets_are_stable(self):
+        assert_equal(self.discover_bucket(1, 'salt'), self.discover_bucket(1, 'salt'))
+
+    def test_salts_reshuffle_similar_test_cases(self):
+        bucket_contents = set(self.discover_bucket(1, str(salt)) for salt in range(10))
+        assert_equal(
+            bucket_contents,
+            set([
+                (bucketing_test.AAA_FirstTestCaseWithSameNumberOfTests,),
+                (bucketing_test.ZZZ_SecondTestCaseWithSameNumberOfTests,),
+            ]),
+        )
+
+    def test_every_test_case_lands_in_one_bucket(self):
+        discovered = sum((self.discover_bucket(bucket, 'salt') for bucket in range(3)), ())
+        assert_equal(sorted(discovered, key=repr), sorted(TestMoreFairBucketing.all_tests, key=repr))
@@ -0,0 +1,69 @@
+import mock
+
+from testify import assert_equal
+from testify import assert_not_in
+from testify import TestCase
+from testify import test_runner_wire
+
+
+RESULT = {
+    'exception_info': 'Traceback...',
+    'exception_info_pretty': '\x1b[31mTraceback...\x1b[0m',
+    'method': {'name': 'test_a'},
+}
+
+
+class EncodingTestCase(TestCase):
+
+    def test_json(self):
+        body, headers = test_runner_wire.encode([RESULT])
+        assert_equal(headers, {'Content-Type': 'application/json'})
+        assert_equal(test_runner_wire.decode(body, headers['Content-Type']), [RESULT])
+
+    def test_large_bodies_are_compressed(self):
+        results = [RESULT] * 100
+        body, headers = test_runner_wire.encode(results, compress=True)
+        assert_equal(headers['Content-Encoding'], 'deflate')
+        assert_equal(test_runner_wire.decode(body, headers['Content-Type'], headers['Content-Encoding']), results)
+
+    def test_compressed_request_bodies_say_so_in_the_wire_header(self):
+        results = [RESULT] * 100
+        body, headers = test_runner_wire.encode(results, compress=True, request=True)
+        assert_not_in('Content-Encoding', headers)
+        assert_equal(headers[test_runner_wire.WIRE_HEADER], 'deflate')
+        assert_equal(test_runner_wire.decode(body, headers['Content-Type'], headers[test_runner_wire.WIRE_HEADER]), results)
+
+    def test_small_bodies_are_not_compressed(self):
+        _, headers = test_runner_wire.encode([RESULT], compress=True)
+        assert_not_in('Content-Encoding', headers)
+
+    def test_msgpack(self):
+        if test_runner_wire.msgpack is None:
+            return
+
+        body, headers = test_runner_wire.encode([RESULT], test_runner_wire.MSGPACK)
+        assert_equal(headers, {'Content-Type': 'application/x-msgpack'})
+        assert_equal(test_runner_wire.decode(body, headers['Content-Type']), [RESULT])
+
+
+class NegotiationTestCase(TestCase):
+
+    def test_choose_content_type(self):
+        with mock.patch.object(test_runner_wire, 'msgpack', mock.Mock()):
+            assert_equal(test_runner_wire.choose_content_type('application/x-msgpack, application/json'), 'application/x-msgpack')
+        with mock.patch.object(test_runner_wire, 'msgpack', None):
+            assert_equal(test_runner_wire.choose_content_type('application/x-msgpack, application/json'), 'application/json')
+        assert_equal(test_runner_wire.choose_content_type(None), 'application/json')
+
+    def test_capabilities(self):
+        with mock.patch.object(test_runner_wire, 'msgpack', None):
+            assert_equal(test_runner_wire.capabilities(omit_pretty=True), 'deflate batch omit-pretty')
+            # We can't send msgpack without it, even if the server can read it.
+            assert_equal(test_runner_wire.parse_capabilities('msgpack deflate'), set(['deflate']))
+        assert_equal(test_runner_wire.parse_capabilities(None), set())
+
+    def test_omitted_fields_are_restored(self):
+        result = test_runner_wire.omit_fields(RESULT, set(['omit-pretty']))
+        assert_not_in('exception_info_pretty', result)
+        assert_equal(test_runner_wire.restore_omitted_fields(result)['exception_info_pretty'], 'Traceback...')
+        assert_equal(test_runner_wire.omit_fields(RESULT, set()), RESULT)
@@ -1,61 +1,161 @@
 import logging
+import socket
 import threading
+import time
 
 import six
 
 from testify import test_reporter
+from testify import test_runner_wire
 
-try:
-    import simplejson as json  # noqa
-except ImportError:
-    import json
+# Results are sent to the server in batches of up to this many...
+BATCH_SIZE = 50
+# ...waiting at most this many seconds after the first result for more.
+BATCH_WINDOW = 0.1
+
+# Put on the result queue by report(), to send whatever is batched right away.
+_FLUSH = object()
 
 
 class HTTPReporter(test_reporter.TestReporter):
+    def next_batch(self):
+        """Take the next batch of results off result_queue: everything which
+        arrives within batch_window of the first, up to batch_size. Returns
+        (results, number of queue items taken)."""
+        results = []
+        taken = 0
+        deadline = None
+        while len(results) < self.batch_size:
+            if deadline is None:
+                item = self.result_queue.get()
+                deadline = time.time() + self.batch_window
+            else:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.result_queue.get(timeout=timeout)
+                except six.moves.queue.Empty:
+                    break
+
+            taken += 1
+            if item is _FLUSH:
+                break
+            results.append(item)
+        return results, taken
+
+    def encode_results(self, results):
+        """Encode results as the server last said it accepts (see
+        test_runner_wire): a list of them if it takes batches, or else the
+        only one. Returns (body, headers)."""
+        results = [test_runner_wire.omit_fields(result, self.wire_capabilities) for result in results]
+        if 'msgpack' in self.wire_capabilities:
+            content_type = test_runner_wire.MSGPACK
+        else:
+            content_type = test_runner_wire.JSON
+        if 'batch' in self.wire_capabilities:
+            body = results
+        else:
+            (body,) = results
+        return test_runner_wire.encode(body, content_type, compress='deflate' in self.wire_capabilities, request=True)
+
+    def post_results(self, results_encoded, headers):
+        """POST results to the server over our keep-alive connection,
+        reconnecting if needed. Returns the response's status, and the
+        classes it rejected results for as (class_path, reason) pairs if it
+        accepted the POST, or its body if not."""
+        if self.connection is None:
+            self.connection = six.moves.http_client.HTTPConnection(self.connect_addr)
+
+        try:
+            self.connection.request(
+                'POST',
+                '/results?runner=%s' % six.moves.urllib.parse.quote(self.runner_id),
+                results_encoded,
+                headers,
+            )
+            response = self.connection.getresponse()
+            self.wire_capabilities = test_runner_wire.parse_capabilities(response.getheader(test_runner_wire.WIRE_HEADER))
+            # The response has to be read in full before the connection can be reused.
+            body = response.read()
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+
+        content_type = response.getheader('Content-Type')
+        if response.status != 200:
+            return response.status, body
+        if not content_type or content_type.split(';')[0].strip() not in test_runner_wire.content_types():
+            # Servers which don't say which classes they rejected accept all of them.
+            return response.status, []
+        reply = test_runner_wire.decode(body, content_type, response.getheader('Content-Encoding'))
+        return response.status, [(rejected['class_path'], rejected['reason']) for rejected in reply['rejected']]
+
     def report_results(self):
         while True:
-            result = self.result_queue.get()
-            result['runner_id'] = self.runner_id
-            result_dumped = json.dumps(result)
-            if not isinstance(result_dumped, bytes):
-                result_dumped = result_dumped.encode('UTF-8')
-
+            results, taken = self.next_batch()
+            if not results:
+                self.result_queue.task_done()
+                continue
+
+            for result in results:
+                result['runner_id'] = self.runner_id
+            while results:
+                if 'batch' in self.wire_capabilities:
+                    self.send_results(results)
+                    break
+                # A server which hasn't said it takes batches (yet) gets one result per POST.
+                self.send_results(results[:1])
+                results = results[1:]
+
+            for _ in range(taken):
+                self.result_queue.task_done()
+
+    def send_results(self, results):
+        """POST results to the server, logging any it didn't take."""
+        results_encoded, headers = self.encode_results(results)
+
+        try:
             try:
-                try:
-                    six.moves.urllib.request.urlopen(
-                        'http://%s/results?runner=%s' % (
-                            self.connect_addr,
-                            self.runner_id,
-                        ),
-                        result_dumped,
-                    )
-                except (six.moves.urllib.error.URLError, six.moves.http_client.BadStatusLine) as e:
-                    # Retry once.
-                    six.moves.urllib.request.urlopen(
-                        'http://%s/results?runner=%s' % (
-                            self.connect_addr,
-                            self.runner_id,
-                        ),
-                        result_dumped,
-                    )
-            except six.moves.urllib.error.HTTPError as e:
+                status, reply = self.post_results(results_encoded, headers)
+            except (socket.error, six.moves.http_client.HTTPException):
+                # Including the server having closed our idle connection. Retry once. Any
+                # other reply is final: the server may have recorded some of the results.
+                status, reply = self.post_results(results_encoded, headers)
+            if status != 200:
                 logging.error(
-                    'Skipping returning results for test %s because of error: %s' % (
-                        result['method']['full_name'], e.read(),
+                    'Skipping returning results for tests %s because of error: %s' % (
+                        ', '.join(result['method']['full_name'] for result in results), reply,
                     )
                 )
-            except Exception as e:
-                logging.error(
-                    'Skipping returning results for test %s because of unknown error: %s' % (
-                        result['method']['full_name'], e,
-                    )
+            else:
+                for class_path, reason in reply:
+                    rejected_results = [
+                        result for result in results
+                        if '%s %s' % (result['method']['module'], result['method']['class']) == class_path
+                    ]
+                    if rejected_results:
+                        logging.error(
+                            'Skipping returning results for tests %s because of error: %s' % (
+                                ', '.join(result['method']['full_name'] for result in rejected_results), reason,
+                            )
+                        )
+        except Exception as e:
+            logging.error(
+                'Skipping returning results for tests %s because of unknown error: %s' % (
+                    ', '.join(result['method']['full_name'] for result in results), e,
                 )
+            )
 
-            self.result_queue.task_done()
-
-    def __init__(self, options, connect_addr, runner_id, *args, **kwargs):
+    def __init__(self, options, connect_addr, runner_id, batch_size=BATCH_SIZE, batch_window=BATCH_WINDOW, *args, **kwargs):
         self.connect_addr = connect_addr
         self.runner_id = runner_id
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.connection = None
+        # What the server has said it accepts; until it says, plain JSON.
+        self.wire_capabilities = set()
 
         self.result_queue = six.moves.queue.Queue()
         self.reporting_thread = threading.Thread(target=self.report_results)
@@ -86,6 +186,7 @@ class HTTPReporter(test_reporter.TestReporter):
 
     def report(self):
         """Wait until all results have been sent back."""
+        self.result_queue.put(_FLUSH)
         self.result_queue.join()
         return True
 
@@ -12,8 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import defaultdict
+from collections import OrderedDict
 import hashlib
 import logging
+import sqlite3
 
 try:
     import simplejson as json  # noqa
@@ -33,6 +36,13 @@ except ImportError:
 
 from testify import test_reporter
 
+# How many tests and failure hashes to remember the ids of.
+TEST_ID_CACHE_SIZE = 50000
+FAILURE_ID_CACHE_SIZE = 10000
+
+# While gathering a batch, how often to check whether report() wants it flushed.
+FLUSH_CHECK_INTERVAL = 0.05
+
 
 def md5(s):
     return hashlib.md5(
@@ -40,22 +50,103 @@ def md5(s):
     ).hexdigest()
 
 
+class LRUCache(object):
+    """A dict-like cache holding at most `size` items, forgetting the least
+    recently used first."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        # SQLReporter's writer threads share its caches.
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ResultSpool(object):
+    """Result dicts waiting to be inserted into the reporting database, kept
+    in a local SQLite database so that they aren't lost if the reporting
+    database is slow or unavailable, or this process dies. Several processes
+    can share a spool; WAL mode keeps their writes from waiting on each other
+    for long."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            # Losing the last few results if the machine (not just this process) dies is fine.
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(id INTEGER PRIMARY KEY, build INTEGER NOT NULL, result TEXT NOT NULL)'
+            )
+
+    def append(self, build_id, result):
+        """Spool a result of the given build, returning its id in the spool."""
+        with self.lock:
+            return self.conn.execute('INSERT INTO results (build, result) VALUES (?, ?)', (build_id, json.dumps(result))).lastrowid
+
+    def remove(self, spool_ids):
+        with self.lock:
+            self.conn.executemany('DELETE FROM results WHERE id = ?', [(spool_id,) for spool_id in spool_ids])
+
+    def builds(self):
+        """The ids of the builds which have results in the spool."""
+        with self.lock:
+            return [row[0] for row in self.conn.execute('SELECT DISTINCT build FROM results')]
+
+    def pending(self, build_id):
+        """A list of (spool id, result) for the results of the given build which are still in the spool."""
+        with self.lock:
+            rows = self.conn.execute('SELECT id, result FROM results WHERE build = ? ORDER BY id', (build_id,)).fetchall()
+        return [(spool_id, json.loads(result)) for spool_id, result in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
 class TaskQueue(six.moves.queue.Queue):
-    def __init__(self, maxsize=0, worker_function=lambda: None):
+    def __init__(self, maxsize=0, worker_function=lambda: None, workers=1):
         self._func = worker_function
-        self._thread = None
+        self._workers = workers
+        self._threads = None
         # Queue is apparently an old-style class.
         six.moves.queue.Queue.__init__(self, maxsize)
 
     def put(self, item, block=True, timeout=None):
-        if self._thread is None:
-            self._thread = threading.Thread(target=self._func)
-            self._thread.daemon = True
-            self._thread.start()
+        if self._threads is None:
+            self._threads = [threading.Thread(target=self._func) for _ in range(self._workers)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
         six.moves.queue.Queue.put(self, item, block, timeout)
 
 
 class SQLReporter(test_reporter.TestReporter):
+    uses_pretty_exception_info = False
 
     def __init__(self, options, *args, **kwargs):
         dburl = options.reporting_db_url or SA.engine.url.URL(**yaml.safe_load(open(options.reporting_db_config)))
@@ -74,20 +165,36 @@ class SQLReporter(test_reporter.TestReporter):
         self.conn = self._connect()
         self.metadata.create_all(self.engine)
 
-        if not options.build_info:
-            raise ValueError("Build info must be specified when reporting to a database.")
-
-        build_info_dict = json.loads(options.build_info)
-        self.build_id = self.create_build_row(build_info_dict)
+        self.spool = None
+        if options.replay_spool:
+            # We're only here to insert the results of earlier runs, into their own builds (see replay_spool).
+            self.spool = ResultSpool(options.replay_spool)
+            self.build_id = None
+        else:
+            if not options.build_info:
+                raise ValueError("Build info must be specified when reporting to a database.")
+
+            build_info_dict = json.loads(options.build_info)
+            self.build_id = self.create_build_row(build_info_dict)
+            if options.sql_spool:
+                self.spool = ResultSpool(options.sql_spool)
+        self.multi_row_insert_ids = self._multi_row_insert_ids(self.conn)
         self.start_time = time.time()
 
-        # Cache of (module,class_name,method_name) => test id
-        self.test_id_cache = dict(
-            ((row[self.Tests.c.module], row[self.Tests.c.class_name], row[self.Tests.c.method_name]), row[self.Tests.c.id])
-            for row in self.conn.execute(self.Tests.select())
+        # Cache of (module,class_name,method_name) => test id, filled a module
+        # at a time as results from each module come in (see _prepare_ids).
+        self.test_id_cache = LRUCache(TEST_ID_CACHE_SIZE)
+        self.cached_modules = set()
+        # Cache of failure hash => failure id
+        self.failure_id_cache = LRUCache(FAILURE_ID_CACHE_SIZE)
+
+        self.result_queue = TaskQueue(
+            maxsize=options.sql_reporting_queue_size,
+            worker_function=self.report_results,
+            workers=options.sql_writer_connections,
         )
-
-        self.result_queue = TaskQueue(worker_function=self.report_results)
+        # Set by report(), to have the writers insert what they have without waiting for more.
+        self.flushing = threading.Event()
         self.ok = True
 
         self.reporting_frequency = options.sql_reporting_frequency
@@ -163,13 +270,31 @@ class SQLReporter(test_reporter.TestReporter):
             SA.Column('test', SA.Integer, index=True, nullable=False),
             SA.Column('failure', SA.Integer, index=True),
             SA.Column('build', SA.Integer, index=True, nullable=False),
-            SA.Column('end_time', SA.Integer, index=True, nullable=False),
+            SA.Column('end_time', SA.Float, index=True, nullable=False),
             SA.Column('run_time', SA.Float, index=True, nullable=False),
             SA.Column('runner_id', SA.String(255), index=True, nullable=True),
             SA.Column('previous_run', SA.Integer, index=False, nullable=True),
         )
         SA.Index('ix_build_test_failure', self.TestResults.c.build, self.TestResults.c.test, self.TestResults.c.failure)
 
+    def _multi_row_insert_ids(self, conn):
+        """How to get the ids of the rows a multi-row INSERT creates on this
+        database: 'returning' if it can return them, 'first' or 'last' if
+        they're consecutive and lastrowid is the first or last of them, or
+        None if we have to insert one row at a time to find out."""
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            return 'returning'
+        elif dialect == 'sqlite':
+            # Only one connection writes at a time, and new rowids count up from the largest.
+            return 'last'
+        elif dialect == 'mysql':
+            # InnoDB only promises a multi-row INSERT consecutive ids in its
+            # "traditional" (0) and "consecutive" (1) lock modes.
+            lock_mode = conn.execute(SA.text('SELECT @@innodb_autoinc_lock_mode')).scalar()
+            return 'first' if lock_mode is not None and int(lock_mode) < 2 else None
+        return None
+
     def create_build_row(self, info_dict):
         results = self.conn.execute(self.Builds.insert({
             'buildbot_run_id': info_dict['buildbot_run_id'],
@@ -191,18 +316,53 @@ class SQLReporter(test_reporter.TestReporter):
                                     }
                                     ))
 
+    def get_class_timings(self, since):
+        """Return the historical run time of each test class in seconds, keyed on
+        {module}.{class_name}: the sum of each of its methods' average run time
+        in results which ended after `since`, a unix timestamp.
+        """
+        query = SA.select(
+            [
+                self.Tests.c.module,
+                self.Tests.c.class_name,
+                self.Tests.c.method_name,
+                SA.func.avg(self.TestResults.c.run_time),
+            ],
+            SA.and_(
+                self.TestResults.c.test == self.Tests.c.id,
+                self.TestResults.c.end_time >= since,
+            ),
+        ).group_by(self.Tests.c.module, self.Tests.c.class_name, self.Tests.c.method_name)
+
+        timings = defaultdict(float)
+        for module, class_name, _, run_time in self.conn.execute(query):
+            timings['%s.%s' % (module, class_name)] += float(run_time)
+        return dict(timings)
+
     def class_teardown_complete(self, result):
         """If there was an error during class_teardown, insert the result
         containing the error into the queue that report_results pulls from.
         """
         if not result['success']:
-            self.result_queue.put(result)
+            self._enqueue(result)
 
     def test_complete(self, result):
         """Insert a result into the queue that report_results pulls from."""
         # Test methods named 'run' are special. See TestCase.run().
         if not result['method']['name'] == 'run':
+            self._enqueue(result)
+
+    def _enqueue(self, result):
+        if self.spool is None:
             self.result_queue.put(result)
+            return
+
+        result = dict(result, spool_id=self.spool.append(self.build_id, result))
+        try:
+            self.result_queue.put_nowait(result)
+        except six.moves.queue.Full:
+            # Rather than wait for the reporting database, leave it in the spool for report() to upload.
+            pass
 
     def test_discovery_failure(self, exc):
         """Set the discovery_failure flag to True and method_count to 0."""
@@ -226,17 +386,115 @@ class SQLReporter(test_reporter.TestReporter):
 
         return (traceback, error)
 
+    def _run_time(self, result):
+        """A result's run time in seconds, from its monotonic run_time_ns when
+        it has one (results from older runners only have run_time)."""
+        if result.get('run_time_ns') is not None:
+            return result['run_time_ns'] / 1000000000.0
+        return result['run_time']
+
     def _create_row_to_insert(self, conn, result, previous_run_id=None):
         return {
             'test': self._get_test_id(conn, result['method']['module'], result['method']['class'], result['method']['name']),
             'failure': self._get_failure_id(conn, result['exception_info'], result['exception_only']),
             'build': self.build_id,
             'end_time': result['end_time'],
-            'run_time': result['run_time'],
+            'run_time': self._run_time(result),
             'runner_id': result['runner_id'],
             'previous_run': previous_run_id,
         }
 
+    def _chunks(self, items):
+        items = list(items)
+        return (items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size))
+
+    def _cache_test_ids(self, conn, keys):
+        """Look up the ids of the tests with the given (module, class_name, method_name) keys, and cache those which exist."""
+        for chunk in self._chunks(keys):
+            query = SA.select(
+                [self.Tests.c.id, self.Tests.c.module, self.Tests.c.class_name, self.Tests.c.method_name],
+                SA.or_(*[
+                    SA.and_(
+                        self.Tests.c.module == module,
+                        self.Tests.c.class_name == class_name,
+                        self.Tests.c.method_name == method_name,
+                    )
+                    for module, class_name, method_name in chunk
+                ]),
+            )
+            self._cache_test_rows(conn.execute(query))
+
+    def _cache_module_test_ids(self, conn, modules):
+        """Cache the ids of every test we know of in the given modules, as the
+        rest of a module's tests are likely to be reported soon."""
+        for chunk in self._chunks(modules):
+            query = SA.select(
+                [self.Tests.c.id, self.Tests.c.module, self.Tests.c.class_name, self.Tests.c.method_name],
+                self.Tests.c.module.in_(chunk),
+            )
+            self._cache_test_rows(conn.execute(query))
+            self.cached_modules.update(chunk)
+
+    def _cache_test_rows(self, rows):
+        for row in rows:
+            test_key = (row[self.Tests.c.module], row[self.Tests.c.class_name], row[self.Tests.c.method_name])
+            self.test_id_cache[test_key] = row[self.Tests.c.id]
+
+    def _cache_failure_ids(self, conn, hashes):
+        """Look up the ids of the failures with the given hashes, and cache those which exist."""
+        for chunk in self._chunks(hashes):
+            query = SA.select([self.Failures.c.id, self.Failures.c.hash], self.Failures.c.hash.in_(chunk))
+            for row in conn.execute(query):
+                self.failure_id_cache[row[self.Failures.c.hash]] = row[self.Failures.c.id]
+
+    def _insert_missing_rows(self, conn, table, rows):
+        try:
+            conn.execute(table.insert(), rows)
+        except SA.exc.IntegrityError:
+            # Another reporter got some of them in first; insert the rest one at a time.
+            for row in rows:
+                try:
+                    conn.execute(table.insert(row))
+                except SA.exc.IntegrityError:
+                    pass
+
+    def _prepare_ids(self, conn, results):
+        """Find (or create) the test and failure rows for a batch of results
+        and their previous runs with a few bulk queries, rather than one or two
+        per result, so that _create_row_to_insert finds their ids cached."""
+        test_keys = set()
+        failures = {}
+        for result in results:
+            while result:
+                test_keys.add((result['method']['module'], result['method']['class'], result['method']['name']))
+                if result['exception_info']:
+                    traceback, error = self._canonicalize_exception(result['exception_info'], result['exception_only'])
+                    failures[md5(traceback)] = (traceback, error)
+                result = result['previous_run']
+
+        missing_tests = [key for key in test_keys if key not in self.test_id_cache]
+        self._cache_module_test_ids(conn, set(module for module, _, _ in missing_tests) - self.cached_modules)
+        missing_tests = [key for key in missing_tests if key not in self.test_id_cache]
+        # Anything still missing is new, or was pushed out of the cache.
+        self._cache_test_ids(conn, missing_tests)
+        missing_tests = [key for key in missing_tests if key not in self.test_id_cache]
+        if missing_tests:
+            self._insert_missing_rows(conn, self.Tests, [
+                {'module': module, 'class_name': class_name, 'method_name': method_name}
+                for module, class_name, method_name in missing_tests
+            ])
+            self._cache_test_ids(conn, missing_tests)
+
+        missing_failures = [exc_hash for exc_hash in failures if exc_hash not in self.failure_id_cache]
+        self._cache_failure_ids(conn, missing_failures)
+        missing_failures = [exc_hash for exc_hash in missing_failures if exc_hash not in self.failure_id_cache]
+        if missing_failures:
+            self._insert_missing_rows(conn, self.Failures, [
+                {'hash': exc_hash, 'error': failures[exc_hash][1], 'traceback': failures[exc_hash][0]}
+                for exc_hash in missing_failures
+            ])
+            self._cache_failure_ids(conn, missing_failures)
+
     def _get_test_id(self, conn, module, class_name, method_name):
         """Get the ID of the self.Tests row that corresponds to this test. If the row doesn't exist, insert one"""
 
@@ -256,7 +514,7 @@ class SQLReporter(test_reporter.TestReporter):
         # Most of the time, the self.Tests row will already exist for this test (it's been run before.)
         row = conn.execute(query).fetchone()
         if row:
-            return row[self.Tests.c.id]
+            test_id = row[self.Tests.c.id]
         else:
             # Not there (this test hasn't been run before); create it
             results = conn.execute(self.Tests.insert({
@@ -265,7 +523,9 @@ class SQLReporter(test_reporter.TestReporter):
                 'method_name': method_name,
             }))
             # and then return it.
-            return results.lastrowid
+            test_id = results.lastrowid
+        self.test_id_cache[(module, class_name, method_name)] = test_id
+        return test_id
 
     def _get_failure_id(self, conn, exception_info, error):
         """Get the ID of the failure row for the specified exception."""
@@ -277,13 +537,17 @@ class SQLReporter(test_reporter.TestReporter):
 
         exc_hash = md5(traceback)
 
+        cached_result = self.failure_id_cache.get(exc_hash)
+        if cached_result is not None:
+            return cached_result
+
         query = SA.select(
             [self.Failures.c.id],
             self.Failures.c.hash == exc_hash,
         )
         row = conn.execute(query).fetchone()
         if row:
-            return row[self.Failures.c.id]
+            failure_id = row[self.Failures.c.id]
         else:
             # We haven't inserted this row yet; insert it and re-query.
             results = conn.execute(self.Failures.insert({
@@ -291,60 +555,159 @@ class SQLReporter(test_reporter.TestReporter):
                 'error': error,
                 'traceback': traceback,
             }))
-            return results.lastrowid
+            failure_id = results.lastrowid
+        self.failure_id_cache[exc_hash] = failure_id
+        return failure_id
+
+    def _insert_rows_returning_ids(self, conn, rows):
+        """Insert self.TestResults rows, with as few INSERTs as the database allows, and return their ids in order."""
+        ids = []
+        for chunk in self._chunks(rows):
+            if self.multi_row_insert_ids == 'returning':
+                results = conn.execute(self.TestResults.insert().values(chunk).returning(self.TestResults.c.id))
+                ids.extend(row[0] for row in results)
+            elif self.multi_row_insert_ids in ('first', 'last'):
+                last_id = conn.execute(self.TestResults.insert().values(chunk)).lastrowid
+                first_id = last_id if self.multi_row_insert_ids == 'first' else last_id - len(chunk) + 1
+                ids.extend(range(first_id, first_id + len(chunk)))
+            else:
+                ids.extend(conn.execute(self.TestResults.insert(row)).lastrowid for row in chunk)
+        return ids
+
+    def _insert_previous_runs(self, conn, results):
+        """Insert the previous runs of a batch of results, and set each
+        result's previous_run_id.
+
+        The runs are inserted a level at a time: first the oldest run of every
+        chain, then the runs which came after those, and so on, so that each
+        level knows the ids of the runs before it.
+        """
+        # levels[n] holds (run, next_run) pairs, where run has n runs before it.
+        levels = []
+        for result in results:
+            chain = []
+            while result['previous_run']:
+                chain.append((result['previous_run'], result))
+                result = result['previous_run']
+            for level, run_and_next_run in enumerate(reversed(chain)):
+                if level == len(levels):
+                    levels.append([])
+                levels[level].append(run_and_next_run)
+
+        for level in levels:
+            rows = [self._create_row_to_insert(conn, run, run.get('previous_run_id', None)) for run, _ in level]
+            for (_, next_run), run_id in zip(level, self._insert_rows_returning_ids(conn, rows)):
+                next_run['previous_run_id'] = run_id
+
+    def _insert_results(self, conn, results):
+        """Insert a batch of results and their previous runs, and take the results out of the spool."""
+        try:
+            self._prepare_ids(conn, results)
+        except Exception:
+            # Not fatal: any ids we're missing are looked up one at a time below.
+            logging.exception("Exception while looking up test and failure ids")
 
-    def _insert_single_run(self, conn, result):
-        """Recursively insert a run and its previous runs."""
-        previous_run_id = self._insert_single_run(conn, result['previous_run']) if result['previous_run'] else None
-        results = conn.execute(self.TestResults.insert(self._create_row_to_insert(conn, result, previous_run_id=previous_run_id)))
-        return results.lastrowid
+        if self.spool is None:
+            # Insert any previous runs, if necessary.
+            try:
+                self._insert_previous_runs(conn, results)
+            except Exception as e:
+                logging.exception("Exception while reporting results: " + repr(e))
+                self.ok = False
 
-    def _report_results_by_chunk(self, conn, chunk):
-        try:
             conn.execute(self.TestResults.insert(),
-                         [self._create_row_to_insert(conn, result, result.get('previous_run_id', None)) for result in chunk]
+                         [self._create_row_to_insert(conn, result, result.get('previous_run_id', None)) for result in results]
                          )
+            return
+
+        # The batch stays in the spool to be tried again if anything goes
+        # wrong, so it has to go in all at once or not at all.
+        try:
+            with conn.begin():
+                self._insert_previous_runs(conn, results)
+                conn.execute(self.TestResults.insert(),
+                             [self._create_row_to_insert(conn, result, result.get('previous_run_id', None)) for result in results]
+                             )
+        except Exception:
+            # Any tests or failures inserted on a cache miss were rolled back too.
+            self._clear_id_caches()
+            raise
+        self.spool.remove([result['spool_id'] for result in results if 'spool_id' in result])
+
+    def _clear_id_caches(self):
+        self.test_id_cache = LRUCache(TEST_ID_CACHE_SIZE)
+        self.cached_modules = set()
+        self.failure_id_cache = LRUCache(FAILURE_ID_CACHE_SIZE)
+
+    def _report_results_by_chunk(self, conn, chunk):
+        try:
+            self._insert_results(conn, chunk)
         except Exception as e:
-            logging.exception("Exception while reporting results: " + repr(e))
-            self.ok = False
+            if self.spool is not None:
+                # report() tries them again.
+                logging.warning("Exception while reporting results, leaving them in %s: %r", self.spool.path, e)
+            else:
+                logging.exception("Exception while reporting results: " + repr(e))
+                self.ok = False
         finally:
             # Do this in finally so we don't hang at report() time if we get errors.
             for _ in range(len(chunk)):
                 self.result_queue.task_done()
 
-    def report_results(self):
-        """A worker func that runs in another thread and reports results to the database.
-        Create a self.TestResults row from a test result dict. Also inserts the previous_run row."""
-        conn = self._connect()
+    def _next_batch(self):
+        """Block until there's a result available, then gather more until
+        there are self.batch_size of them, the first has waited
+        self.reporting_frequency seconds, or report() is waiting for them
+        (in which case we take whatever's already queued)."""
+        results = [self.result_queue.get()]
+        deadline = time.time() + self.reporting_frequency
+        while len(results) < self.batch_size:
+            if self.flushing.is_set():
+                try:
+                    results.append(self.result_queue.get_nowait())
+                except six.moves.queue.Empty:
+                    break
+                continue
 
-        while True:
-            results = []
-            # Block until there's a result available.
-            results.append(self.result_queue.get())
-            # Grab any more tests that come in during the next self.reporting_frequency seconds.
-            time.sleep(self.reporting_frequency)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
             try:
-                while True:
-                    results.append(self.result_queue.get_nowait())
+                results.append(self.result_queue.get(timeout=min(remaining, FLUSH_CHECK_INTERVAL)))
             except six.moves.queue.Empty:
                 pass
+        return results
 
-            # Insert any previous runs, if necessary.
-            for result in filter(lambda x: x['previous_run'], results):
-                try:
-                    result['previous_run_id'] = self._insert_single_run(conn, result['previous_run'])
-                except Exception as e:
-                    logging.exception("Exception while reporting results: " + repr(e))
-                    self.ok = False
+    def report_results(self):
+        """A worker func that runs in another thread and reports results to the database.
+        Create a self.TestResults row from a test result dict. Also inserts the previous_run row.
+        There are --sql-writer-connections of these, each with a connection of its own."""
+        conn = self._connect()
 
-            chunks = (results[i:i + self.batch_size] for i in range(0, len(results), self.batch_size))
+        while True:
+            self._report_results_by_chunk(conn, self._next_batch())
 
-            for chunk in chunks:
-                self._report_results_by_chunk(conn, chunk)
+    def upload_spool(self, conn):
+        """Insert the results of self.build_id which are still in the spool, and return how many are left."""
+        for chunk in self._chunks(self.spool.pending(self.build_id)):
+            try:
+                self._insert_results(conn, [dict(result, spool_id=spool_id) for spool_id, result in chunk])
+            except Exception as e:
+                logging.exception("Exception while reporting results from %s: %r" % (self.spool.path, e))
+        return len(self.spool.pending(self.build_id))
 
     def report(self):
         self.end_time = time.time()
+        self.flushing.set()
         self.result_queue.join()
+
+        if self.spool is not None:
+            left = self.upload_spool(self.conn)
+            if left:
+                logging.error("%d results couldn't be reported; use --replay-spool %s to try again later.", left, self.spool.path)
+                self.ok = False
+            self.spool.close()
+
         query = SA.update(self.Builds,
                           whereclause=(self.Builds.c.id == self.build_id),
                           values={
@@ -388,7 +751,23 @@ def add_command_line_options(parser):
         dest="sql_reporting_frequency",
         type="float",
         default=1.0,
-        help="How long to wait between SQL inserts, at a minimum",
+        help="How long a result may wait for others to be inserted along with it, at most.",
+    )
+    parser.add_option(
+        "--sql-reporting-queue-size",
+        action="store",
+        dest="sql_reporting_queue_size",
+        type="int",
+        default=10000,
+        help="How many results may wait to be inserted before reporting more blocks until they are. 0 for no limit.",
+    )
+    parser.add_option(
+        "--sql-writer-connections",
+        action="store",
+        dest="sql_writer_connections",
+        type="int",
+        default=1,
+        help="How many connections to insert results over in parallel.",
     )
     parser.add_option(
         "--sql-batch-size",
@@ -398,6 +777,19 @@ def add_command_line_options(parser):
         default="500",
         help="Maximum number of rows to insert at any one time",
     )
+    parser.add_option(
+        "--sql-spool",
+        action="store",
+        dest="sql_spool",
+        type="string",
+        default=None,
+        metavar="FILE",
+        help=(
+            "Keep results in a local SQLite database at FILE until they're in the reporting database, "
+            "so tests needn't wait for it and results left over when it's unavailable can be "
+            "reported later with --replay-spool FILE."
+        ),
+    )
     parser.add_option(
         "--sql-traceback-size",
         action="store",
@@ -406,6 +798,59 @@ def add_command_line_options(parser):
         default="65536",
         help="Maximum length of traceback to store. Tracebacks longer than this will be truncated.",
     )
+    parser.add_option(
+        "--bucket-timings-from-reporting-db",
+        action="store_true",
+        dest="bucket_timings_from_reporting_db",
+        default=False,
+        help="Balance buckets by the run times of test classes in the reporting database.",
+    )
+    parser.add_option(
+        "--bucket-timings-days",
+        action="store",
+        dest="bucket_timings_days",
+        type="float",
+        default=7.0,
+        help="With --bucket-timings-from-reporting-db, how many days of results to average over.",
+    )
+
+
+def prepare_test_runner(options, runner):
+    if not options.bucket_timings_from_reporting_db:
+        return
+
+    sql_reporters = [reporter for reporter in runner.test_reporters if isinstance(reporter, SQLReporter)]
+    if not sql_reporters:
+        logging.warning('--bucket-timings-from-reporting-db needs a reporting database; balancing buckets by test count.')
+        return
+
+    since = time.time() - options.bucket_timings_days * 24 * 60 * 60
+    for test_module_and_class, run_time in sql_reporters[0].get_class_timings(since).items():
+        # Timings from --bucket-timings-file take precedence.
+        runner.bucket_timings.setdefault(test_module_and_class, run_time)
+
+
+def replay_spool(options):
+    """Insert the results left in the spool at options.replay_spool into the
+    reporting database, each into the build it came from. Return whether they
+    all went in."""
+    if not (options.reporting_db_config or options.reporting_db_url):
+        logging.error('--replay-spool needs a reporting database, from --reporting-db-config or --reporting-db-url.')
+        return False
+    if not SA:
+        msg = 'SQL Reporter plugin requires sqlalchemy and you do not have it installed in your PYTHONPATH.\n'
+        raise ImportError(msg)
+
+    reporter = SQLReporter(options)
+    left = 0
+    for build_id in reporter.spool.builds():
+        reporter.build_id = build_id
+        left += reporter.upload_spool(reporter.conn)
+    reporter.spool.close()
+
+    if left:
+        logging.error("%d results are still in %s.", left, options.replay_spool)
+    return reporter.ok and not left
 
 
 def build_test_reporters(options):
@@ -40,6 +40,11 @@ def prepare_test_runner(options, runner):
         runner.unittests = db.build_dict()
 
 
+def adds_testcase_info(runner):
+    """Whether add_testcase_info will annotate anything."""
+    return hasattr(runner, 'unittests')
+
+
 def add_testcase_info(test_case, runner):
     """Uses the runner's data structure to add information about tests"""
     test_case.unittests = []
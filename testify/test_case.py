@@ -27,6 +27,7 @@ import inspect
 import sys
 import types
 import unittest
+import weakref
 
 import six
 
@@ -34,10 +35,34 @@ from testify.utils import class_logger
 from testify.test_fixtures import DEPRECATED_FIXTURE_TYPE_MAP
 from testify.test_fixtures import TestFixtures
 from testify.test_fixtures import suite
+from testify.test_fixtures import suites_generation
 from .test_result import TestResult
 from . import deprecated_assertions
 
 
+def suites_selected(member_suites, suites_include, suites_exclude, suites_require):
+    """Return whether a test method in `member_suites` should run, given the
+    suites to include, exclude and require.
+    """
+    # if there are any exclude suites, exclude methods under them
+    if suites_exclude and suites_exclude & member_suites:
+        return False
+    # if there are any include suites, only run methods in them
+    if suites_include and not (suites_include & member_suites):
+        return False
+    # if there are any require suites, only run methods in *all* of those suites
+    if suites_require and not ((suites_require & member_suites) == suites_require):
+        return False
+    return True
+
+
+# Bumped whenever an attribute of any TestCase class is set or deleted, which
+# makes every cached test method table and fixture plan stale.
+_test_method_generation = 0
+_test_method_tables = weakref.WeakKeyDictionary()
+_fixture_plans = weakref.WeakKeyDictionary()
+
+
 class MetaTestCase(type):
     """This base metaclass is used to collect each TestCase's decorated fixture methods at
     runtime. It is implemented as a metaclass so we can determine the order in which
@@ -63,6 +88,62 @@ class MetaTestCase(type):
 
         return super(MetaTestCase, mcls).__new__(mcls, name, bases, dct)
 
+    def __setattr__(cls, name, value):
+        super(MetaTestCase, cls).__setattr__(name, value)
+        MetaTestCase._invalidate_test_method_tables()
+
+    def __delattr__(cls, name):
+        super(MetaTestCase, cls).__delattr__(name)
+        MetaTestCase._invalidate_test_method_tables()
+
+    @staticmethod
+    def _invalidate_test_method_tables():
+        global _test_method_generation
+        _test_method_generation += 1
+
+    def _test_method_table(cls):
+        """Return a list of (name, function) for each of this class's members
+        whose name starts with "test", in dir() order.
+
+        function is the plain function instances bind, or None for any other
+        kind of member, which instances have to look up for themselves.
+        """
+        generation, table = _test_method_tables.get(cls, (None, None))
+        if generation != _test_method_generation:
+            table = []
+            for member_name in dir(cls):
+                if not member_name.startswith('test'):
+                    continue
+                member = None
+                for klass in cls.__mro__:
+                    if member_name in vars(klass):
+                        member = vars(klass)[member_name]
+                        break
+                table.append((member_name, member if isinstance(member, types.FunctionType) else None))
+            _test_method_tables[cls] = (_test_method_generation, table)
+        return table
+
+    def _fixture_plan(cls):
+        """Return this class's TestFixtures.plan_for, computed once."""
+        generation, fixture_plan = _fixture_plans.get(cls, (None, None))
+        if generation != _test_method_generation:
+            fixture_plan = TestFixtures.plan_for(cls)
+            _fixture_plans[cls] = (_test_method_generation, fixture_plan)
+        return fixture_plan
+
+    def _has_class_fixtures(cls):
+        """Whether this class has any class-level fixtures, not counting the
+        no-op classSetUp and classTearDown every TestCase inherits."""
+        for descriptor in cls._fixture_plan().class_fixtures:
+            name = descriptor.function.__name__
+            if name in DEPRECATED_FIXTURE_TYPE_MAP and (
+                    six.get_unbound_function(getattr(cls, name)) is
+                    six.get_unbound_function(getattr(TestCase, name))
+            ):
+                continue
+            return True
+        return False
+
     @staticmethod
     def _cmp_str(instance):
         """Return a canonical representation of a TestCase for sorting and hashing."""
@@ -118,9 +199,10 @@ class TestCase(six.with_metaclass(MetaTestCase, object)):
     log = class_logger.ClassLogger()
 
     def __init__(self, *args, **kwargs):
+        self.__runnable_test_methods = None
         super(TestCase, self).__init__()
 
-        self.__test_fixtures = TestFixtures.discover_from(self)
+        self.__test_fixtures = TestFixtures.from_plan(type(self)._fixture_plan(), self)
 
         self.__suites_include = kwargs.get('suites_include', set())
         self.__suites_exclude = kwargs.get('suites_exclude', set())
@@ -150,6 +232,18 @@ class TestCase(six.with_metaclass(MetaTestCase, object)):
         self.failure_limit = kwargs.pop('failure_limit', None)
         self.failure_count = 0
 
+    def __setattr__(self, name, value):
+        # New or replaced test methods (see _generate_test_method) and suites
+        # change which methods are runnable.
+        if name.startswith('test') or name == '_suites':
+            self.__runnable_test_methods = None
+        super(TestCase, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if name.startswith('test') or name == '_suites':
+            self.__runnable_test_methods = None
+        super(TestCase, self).__delattr__(name)
+
     @property
     def test_result(self):
         return self.__all_test_results[-1] if self.__all_test_results else None
@@ -170,24 +264,41 @@ class TestCase(six.with_metaclass(MetaTestCase, object)):
         This will pick out the test methods from this TestCase, and then exclude any in
         any of our exclude_suites.  If there are any include_suites, it will then further
         limit itself to test methods in those suites.
-        """
-        for member_name in dir(self):
-            if not member_name.startswith("test"):
-                continue
-            member = getattr(self, member_name)
-            if not inspect.ismethod(member):
-                continue
 
-            member_suites = self.suites(member)
+        The result is computed once, and again only after a test method or
+        suite is set on this instance or on any TestCase class, or suite()
+        marks any function.
+        """
+        generation = (_test_method_generation, suites_generation[0])
+        cached = getattr(self, '_TestCase__runnable_test_methods', None)
+        if cached is None or cached[0] != generation:
+            cached = (generation, list(self.__find_runnable_test_methods()))
+            self.__runnable_test_methods = cached
+        return iter(cached[1])
+
+    def __find_runnable_test_methods(self):
+        test_method_table = type(self)._test_method_table()
+        instance_member_names = [member_name for member_name in vars(self) if member_name.startswith('test')]
+        if instance_member_names:
+            # Members set on this instance (e.g. by _generate_test_method) shadow the class's.
+            test_method_table = dict(test_method_table)
+            test_method_table.update((member_name, None) for member_name in instance_member_names)
+            test_method_table = sorted(test_method_table.items())
+
+        for member_name, function in test_method_table:
+            if function is not None:
+                member = function.__get__(self, type(self))
+            else:
+                member = getattr(self, member_name)
+                if not inspect.ismethod(member):
+                    continue
 
-            # if there are any exclude suites, exclude methods under them
-            if self.__suites_exclude and self.__suites_exclude & member_suites:
-                continue
-            # if there are any include suites, only run methods in them
-            if self.__suites_include and not (self.__suites_include & member_suites):
-                continue
-            # if there are any require suites, only run methods in *all* of those suites
-            if self.__suites_require and not ((self.__suites_require & member_suites) == self.__suites_require):
+            if not suites_selected(
+                    self.suites(member),
+                    self.__suites_include,
+                    self.__suites_exclude,
+                    self.__suites_require,
+            ):
                 continue
 
             # if there are any name overrides, only run the named methods
@@ -351,8 +462,13 @@ class TestCase(six.with_metaclass(MetaTestCase, object)):
         self.__callbacks[event].append(callback)
 
     def fire_event(self, event, result):
-        for callback in self.__callbacks[event]:
-            callback(result.to_dict())
+        callbacks = self.__callbacks[event]
+        if not callbacks:
+            return
+        result_dict = result.to_dict()
+        for callback in callbacks:
+            # Reporters add keys to their result dicts, so each gets a copy.
+            callback(dict(result_dict))
 
     def classSetUp(self):
         pass
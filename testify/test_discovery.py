@@ -27,6 +27,10 @@ class DiscoveryError(TestifyError):
     pass
 
 
+# Keyed on (module path, class name), classes found by import_test_class.
+_test_class_cache = {}
+
+
 def to_module(path):
     path = os.path.relpath(path)
 
@@ -48,27 +52,40 @@ def get_parent_module_suites(mod):
         return set(getattr(sys.modules[parent_mod_path], '_suites', set()))
 
 
-def get_test_classes_from_module(mod):
+def set_module_suites(mod):
     mod._suites = (
         set(getattr(mod, '_suites', set())) | get_parent_module_suites(mod)
     )
 
-    for _, cls in inspect.getmembers(mod, inspect.isclass):
-        # Skip things that are only there due to a side-effect of importing
-        if cls.__module__ != mod.__name__:
-            continue
 
-        # Skip tests that have __test __ = False
-        if not cls.__dict__.get('__test__', True):
-            continue
+def get_test_classes_from_module(mod):
+    set_module_suites(mod)
 
-        if isinstance(cls, MetaTestCase):
-            cls._suites = set(getattr(cls, '_suites', set())) | mod._suites
-            yield cls
-        elif issubclass(cls, unittest.TestCase):
-            yield TestifiedUnitTest.from_unittest_case(
-                cls, module_suites=mod._suites,
-            )
+    for _, cls in inspect.getmembers(mod, inspect.isclass):
+        test_class = get_test_class(mod, cls)
+        if test_class is not None:
+            yield test_class
+
+
+def get_test_class(mod, cls):
+    """Return the TestCase to run for class `cls` in module `mod` (whose
+    _suites have been set), or None if it isn't a test class defined there."""
+    # Skip things that are only there due to a side-effect of importing
+    if cls.__module__ != mod.__name__:
+        return None
+
+    # Skip tests that have __test __ = False
+    if not cls.__dict__.get('__test__', True):
+        return None
+
+    if isinstance(cls, MetaTestCase):
+        cls._suites = set(getattr(cls, '_suites', set())) | mod._suites
+        return cls
+    elif issubclass(cls, unittest.TestCase):
+        return TestifiedUnitTest.from_unittest_case(
+            cls, module_suites=mod._suites,
+        )
+    return None
 
 
 def discover(what):
@@ -108,8 +125,49 @@ def discover(what):
 
 
 def import_test_class(module_path, class_name):
-    for klass in discover(module_path):
-        if klass.__name__ == class_name:
-            return klass
+    """Return the TestCase class named class_name which discover(module_path)
+    would find. unittest classes go by their Testified* names.
 
-    raise DiscoveryError(class_name)
+    Classes are cached, so each is only looked up once per process, and are
+    looked up by name rather than discovering the whole module where possible.
+    """
+    key = (module_path, class_name)
+    if key not in _test_class_cache:
+        klass = _get_test_class_by_name(module_path, class_name)
+        if klass is None:
+            for klass in discover(module_path):
+                if klass.__name__ == class_name:
+                    break
+            else:
+                raise DiscoveryError(class_name)
+        _test_class_cache[key] = klass
+
+    return _test_class_cache[key]
+
+
+def _get_test_class_by_name(module_path, class_name):
+    """import_test_class's fast path: look class_name up directly on its
+    module. Returns None if that doesn't find it, including when module_path
+    is a package, whose submodules would all have to be searched."""
+    try:
+        mod = __import__(to_module(module_path), fromlist=[str('__trash')])
+    except Exception:
+        # Let discover() report the error.
+        return None
+    if hasattr(mod, '__path__'):
+        return None
+
+    cls = getattr(mod, class_name, None)
+    if not inspect.isclass(cls) and class_name.startswith('Testified'):
+        # A unittest.TestCase, which get_test_class converts to a TestCase named Testified<name>.
+        cls = getattr(mod, class_name[len('Testified'):], None)
+        if inspect.isclass(cls) and isinstance(cls, MetaTestCase):
+            return None
+    if not inspect.isclass(cls):
+        return None
+
+    set_module_suites(mod)
+    test_class = get_test_class(mod, cls)
+    if test_class is None or test_class.__name__ != class_name:
+        return None
+    return test_class
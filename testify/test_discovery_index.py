@@ -0,0 +1,207 @@
+"""
+An on-disk index of what test discovery found in each module, so that listing,
+bucketing and enqueueing tests don't have to import modules which haven't
+changed since the last run.
+
+Each module's entry records its TestCase classes, their test method names and
+the suites of each method, along with the files the entry depends on: the
+module itself, its parent packages (which can contribute module-level suites)
+and the source of every class in each TestCase's MRO (which can contribute
+inherited test methods). An entry is only reused if none of those files have
+changed, going by mtime and size, or by content hash when only the mtime
+moved.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import inspect
+import os
+import pkgutil
+import traceback
+
+import six
+
+if not six.PY2:
+    import importlib.util
+
+try:
+    import simplejson as json  # noqa
+except ImportError:
+    import json
+
+from . import test_discovery
+from .test_discovery import DiscoveryError
+
+INDEX_VERSION = 2
+
+
+def _file_md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def _module_file(module_name):
+    """Return (filename, is_package) for a module, without importing it
+    (parent packages do get imported)."""
+    if six.PY2:
+        loader = pkgutil.get_loader(module_name)
+        if loader is None:
+            raise DiscoveryError('No module named %s' % module_name)
+        return loader.get_filename(module_name), loader.is_package(module_name)
+
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except ImportError:
+        # A parent package is missing.
+        spec = None
+    if spec is None or spec.origin is None:
+        raise DiscoveryError('No module named %s' % module_name)
+    return spec.origin, spec.submodule_search_locations is not None
+
+
+def iter_module_names(what):
+    """Yield the module names test_discovery.discover(what) would scan."""
+    filename, is_package = _module_file(what)
+    if not is_package:
+        yield what
+        return
+
+    def walk(path, prefix):
+        for _, module_name, is_subpackage in pkgutil.iter_modules([path], prefix):
+            yield module_name
+            if is_subpackage:
+                for name in walk(os.path.join(path, module_name.rpartition('.')[2]), module_name + '.'):
+                    yield name
+
+    for module_name in walk(os.path.dirname(filename), what + '.'):
+        yield module_name
+
+
+def build_class_manifest(test_case_class):
+    """Describe a TestCase class as a dict of plain data: its module and name,
+    the suites of each of its test methods, and whether it has class fixtures.
+
+    The class is instantiated so methods generated in __init__ are included.
+    """
+    test_case = test_case_class()
+    methods = {}
+    for member_name in dir(test_case):
+        if not member_name.startswith('test'):
+            continue
+        member = getattr(test_case, member_name)
+        if not inspect.ismethod(member):
+            continue
+        methods[member_name] = sorted(test_case.suites(member))
+
+    return {
+        'module': test_case_class.__module__,
+        'class': test_case_class.__name__,
+        'methods': methods,
+        'class_fixtures': test_case_class._has_class_fixtures(),
+    }
+
+
+class DiscoveryIndex(object):
+    """Module path -> discovered test classes, persisted as JSON at `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        self.modules = {}
+        self.dirty = False
+
+        if os.path.exists(path):
+            with open(path) as f:
+                try:
+                    data = json.load(f)
+                except ValueError:
+                    data = {}
+            if data.get('version') == INDEX_VERSION:
+                self.modules = data['modules']
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        # Write and rename, so concurrent bucket processes never see half an index.
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'modules': self.modules}, f)
+        os.rename(tmp_path, self.path)
+        self.dirty = False
+
+    def _is_fresh(self, entry):
+        for path, (mtime, size, md5) in entry['deps'].items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+
+            if stat.st_size != size:
+                return False
+            if stat.st_mtime != mtime:
+                # A checkout or touch can move the mtime without changing anything.
+                if _file_md5(path) != md5:
+                    return False
+                entry['deps'][path] = [stat.st_mtime, size, md5]
+                self.dirty = True
+        return True
+
+    def _index_module(self, module_name, filename):
+        """Import a module and record what discovery finds in it."""
+        mod = __import__(module_name, fromlist=[str('__trash')])
+
+        dep_paths = set([os.path.abspath(filename)])
+
+        parent_name = module_name.rpartition('.')[0]
+        while parent_name:
+            dep_paths.add(os.path.abspath(_module_file(parent_name)[0]))
+            parent_name = parent_name.rpartition('.')[0]
+
+        classes = []
+        for test_case_class in test_discovery.get_test_classes_from_module(mod):
+            for klass in inspect.getmro(test_case_class):
+                try:
+                    dep_paths.add(os.path.abspath(inspect.getsourcefile(klass)))
+                except TypeError:
+                    # builtins, like object
+                    pass
+            classes.append(build_class_manifest(test_case_class))
+
+        deps = {}
+        for path in dep_paths:
+            stat = os.stat(path)
+            deps[path] = [stat.st_mtime, stat.st_size, _file_md5(path)]
+
+        self.modules[module_name] = {
+            'deps': deps,
+            'classes': sorted(classes, key=lambda manifest: manifest['class']),
+        }
+        self.dirty = True
+
+    def discover(self, what):
+        """Return class manifests (see build_class_manifest) for everything
+        test_discovery.discover(what) would find, only importing modules whose
+        entries are missing or stale.
+        """
+        try:
+            what = test_discovery.to_module(what)
+            manifests = []
+            for module_name in iter_module_names(what):
+                entry = self.modules.get(module_name)
+                if entry is None or not self._is_fresh(entry):
+                    self._index_module(module_name, _module_file(module_name)[0])
+                    entry = self.modules[module_name]
+                manifests.extend(entry['classes'])
+        except DiscoveryError:
+            raise
+        except Exception:
+            traceback.print_exc()
+            raise DiscoveryError(
+                (
+                    '\n    ' +
+                    traceback.format_exc().replace('\n', '\n    ')
+                ).rstrip()
+            )
+
+        self.save()
+        return manifests
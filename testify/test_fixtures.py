@@ -1,5 +1,7 @@
 __testify = 1
+import collections
 import contextlib
+import functools
 import inspect
 import sys
 
@@ -45,6 +47,67 @@ SETUP_FIXTURES = ['setup', 'class_setup']
 HYBRID_FIXTURES = ['setup_teardown', 'class_setup_teardown']
 
 
+# A fixture, as planned once per TestCase class: `function` is bound to each
+# instance to give a generator fixture (see TestFixtures.plan_for).
+FixtureDescriptor = collections.namedtuple(
+    'FixtureDescriptor',
+    ['function', 'fixture_type', 'fixture_id', 'defining_class_depth'],
+)
+FixturePlan = collections.namedtuple('FixturePlan', ['class_fixtures', 'instance_fixtures'])
+
+
+def _sort_key(fixture_type, fixture_id, defining_class_depth):
+    """Use class depth, fixture type and fixture id to define
+    a sortable key for fixtures.
+
+    Class depth is the most significant value and defines the
+    MRO (reverse mro for teardown methods) order. Fixture type
+    and fixture id help us to define the expected order.
+
+    See
+    test.test_case_test.FixtureMethodRegistrationOrderWithBaseClassTest
+    for the expected order.
+    """
+    fixture_order = {
+        'class_setup': 0,
+        'class_teardown': 1,
+        'class_setup_teardown': 2,
+
+        'setup': 3,
+        'teardown': 4,
+        'setup_teardown': 5,
+    }
+
+    if fixture_type in REVERSED_FIXTURE_TYPES:
+        # class_teardown fixtures should be run in reverse
+        # definition order (last definition runs
+        # first). Converting fixture_id to its negative
+        # value will sort class_teardown fixtures in the
+        # same class in reversed order.
+        return (defining_class_depth, fixture_order[fixture_type], -fixture_id)
+
+    return (defining_class_depth, fixture_order[fixture_type], fixture_id)
+
+
+def _enter_generator(generator):
+    """Run a generator fixture's setup half, as contextmanager.__enter__ would."""
+    try:
+        next(generator)
+    except StopIteration:
+        raise RuntimeError("generator didn't yield")
+
+
+def _exit_generator(generator):
+    """Run the remainder of a generator fixture. This finishes the generator
+    without contextmanager.__exit__, which would mess up the stack trace we end
+    up with.
+    """
+    try:
+        next(generator)
+    except StopIteration:
+        pass
+
+
 class TestFixtures(object):
     """
     Handles all the juggling of actual fixture methods and the context they are
@@ -64,6 +127,46 @@ class TestFixtures(object):
             self.ensure_generator(f) for f in instance_fixtures
         )
 
+    @classmethod
+    def from_plan(cls, fixture_plan, test_case):
+        """Bind a FixturePlan (see plan_for) to a TestCase instance."""
+        test_fixtures = cls.__new__(cls)
+        test_fixtures.class_fixtures = [
+            descriptor.function.__get__(test_case, type(test_case))
+            for descriptor in fixture_plan.class_fixtures
+        ]
+        test_fixtures.instance_fixtures = [
+            descriptor.function.__get__(test_case, type(test_case))
+            for descriptor in fixture_plan.instance_fixtures
+        ]
+        return test_fixtures
+
+    @staticmethod
+    def generator_function(fixture, fixture_type, fixture_id, defining_class_depth):
+        """Like ensure_generator, but for an unbound fixture: returns a
+        function which, once bound, is a generator fixture.
+        """
+        if fixture_type in HYBRID_FIXTURES:
+            # already a context manager, nothing to do
+            return fixture
+
+        def wrapper(self):
+            bound_fixture = fixture.__get__(self, type(self))
+            if fixture_type in SETUP_FIXTURES:
+                bound_fixture()
+                yield
+            elif fixture_type in TEARDOWN_FIXTURES:
+                yield
+                bound_fixture()
+
+        function = getattr(fixture, '__func__', fixture)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper._fixture_type = fixture_type
+        wrapper._fixture_id = fixture_id
+        wrapper._defining_class_depth = defining_class_depth
+        return wrapper
+
     def ensure_generator(self, fixture):
         if fixture._fixture_type in HYBRID_FIXTURES:
             # already a context manager, nothing to do
@@ -100,85 +203,86 @@ class TestFixtures(object):
 
     @contextlib.contextmanager
     def enter(self, fixtures, setup_callbacks=None, teardown_callbacks=None, stop_setups=False):
-        """Transform each fixture_method into a context manager, enter them
-        recursively, and yield any failures.
+        """Enter each fixture_method (as a generator) in order, yield any
+        failures, then exit them in reverse order.
 
         `stop_setups` is set after a setup fixture fails. This flag prevents
         more setup fixtures from being added to the onion after a failure as we
-        recurse through the list of fixtures.
-        """
-
-        # base case
-        if not fixtures:
-            yield []
-            return
+        go through the list of fixtures.
 
+        This is equivalent to nesting a contextmanager per fixture, but keeps
+        the fixtures on an explicit stack so deep fixture lists don't cost
+        deep call stacks.
+        """
         setup_callbacks = setup_callbacks or [None, None]
         teardown_callbacks = teardown_callbacks or [None, None]
 
-        fixture = fixtures[0]
+        # (fixture, generator, stop_setups as of entering it, its enter failures)
+        entered = []
+
+        for fixture in fixtures:
+            generator = fixture()
+
+            # if a previous setup fixture failed, stop running new setup
+            # fixtures.  this doesn't apply to teardown fixtures, however,
+            # because behind the scenes they're setup_teardowns, and we need
+            # to run the (empty) setup portion in order to get the teardown
+            # portion later.
+            if not stop_setups or fixture._fixture_type in TEARDOWN_FIXTURES:
+                # class_teardown fixture is wrapped as
+                # class_setup_teardown. We should not fire events for the
+                # setup phase of this fake context manager.
+                suppress_callbacks = fixture._fixture_type in TEARDOWN_FIXTURES
+                enter_failures = self.run_fixture(
+                    fixture,
+                    functools.partial(_enter_generator, generator),
+                    enter_callback=None if suppress_callbacks else setup_callbacks[0],
+                    exit_callback=None if suppress_callbacks else setup_callbacks[1],
+                )
+                # keep skipping setups once we've had a failure
+                stop_setups = stop_setups or bool(enter_failures)
+            else:
+                # we skipped the setup, pretend like nothing happened.
+                enter_failures = None
+
+            entered.append((fixture, generator, stop_setups, enter_failures))
+
+        # failures are reported innermost fixture first
+        all_failures = []
+        for _, _, _, enter_failures in reversed(entered):
+            all_failures += enter_failures or []
 
-        ctm = contextlib.contextmanager(fixture)()
+        # need to only yield one failure
+        yield all_failures
+
+        while entered:
+            fixture, generator, fixture_stop_setups, _ = entered.pop()
+
+            # this setup fixture got skipped due to an earlier setup fixture
+            # failure, or failed itself. all of these fixtures are basically
+            # represented by setup_teardowns, but because we never ran this setup,
+            # we have nothing to do for teardown (if we did visit it here, that
+            # would have the effect of running the setup we just skipped), so
+            # instead move on to the next fixture on the stack.
+            #
+            # (skipped setup_teardowns *are* visited, so their setup half runs
+            # here; the recursive version of this method did the same.)
+            if fixture_stop_setups and fixture._fixture_type in SETUP_FIXTURES:
+                continue
 
-        # class_teardown fixture is wrapped as
-        # class_setup_teardown. We should not fire events for the
-        # setup phase of this fake context manager.
-        suppress_callbacks = bool(fixture._fixture_type in TEARDOWN_FIXTURES)
+            # class_setup fixture is wrapped as
+            # class_setup_teardown. We should not fire events for the
+            # teardown phase of this fake context manager.
+            suppress_callbacks = fixture._fixture_type in SETUP_FIXTURES
 
-        # if a previous setup fixture failed, stop running new setup
-        # fixtures.  this doesn't apply to teardown fixtures, however,
-        # because behind the scenes they're setup_teardowns, and we need
-        # to run the (empty) setup portion in order to get the teardown
-        # portion later.
-        if not stop_setups or fixture._fixture_type in TEARDOWN_FIXTURES:
-            enter_failures = self.run_fixture(
+            exit_failures = self.run_fixture(
                 fixture,
-                ctm.__enter__,
-                enter_callback=None if suppress_callbacks else setup_callbacks[0],
-                exit_callback=None if suppress_callbacks else setup_callbacks[1],
+                functools.partial(_exit_generator, generator),
+                enter_callback=None if suppress_callbacks else teardown_callbacks[0],
+                exit_callback=None if suppress_callbacks else teardown_callbacks[1],
             )
-            # keep skipping setups once we've had a failure
-            stop_setups = stop_setups or bool(enter_failures)
-        else:
-            # we skipped the setup, pretend like nothing happened.
-            enter_failures = []
 
-        with self.enter(fixtures[1:], setup_callbacks, teardown_callbacks, stop_setups) as all_failures:
-            all_failures += enter_failures or []
-            # need to only yield one failure
-            yield all_failures
-
-        # this setup fixture got skipped due to an earlier setup fixture
-        # failure, or failed itself. all of these fixtures are basically
-        # represented by setup_teardowns, but because we never ran this setup,
-        # we have nothing to do for teardown (if we did visit it here, that
-        # would have the effect of running the setup we just skipped), so
-        # instead bail out and move on to the next fixture on the stack.
-        if stop_setups and fixture._fixture_type in SETUP_FIXTURES:
-            return
-
-        # class_setup fixture is wrapped as
-        # class_setup_teardown. We should not fire events for the
-        # teardown phase of this fake context manager.
-        suppress_callbacks = bool(fixture._fixture_type in SETUP_FIXTURES)
-
-        # this is hack to finish the remainder of the context manager without
-        # calling contextlib's __exit__; doing that messes up the stack trace
-        # we end up with.
-        def exit():
-            try:
-                next(ctm.gen)
-            except StopIteration:
-                pass
-
-        exit_failures = self.run_fixture(
-            fixture,
-            exit,
-            enter_callback=None if suppress_callbacks else teardown_callbacks[0],
-            exit_callback=None if suppress_callbacks else teardown_callbacks[1],
-        )
-
-        all_failures += exit_failures or []
+            all_failures += exit_failures or []
 
     def run_fixture(self, fixture, function_to_call, enter_callback=None, exit_callback=None):
         result = TestResult(fixture)
@@ -198,45 +302,25 @@ class TestFixtures(object):
                 exit_callback(result)
 
     def sort(self, fixtures):
-
-        def key(fixture):
-            """Use class depth, fixture type and fixture id to define
-            a sortable key for fixtures.
-
-            Class depth is the most significant value and defines the
-            MRO (reverse mro for teardown methods) order. Fixture type
-            and fixture id help us to define the expected order.
-
-            See
-            test.test_case_test.FixtureMethodRegistrationOrderWithBaseClassTest
-            for the expected order.
-            """
-            fixture_order = {
-                'class_setup': 0,
-                'class_teardown': 1,
-                'class_setup_teardown': 2,
-
-                'setup': 3,
-                'teardown': 4,
-                'setup_teardown': 5,
-            }
-
-            if fixture._fixture_type in REVERSED_FIXTURE_TYPES:
-                # class_teardown fixtures should be run in reverse
-                # definition order (last definition runs
-                # first). Converting fixture_id to its negative
-                # value will sort class_teardown fixtures in the
-                # same class in reversed order.
-                return (fixture._defining_class_depth, fixture_order[fixture._fixture_type], -fixture._fixture_id)
-
-            return (fixture._defining_class_depth, fixture_order[fixture._fixture_type], fixture._fixture_id)
-
-        return sorted(fixtures, key=key)
+        return sorted(
+            fixtures,
+            key=lambda fixture: _sort_key(fixture._fixture_type, fixture._fixture_id, fixture._defining_class_depth),
+        )
 
     @classmethod
     def discover_from(cls, test_case):
         """Initialize and populate the lists of fixture methods for this TestCase.
 
+        TestCase instances get their plan from MetaTestCase, which caches it
+        per class; this computes it afresh.
+        """
+        return cls.from_plan(cls.plan_for(type(test_case)), test_case)
+
+    @classmethod
+    def plan_for(cls, test_case_class):
+        """Find and order the fixture methods of a TestCase class, returning a
+        FixturePlan which TestFixtures.from_plan binds to instances.
+
         Fixture methods are identified by the fixture_decorator_factory when the
         methods are created. This means in order to figure out all the fixtures
         this particular TestCase will need, we have to test all of its attributes
@@ -251,7 +335,7 @@ class TestFixtures(object):
 
         # the list of classes in our heirarchy, starting with the highest class
         # (object), and ending with our class
-        reverse_mro_list = [x for x in reversed(type(test_case).mro())]
+        reverse_mro_list = [x for x in reversed(test_case_class.mro())]
 
         # discover which fixures are on this class, including mixed-in ones
 
@@ -259,7 +343,7 @@ class TestFixtures(object):
         # from bases), but we don't want to trigger any lazily loaded
         # attributes, so dir() isn't an option; this traverses __bases__/__dict__
         # correctly for us.
-        for classified_attr in inspect.classify_class_attrs(type(test_case)):
+        for classified_attr in inspect.classify_class_attrs(test_case_class):
             # have to index here for Python 2.5 compatibility
             attr_name = classified_attr[0]
             unbound_method = classified_attr[3]
@@ -285,21 +369,48 @@ class TestFixtures(object):
                     defining_class_depth,
                 )
 
-                # we grabbed this from the class and need to bind it to the
-                # test case
+                # instances bind what we grabbed from the class
                 # http://stackoverflow.com/q/4364565
-                instance_method = unbound_method.__get__(test_case, type(test_case))
-                all_fixtures[instance_method._fixture_type].append(instance_method)
+                class_method = unbound_method.__get__(None, test_case_class)
+                fixture_type = class_method._fixture_type
+                all_fixtures[fixture_type].append(FixtureDescriptor(
+                    # We convert all class-level fixtures to
+                    # class_setup_teardown fixtures; see __init__.
+                    function=cls.generator_function(
+                        unbound_method,
+                        fixture_type,
+                        class_method._fixture_id,
+                        defining_class_depth,
+                    ),
+                    fixture_type=fixture_type,
+                    fixture_id=class_method._fixture_id,
+                    defining_class_depth=defining_class_depth,
+                ))
 
         class_level = ['class_setup', 'class_teardown', 'class_setup_teardown']
         inst_level = ['setup', 'teardown', 'setup_teardown']
 
-        return cls(
-            class_fixtures=sum([all_fixtures[typ] for typ in class_level], []),
-            instance_fixtures=sum([all_fixtures[typ] for typ in inst_level], []),
+        def plan(fixture_types):
+            return tuple(sorted(
+                sum([all_fixtures[typ] for typ in fixture_types], []),
+                key=lambda descriptor: _sort_key(
+                    descriptor.fixture_type,
+                    descriptor.fixture_id,
+                    descriptor.defining_class_depth,
+                ),
+            ))
+
+        return FixturePlan(
+            class_fixtures=plan(class_level),
+            instance_fixtures=plan(inst_level),
         )
 
 
+# Bumped whenever suite() adds suites to a function, so that TestCases know to
+# filter their runnable test methods again (see runnable_test_methods).
+suites_generation = [0]
+
+
 def suite(*args, **kwargs):
     """Decorator to conditionally assign suites to individual test methods.
 
@@ -316,6 +427,7 @@ def suite(*args, **kwargs):
             function._suites = set()
         if args and (conditions is None or bool(conditions) is True):
             function._suites = set(function._suites) | set(args)
+            suites_generation[0] += 1
             if reason:
                 if not hasattr(function, '_suite_reasons'):
                     function._suite_reasons = []
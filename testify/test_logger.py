@@ -117,6 +117,10 @@ class TestLoggerBase(test_reporter.TestReporter):
 
 
 class TextTestLogger(TestLoggerBase):
+    @property
+    def uses_pretty_exception_info(self):
+        return self.use_color
+
     def __init__(self, options, stream=sys.stdout):
         super(TextTestLogger, self).__init__(options, stream)
 
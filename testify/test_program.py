@@ -25,6 +25,11 @@ import sys
 import logging
 import imp
 
+try:
+    import simplejson as json  # noqa
+except ImportError:
+    import json
+
 import testify
 from testify import test_logger
 from testify.test_runner import TestRunner
@@ -57,6 +62,40 @@ def get_bucket_overrides(filename):
     return overrides
 
 
+def get_bucket_timings(filenames):
+    """Returns a map from test class name to its historical run time in seconds.
+
+    test class name: {test module}.{classname}
+
+    Each file holds one JSON test result dict per line. Per-class results (from
+    --test-case-results) are used as they are; per-method results (from
+    --json-results) are added up for each class. Later lines win.
+    """
+    class_timings = {}
+    method_timings = {}
+    for filename in filenames:
+        with open(filename) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line == 'RUN COMPLETE':
+                    continue
+                result = json.loads(line)
+                if result.get('run_time') is None:
+                    continue
+
+                test_module_and_class = '%s.%s' % (result['method']['module'], result['method']['class'])
+                if result['method']['name'] == 'run':
+                    class_timings[test_module_and_class] = result['run_time']
+                else:
+                    method_timings[(test_module_and_class, result['method']['name'])] = result['run_time']
+
+    timings = defaultdict(float)
+    for (test_module_and_class, _), run_time in method_timings.items():
+        timings[test_module_and_class] += run_time
+    timings.update(class_timings)
+    return dict(timings)
+
+
 def load_plugins():
     """Load any plugin modules
 
@@ -128,7 +167,41 @@ def default_parser():
     parser.add_option("--bucket", action="store", dest="bucket", type="int")
     parser.add_option("--bucket-count", action="store", dest="bucket_count", type="int")
     parser.add_option("--bucket-overrides-file", action="store", dest="bucket_overrides_file", default=None)
-    parser.add_option("--bucket-salt", action="store", dest="bucket_salt", default=None)
+    parser.add_option(
+        "--bucket-salt",
+        action="store",
+        dest="bucket_salt",
+        default=None,
+        help="Deterministically reshuffle test cases of similar size between buckets",
+    )
+    parser.add_option(
+        "--bucket-timings-file",
+        action="append",
+        dest="bucket_timings_files",
+        type="string",
+        default=[],
+        metavar="FILE",
+        help=(
+            "Balance buckets by historical run time instead of test count. FILE "
+            "is the output of a previous --json-results or --test-case-results "
+            "run. May be passed multiple times."
+        ),
+    )
+
+    parser.add_option(
+        "--discovery-index",
+        action="store",
+        dest="discovery_index",
+        type="string",
+        default=None,
+        metavar="FILE",
+        help=(
+            "Remember what test discovery found in each module in FILE, and "
+            "don't import modules which haven't changed when listing or "
+            "enqueueing tests. With --bucket, only this bucket's modules are "
+            "imported."
+        ),
+    )
 
     parser.add_option("--summary", action="store_true", dest="summary_mode")
     parser.add_option("--no-color", action="store_true", dest="disable_color", default=bool(not os.isatty(sys.stdout.fileno())))
@@ -152,6 +225,28 @@ def default_parser():
         default=None,
         help="Run in server mode, listening on this port for testify clients.",
     )
+    parser.add_option(
+        '--journal',
+        action="store",
+        dest="journal",
+        type="string",
+        default=None,
+        metavar="FILE",
+        help=(
+            "With --serve, record each test case's results in FILE as they're "
+            "reported, so the run can be picked up again with --resume."
+        ),
+    )
+    parser.add_option(
+        '--resume',
+        action="store_true",
+        dest="resume",
+        default=False,
+        help=(
+            "With --serve and --journal, carry on with the run recorded in the "
+            "journal, only running tests whose results weren't reported yet."
+        ),
+    )
     parser.add_option(
         '--connect',
         action="store",
@@ -205,12 +300,79 @@ def default_parser():
         default=10,
         help="Number of seconds to try reconnecting to the server before exiting if we have previously connected.",
     )
+    parser.add_option(
+        '--prefetch',
+        action="store_true",
+        dest="prefetch",
+        default=False,
+        help="With --connect, check out the next test cases from the server while running the current ones.",
+    )
+    parser.add_option(
+        '--prefetch-imports',
+        action="store_true",
+        dest="prefetch_imports",
+        default=False,
+        help="With --prefetch, also import the next test cases' modules while running the current ones.",
+    )
+    parser.add_option(
+        '--heartbeat-interval',
+        action="store",
+        dest="heartbeat_interval",
+        type="float",
+        default=3,
+        help=(
+            "With --connect, tell the server this often (in seconds) that we're still alive, "
+            "so it can quickly requeue the tests of runners which die. 0 to disable."
+        ),
+    )
+    parser.add_option(
+        '--batch-size',
+        action="store",
+        dest="batch_size",
+        type="int",
+        default=None,
+        metavar="N",
+        help=(
+            "With --connect, check out up to N test cases per request to the "
+            "server (default 1, or no limit with --batch-seconds)."
+        ),
+    )
+    parser.add_option(
+        '--batch-seconds',
+        action="store",
+        dest="batch_seconds",
+        type="float",
+        default=None,
+        help=(
+            "With --connect, check out test cases until their estimated run "
+            "time (from the server's bucket timings) would exceed this many seconds."
+        ),
+    )
     parser.add_option(
         '--disable-requeueing',
         action="store_true",
         dest="disable_requeueing",
         help="Disable re-queueing/re-running failed tests on a different builder.",
     )
+    parser.add_option(
+        '--disable-speculation',
+        action="store_true",
+        dest="disable_speculation",
+        help=(
+            "Disable giving idle builders copies of test cases which are taking much longer than "
+            "expected, or parts of test cases without class fixtures, at the end of the run."
+        ),
+    )
+
+    parser.add_option(
+        '--workers',
+        action="store",
+        dest="workers",
+        type="int",
+        default=None,
+        metavar="N",
+        help="Run test cases in N local worker processes, reporting their results from this process.",
+    )
 
     parser.add_option(
         '--failure-limit',
@@ -228,6 +390,19 @@ def default_parser():
         default=300,
         help="How long to wait to wait for activity from a test runner before requeuing the tests it has checked out.",
     )
+    parser.add_option(
+        '--heartbeat-timeout',
+        action="store",
+        dest="heartbeat_timeout",
+        type="float",
+        default=60,
+        help=(
+            "How long to wait for a heartbeat from a test runner which has sent them before "
+            "treating it as dead and requeueing the tests it has checked out. 0 to disable. "
+            "Heartbeats are sent from a thread in the process running the tests, so leave room "
+            "for tests which hold the GIL for a while."
+        ),
+    )
     parser.add_option(
         '--server-timeout',
         action="store",
@@ -237,6 +412,17 @@ def default_parser():
         help="How long to wait after the last activity from any test runner before shutting down.",
     )
 
+    parser.add_option(
+        '--server-reporting-queue-size',
+        action="store",
+        dest="reporting_queue_size",
+        type="int",
+        default=10000,
+        help=(
+            "How many results the server may have waiting for its reporters, which it runs in a "
+            "thread of their own. 0 to run them inline instead, holding up test runners while they do."
+        ),
+    )
     parser.add_option(
         '--server-shutdown-delay',
         action='store',
@@ -291,6 +477,18 @@ def default_parser():
             "with --replay-json, inline results get reported first."
         ),
     )
+    parser.add_option(
+        '--replay-spool',
+        action="store",
+        dest="replay_spool",
+        type="string",
+        default=None,
+        metavar="FILE",
+        help=(
+            "Instead of discovering and running tests, insert the results left "
+            "in a --sql-spool FILE into the reporting database."
+        ),
+    )
 
     parser.add_option(
         '--rerun-test-file',
@@ -325,7 +523,8 @@ def parse_test_runner_command_line_args(plugin_modules, args):
                 options.connect_addr or
                 options.rerun_test_file or
                 options.replay_json or
-                options.replay_json_inline
+                options.replay_json_inline or
+                options.replay_spool
             )
     ):
         parser.error("Test path required unless --connect or --rerun-test-file specified.")
@@ -333,6 +532,15 @@ def parse_test_runner_command_line_args(plugin_modules, args):
     if options.connect_addr and options.serve_port:
         parser.error("--serve and --connect are mutually exclusive.")
 
+    if options.resume and not (options.serve_port and options.journal):
+        parser.error("--resume requires --serve and --journal.")
+
+    if options.prefetch_imports and not options.prefetch:
+        parser.error("--prefetch-imports requires --prefetch.")
+
+    if options.workers and options.debugger:
+        parser.error("--workers and --ipdb are mutually exclusive.")
+
     test_path, module_method_overrides = _parse_test_runner_command_line_module_method_overrides(args)
 
     if pwd and pwd.getpwuid(os.getuid()).pw_name == 'buildbot':
@@ -351,6 +559,7 @@ def parse_test_runner_command_line_args(plugin_modules, args):
         'suites_exclude': options.suites_exclude,
         'suites_require': options.suites_require,
         'failure_limit': options.failure_limit,
+        'discovery_index': options.discovery_index,
         'module_method_overrides': module_method_overrides,
         'options': options,
         'plugin_modules': plugin_modules
@@ -413,6 +622,10 @@ class TestProgram(object):
         """Run testify, return True on success, False on failure."""
         self.setup_logging(self.other_opts)
 
+        if self.other_opts.replay_spool:
+            from .plugins.sql_reporter import replay_spool
+            return replay_spool(self.other_opts)
+
         bucket_overrides = {}
         if self.other_opts.bucket_overrides_file:
             bucket_overrides = get_bucket_overrides(self.other_opts.bucket_overrides_file)
@@ -435,6 +648,10 @@ class TestProgram(object):
             from .test_rerunner import TestRerunner
             test_runner_class = TestRerunner
             self.test_runner_args['rerun_test_file'] = self.other_opts.rerun_test_file
+        elif self.other_opts.workers:
+            from .test_runner_multiprocess import TestRunnerMultiprocess
+            test_runner_class = TestRunnerMultiprocess
+            self.test_runner_args['workers'] = self.other_opts.workers
         else:
             test_runner_class = TestRunner
 
@@ -443,9 +660,14 @@ class TestProgram(object):
             self.other_opts, self.test_runner_args['plugin_modules']
         )
 
+        bucket_timings = {}
+        if self.other_opts.bucket_timings_files:
+            bucket_timings = get_bucket_timings(self.other_opts.bucket_timings_files)
+
         runner = test_runner_class(
             self.test_path,
             bucket_overrides=bucket_overrides,
+            bucket_timings=bucket_timings,
             bucket_count=self.other_opts.bucket_count,
             bucket_salt=self.other_opts.bucket_salt,
             bucket=self.other_opts.bucket,
@@ -19,6 +19,10 @@ class TestReporter(object):
     A TestReporter is configured as a callback for each test case by test_runner.
     """
 
+    # Whether this reporter reads results' exception_info_pretty. If no
+    # reporter on a TestRunnerServer does, clients needn't send it.
+    uses_pretty_exception_info = True
+
     def __init__(self, options):
         """Constructor
 
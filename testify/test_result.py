@@ -43,6 +43,17 @@ except ImportError:
     fancy_tb_formatter = None
 
 
+# Run times come from a monotonic clock, so they don't jump with the wall clock.
+try:
+    _monotonic_ns = time.perf_counter_ns
+except AttributeError:
+    # PY2 / PY3 < 3.7
+    _perf_counter = getattr(time, 'perf_counter', time.time)
+
+    def _monotonic_ns():
+        return int(_perf_counter() * 1000000000)
+
+
 def plain_tb_formatter(etype, value, tb, length=None):
     # We want our formatters to return a string.
     return ''.join(traceback.format_exception(etype, value, tb, length))
@@ -56,11 +67,18 @@ class TestResult(object):
         self.test_method = test_method
         self.test_method_name = test_method.__name__
         self.success = self.failure = self.error = self.interrupted = None
+        # start_time and end_time are datetimes, run_time a timedelta; the
+        # _timestamp attributes are the same times as epoch seconds, and
+        # run_time_ns is the monotonic run time in nanoseconds.
         self.run_time = self.start_time = self.end_time = None
+        self.start_timestamp = self.end_timestamp = self.run_time_ns = None
+        self.__start_ns = None
         self.exception_infos = []
         self.complete = False
         self.previous_run = None
         self.runner_id = runner_id
+        # kind of formatting -> (number of exception_infos, formatted text)
+        self.__formatted_exceptions = {}
 
     @property
     def exception_info(self):
@@ -70,7 +88,9 @@ class TestResult(object):
 
     def start(self, previous_run=None):
         self.previous_run = previous_run
-        self.start_time = datetime.datetime.now()
+        self.start_timestamp = time.time()
+        self.start_time = datetime.datetime.fromtimestamp(self.start_timestamp)
+        self.__start_ns = _monotonic_ns()
 
     def record(self, function):
         """Excerpted code for executing a block of code that might raise an
@@ -113,8 +133,10 @@ class TestResult(object):
 
     def _complete(self):
         self.complete = True
-        self.end_time = datetime.datetime.now()
-        self.run_time = self.end_time - self.start_time
+        self.run_time_ns = _monotonic_ns() - self.__start_ns
+        self.run_time = datetime.timedelta(microseconds=self.run_time_ns / 1000.0)
+        self.end_timestamp = time.time()
+        self.end_time = datetime.datetime.fromtimestamp(self.end_timestamp)
 
     def end_in_failure(self, exception_info):
         if not self.complete:
@@ -155,11 +177,29 @@ class TestResult(object):
             #   http://docs.python.org/3.1/reference/simple_stmts.html#the-raise-statement
             return '\nDuring handling of the above exception, another exception occurred:\n\n'.join(result)
 
+    def __cached_format(self, kind, format_function):
+        """Formatting tracebacks is slow, and every reporter wants them, so
+        keep each kind of formatting until exception_infos changes."""
+        exception_count = len(self.exception_infos)
+        cached = self.__formatted_exceptions.get(kind)
+        if cached is None or cached[0] != exception_count:
+            cached = (exception_count, format_function())
+            self.__formatted_exceptions[kind] = cached
+        return cached[1]
+
     def format_exception_info(self, pretty=False):
         if not self.exception_infos:
             return None
 
-        tb_formatter = fancy_tb_formatter if (pretty and fancy_tb_formatter) else plain_tb_formatter
+        # Without IPython, pretty is the same as plain.
+        pretty = bool(pretty and fancy_tb_formatter)
+        return self.__cached_format(
+            'pretty' if pretty else 'plain',
+            lambda: self.__format_exception_info(pretty),
+        )
+
+    def __format_exception_info(self, pretty):
+        tb_formatter = fancy_tb_formatter if pretty else plain_tb_formatter
 
         def is_relevant_tb_level(tb):
             if '__testify' in tb.tb_frame.f_globals:
@@ -199,21 +239,18 @@ class TestResult(object):
         def formatter(exctype, value, tb):
             return ''.join(traceback.format_exception_only(exctype, value))
 
-        return self.__make_multi_error_message(formatter)
+        return self.__cached_format('only', lambda: self.__make_multi_error_message(formatter))
 
     def to_dict(self):
         test_method_self_t = type(six.get_method_self(self.test_method))
         assert not isinstance(test_method_self_t, type(None))
         return {
             'previous_run': self.previous_run,
-            'start_time': time.mktime(self.start_time.timetuple()) if self.start_time else None,
-            'end_time': time.mktime(self.end_time.timetuple()) if self.end_time else None,
-            'run_time': (
-                self.run_time.seconds + float(self.run_time.microseconds) / 1000000
-            ) if self.run_time is not None else None,
-            'normalized_run_time': None if not self.run_time else "%.2fs" % (
-                self.run_time.seconds + (self.run_time.microseconds / 1000000.0)
-            ),
+            'start_time': self.start_timestamp,
+            'end_time': self.end_timestamp,
+            'run_time': self.run_time_ns / 1000000000.0 if self.run_time_ns is not None else None,
+            'run_time_ns': self.run_time_ns,
+            'normalized_run_time': None if not self.run_time_ns else "%.2fs" % (self.run_time_ns / 1000000000.0),
             'complete': self.complete,
             'success': self.success,
             'failure': self.failure,
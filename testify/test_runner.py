@@ -21,15 +21,25 @@ __author__ = "Oliver Nicholas <bigo@yelp.com>"
 __testify = 1
 
 from collections import defaultdict
+import hashlib
+import heapq
 import itertools
 import functools
+import logging
+import math
 import pprint
 import sys
+import traceback
 
 import six
 
-from .test_case import MetaTestCase, TestCase
+from .test_case import MetaTestCase, TestCase, suites_selected
 from . import test_discovery
+from .test_discovery_index import DiscoveryIndex
+
+# With a bucket salt, test cases whose weights (method counts or run times)
+# are within this factor of each other may be shuffled relative to each other.
+SALT_BAND_RATIO = 1.5
 
 
 class TestRunner(object):
@@ -45,6 +55,7 @@ class TestRunner(object):
                  bucket_count=None,
                  bucket_overrides=None,
                  bucket_salt=None,
+                 bucket_timings=None,
                  debugger=None,
                  suites_include=(),
                  suites_exclude=(),
@@ -53,7 +64,8 @@ class TestRunner(object):
                  test_reporters=None,
                  plugin_modules=None,
                  module_method_overrides=None,
-                 failure_limit=None
+                 failure_limit=None,
+                 discovery_index=None,
                  ):
         """After instantiating a TestRunner, call run() to run them."""
 
@@ -62,6 +74,8 @@ class TestRunner(object):
         self.bucket_count = bucket_count
         self.bucket_overrides = bucket_overrides if bucket_overrides is not None else {}
         self.bucket_salt = bucket_salt
+        # Historical run time in seconds, keyed on MetaTestCase._cmp_str.
+        self.bucket_timings = bucket_timings if bucket_timings is not None else {}
 
         self.debugger = debugger
 
@@ -78,6 +92,29 @@ class TestRunner(object):
         self.failure_limit = failure_limit
         self.failure_count = 0
 
+        # Path of a DiscoveryIndex file, if we may answer discovery from it.
+        self.discovery_index = discovery_index
+
+    def uses_discovery_index(self):
+        """Whether we may answer discovery from self.discovery_index.
+
+        We can't if a plugin's add_testcase_info hook will change TestCases as
+        they're constructed (unittest_annotate adds suites, say), since the
+        index only knows what the classes themselves say. A plugin with the
+        hook can define adds_testcase_info(runner) to say whether it will;
+        otherwise we assume it does.
+        """
+        if self.discovery_index is None:
+            return False
+        for plugin_mod in self.plugin_modules:
+            if hasattr(plugin_mod, 'add_testcase_info') and getattr(plugin_mod, 'adds_testcase_info', lambda runner: True)(self):
+                logging.warning(
+                    'Not using the discovery index: plugin %s adds information to test cases it can\'t know about.',
+                    plugin_mod.__name__,
+                )
+                return False
+        return True
+
     @classmethod
     def get_test_method_name(cls, test_method):
         test_method_self_t = type(six.get_method_self(test_method))
@@ -116,29 +153,46 @@ class TestRunner(object):
             ]
 
         def discover_tests_by_buckets():
-            # Sort by the test count, use the cmp_str as a fallback for determinism
-            test_cases = sorted(
-                discover_tests(),
-                key=lambda test_case: (
-                    -1 * len(list(test_case.runnable_test_methods())),
-                    MetaTestCase._cmp_str(type(test_case)),
-                )
-            )
+            if self.uses_discovery_index():
+                return discover_tests_by_indexed_buckets()
 
-            # Assign buckets round robin
-            buckets = defaultdict(list)
-            for bucket, test_case in six.moves.zip(
-                itertools.cycle(
-                    list(range(self.bucket_count)) +
-                    list(reversed(range(self.bucket_count)))
-                ),
-                test_cases,
-            ):
-                # If the class is supposed to be specially bucketed, do so
-                bucket = self.bucket_overrides.get(MetaTestCase._cmp_str(type(test_case)), bucket)
-                buckets[bucket].append(test_case)
-
-            return buckets[self.bucket]
+            test_cases = dict(
+                (MetaTestCase._cmp_str(type(test_case)), test_case)
+                for test_case in discover_tests()
+            )
+            buckets = self.assign_buckets(
+                (cmp_str, len(list(test_case.runnable_test_methods())))
+                for cmp_str, test_case in test_cases.items()
+            )
+            return [test_cases[cmp_str] for cmp_str in buckets[self.bucket]]
+
+        def discover_tests_by_indexed_buckets():
+            # Partition on the index, then only import this bucket's modules.
+            test_case_classes = []
+            module_classes = {}
+            for manifest in self.bucket_manifests(self.indexed_manifests()):
+                if manifest['module'] not in module_classes:
+                    try:
+                        mod = __import__(manifest['module'], fromlist=[str('__trash')])
+                    except Exception:
+                        traceback.print_exc()
+                        raise test_discovery.DiscoveryError(
+                            (
+                                '\n    ' +
+                                traceback.format_exc().replace('\n', '\n    ')
+                            ).rstrip()
+                        )
+                    module_classes[manifest['module']] = dict(
+                        (test_case_class.__name__, test_case_class)
+                        for test_case_class in test_discovery.get_test_classes_from_module(mod)
+                    )
+                try:
+                    test_case_classes.append(module_classes[manifest['module']][manifest['class']])
+                except KeyError:
+                    raise test_discovery.DiscoveryError(
+                        '%s %s is in the discovery index but not in its module' % (manifest['module'], manifest['class']),
+                    )
+            return [construct_test(test_case_class) for test_case_class in test_case_classes]
 
         def discover_tests_testing():
             # For testing purposes only
@@ -162,6 +216,171 @@ class TestRunner(object):
             reporter.test_counts(test_case_count, test_method_count)
         return discovered_tests
 
+    def estimate_run_times(self, test_method_counts):
+        """Estimate how long each test case will take, in seconds, from
+        self.bucket_timings. Test cases without any history are assumed to
+        take the median per-method time of the ones with history, for each
+        of their methods.
+        """
+        per_method_times = sorted(
+            self.bucket_timings[cmp_str] / method_count
+            for cmp_str, method_count in test_method_counts.items()
+            if method_count and cmp_str in self.bucket_timings
+        )
+        median_per_method_time = per_method_times[len(per_method_times) // 2] if per_method_times else 1.0
+
+        return dict(
+            (cmp_str, self.bucket_timings.get(cmp_str, method_count * median_per_method_time))
+            for cmp_str, method_count in test_method_counts.items()
+        )
+
+    def bucket_order(self, weights):
+        """Sort cmp_strs heaviest first, given a dict of cmp_str to weight.
+
+        Without a bucket salt, equal weights are ordered by cmp_str. With one,
+        weights within SALT_BAND_RATIO of each other count as equal, and
+        are ordered by a hash of the salt and the cmp_str. Each salt gives a
+        different but stable mix of test cases in each bucket, while the load
+        stays about even.
+        """
+        if self.bucket_salt is None:
+            return sorted(weights, key=lambda cmp_str: (-1 * weights[cmp_str], cmp_str))
+
+        def salted_key(cmp_str):
+            weight = weights[cmp_str]
+            band = math.floor(math.log(weight, SALT_BAND_RATIO)) if weight > 0 else float('-inf')
+            salted_hash = hashlib.md5(('%s\0%s' % (self.bucket_salt, cmp_str)).encode('utf8')).hexdigest()
+            return (-1 * band, salted_hash, cmp_str)
+
+        return sorted(weights, key=salted_key)
+
+    def assign_buckets(self, test_method_counts):
+        """Split test cases into self.bucket_count buckets.
+
+        `test_method_counts` are (cmp_str, number of runnable methods) pairs,
+        where cmp_str is MetaTestCase._cmp_str of the test case class. Returns
+        a dict of bucket number to the list of cmp_strs in that bucket, in
+        the order they should run.
+
+        Without self.bucket_timings, test cases are sorted by method count
+        and dealt out round robin, zig-zagging across the buckets
+        (0 1 2 2 1 0 0 1 2 ...). With timings, the longest-running test case
+        is repeatedly given to the bucket with the least total time so far,
+        so every bucket should finish at about the same time.
+
+        Either way, classes in self.bucket_overrides go to their assigned
+        bucket, and self.bucket_salt reshuffles similar test cases (see
+        bucket_order).
+        """
+        test_method_counts = dict(test_method_counts)
+        buckets = defaultdict(list)
+
+        if not self.bucket_timings:
+            # Sort by the test count, use the cmp_str (or salt) as a fallback for determinism
+            cmp_strs = self.bucket_order(test_method_counts)
+
+            # Assign buckets round robin
+            for bucket, cmp_str in six.moves.zip(
+                itertools.cycle(
+                    list(range(self.bucket_count)) +
+                    list(reversed(range(self.bucket_count)))
+                ),
+                cmp_strs,
+            ):
+                # If the class is supposed to be specially bucketed, do so
+                bucket = self.bucket_overrides.get(cmp_str, bucket)
+                buckets[bucket].append(cmp_str)
+
+            return buckets
+
+        run_times = self.estimate_run_times(test_method_counts)
+        cmp_strs = self.bucket_order(run_times)
+
+        bucket_run_times = dict((bucket, 0.0) for bucket in range(self.bucket_count))
+        for cmp_str in cmp_strs:
+            if cmp_str in self.bucket_overrides:
+                bucket = self.bucket_overrides[cmp_str]
+                bucket_run_times[bucket] = bucket_run_times.get(bucket, 0.0) + run_times[cmp_str]
+                buckets[bucket].append(cmp_str)
+
+        least_loaded = [(bucket_run_times[bucket], bucket) for bucket in range(self.bucket_count)]
+        heapq.heapify(least_loaded)
+        for cmp_str in cmp_strs:
+            if cmp_str not in self.bucket_overrides:
+                bucket_run_time, bucket = least_loaded[0]
+                heapq.heapreplace(least_loaded, (bucket_run_time + run_times[cmp_str], bucket))
+                buckets[bucket].append(cmp_str)
+
+        return buckets
+
+    def discover_manifests(self):
+        """Like discover(), but describes each TestCase as a dict with its
+        'module', 'class', runnable 'methods' (a dict of method name to the
+        set of suites that method is in) and whether it has 'class_fixtures',
+        rather than as an instance.
+
+        With a discovery index, modules which haven't changed since they were
+        indexed aren't even imported.
+        """
+        if isinstance(self.test_path_or_test_case, (TestCase, MetaTestCase)) or not self.uses_discovery_index():
+            return [
+                {
+                    'module': type(test_case).__module__,
+                    'class': type(test_case).__name__,
+                    'methods': dict(
+                        (test_method.__name__, test_case.suites(test_method))
+                        for test_method in test_case.runnable_test_methods()
+                    ),
+                    'class_fixtures': type(test_case)._has_class_fixtures(),
+                }
+                for test_case in self.discover()
+            ]
+
+        try:
+            manifests = self.indexed_manifests()
+        except test_discovery.DiscoveryError as exc:
+            for reporter in self.test_reporters:
+                reporter.test_discovery_failure(exc)
+            sys.exit(1)
+
+        if self.bucket is not None:
+            manifests = self.bucket_manifests(manifests)
+
+        test_method_count = sum(len(manifest['methods']) for manifest in manifests)
+        for reporter in self.test_reporters:
+            reporter.test_counts(len(manifests), test_method_count)
+        return manifests
+
+    def indexed_manifests(self):
+        """Manifests from the discovery index, with the same suite and method
+        name filtering discover() applies. May raise DiscoveryError.
+        """
+        manifests = []
+        for manifest in DiscoveryIndex(self.discovery_index).discover(self.test_path_or_test_case):
+            if self.module_method_overrides and manifest['class'] not in self.module_method_overrides:
+                continue
+            name_overrides = self.module_method_overrides.get(manifest['class'], None)
+
+            methods = {}
+            for method_name, method_suites in manifest['methods'].items():
+                method_suites = set(method_suites)
+                if not suites_selected(method_suites, self.suites_include, self.suites_exclude, self.suites_require):
+                    continue
+                if name_overrides is None or method_name in name_overrides:
+                    methods[method_name] = method_suites
+
+            manifests.append(dict(manifest, methods=methods))
+        return manifests
+
+    def bucket_manifests(self, manifests):
+        """The manifests assigned to self.bucket, in assign_buckets order."""
+        manifests = dict(('%s.%s' % (manifest['module'], manifest['class']), manifest) for manifest in manifests)
+        buckets = self.assign_buckets(
+            (cmp_str, len(manifest['methods']))
+            for cmp_str, manifest in manifests.items()
+        )
+        return [manifests[cmp_str] for cmp_str in buckets[self.bucket]]
+
     def run(self):
         """Instantiate our found test case classes and run their test methods.
 
@@ -180,60 +399,78 @@ class TestRunner(object):
                 if self.failure_limit and self.failure_count >= self.failure_limit:
                     break
 
-                # We allow our plugins to mutate the test case prior to execution
-                for plugin_mod in self.plugin_modules:
-                    if hasattr(plugin_mod, "prepare_test_case"):
-                        plugin_mod.prepare_test_case(self.options, test_case)
+                self.run_test_case(test_case)
 
-                if not any(test_case.runnable_test_methods()):
-                    continue
+        except (KeyboardInterrupt, SystemExit):
+            # we'll catch and pass a keyboard interrupt so we can cancel in the middle of a run
+            # but still get a testing summary.
+            pass
 
-                def failure_counter(result_dict):
-                    if not result_dict['success']:
-                        self.failure_count += 1
+        report = [reporter.report() for reporter in self.test_reporters]
+        return all(report)
 
-                for reporter in self.test_reporters:
-                    test_case.register_callback(test_case.EVENT_ON_RUN_TEST_METHOD, reporter.test_start)
-                    test_case.register_callback(test_case.EVENT_ON_COMPLETE_TEST_METHOD, reporter.test_complete)
+    def run_test_case(self, test_case, test_reporters=None):
+        """Register reporter callbacks on a single TestCase instance, let the
+        plugins wrap it, and run it.
 
-                    test_case.register_callback(test_case.EVENT_ON_RUN_CLASS_SETUP_METHOD, reporter.class_setup_start)
-                    test_case.register_callback(test_case.EVENT_ON_COMPLETE_CLASS_SETUP_METHOD, reporter.class_setup_complete)
+        `test_reporters` defaults to this runner's reporters; subclasses which
+        run tests out-of-process pass stand-ins that forward the results.
+        """
+        if test_reporters is None:
+            test_reporters = self.test_reporters
 
-                    test_case.register_callback(test_case.EVENT_ON_RUN_CLASS_TEARDOWN_METHOD, reporter.class_teardown_start)
-                    test_case.register_callback(
-                        test_case.EVENT_ON_COMPLETE_CLASS_TEARDOWN_METHOD,
-                        reporter.class_teardown_complete,
-                    )
+        # We allow our plugins to mutate the test case prior to execution
+        for plugin_mod in self.plugin_modules:
+            if hasattr(plugin_mod, "prepare_test_case"):
+                plugin_mod.prepare_test_case(self.options, test_case)
 
-                    test_case.register_callback(test_case.EVENT_ON_RUN_TEST_CASE, reporter.test_case_start)
-                    test_case.register_callback(test_case.EVENT_ON_COMPLETE_TEST_CASE, reporter.test_case_complete)
+        if not any(test_case.runnable_test_methods()):
+            return
 
-                test_case.register_callback(test_case.EVENT_ON_COMPLETE_TEST_METHOD, failure_counter)
+        def failure_counter(result_dict):
+            if not result_dict['success']:
+                self.failure_count += 1
 
-                # Now we wrap our test case like an onion. Each plugin given the opportunity to wrap it.
-                runnable = test_case.run
-                for plugin_mod in self.plugin_modules:
-                    if hasattr(plugin_mod, "run_test_case"):
-                        runnable = functools.partial(plugin_mod.run_test_case, self.options, test_case, runnable)
+        for reporter in test_reporters:
+            test_case.register_callback(test_case.EVENT_ON_RUN_TEST_METHOD, reporter.test_start)
+            test_case.register_callback(test_case.EVENT_ON_COMPLETE_TEST_METHOD, reporter.test_complete)
 
-                # And we finally execute our finely wrapped test case
-                runnable()
+            test_case.register_callback(test_case.EVENT_ON_RUN_CLASS_SETUP_METHOD, reporter.class_setup_start)
+            test_case.register_callback(test_case.EVENT_ON_COMPLETE_CLASS_SETUP_METHOD, reporter.class_setup_complete)
 
-        except (KeyboardInterrupt, SystemExit):
-            # we'll catch and pass a keyboard interrupt so we can cancel in the middle of a run
-            # but still get a testing summary.
-            pass
+            test_case.register_callback(test_case.EVENT_ON_RUN_CLASS_TEARDOWN_METHOD, reporter.class_teardown_start)
+            test_case.register_callback(
+                test_case.EVENT_ON_COMPLETE_CLASS_TEARDOWN_METHOD,
+                reporter.class_teardown_complete,
+            )
 
-        report = [reporter.report() for reporter in self.test_reporters]
-        return all(report)
+            test_case.register_callback(test_case.EVENT_ON_RUN_TEST_CASE, reporter.test_case_start)
+            test_case.register_callback(test_case.EVENT_ON_COMPLETE_TEST_CASE, reporter.test_case_complete)
+
+        test_case.register_callback(test_case.EVENT_ON_COMPLETE_TEST_METHOD, failure_counter)
+
+        # Now we wrap our test case like an onion. Each plugin given the opportunity to wrap it.
+        runnable = test_case.run
+        for plugin_mod in self.plugin_modules:
+            if hasattr(plugin_mod, "run_test_case"):
+                runnable = functools.partial(plugin_mod.run_test_case, self.options, test_case, runnable)
+
+        # And we finally execute our finely wrapped test case
+        runnable()
 
     def list_suites(self):
         """List the suites represented by this TestRunner's tests."""
         suites = defaultdict(list)
-        for test_instance in self.discover():
-            for test_method in test_instance.runnable_test_methods():
-                for suite_name in test_instance.suites(test_method):
-                    suites[suite_name].append(test_method)
+        if self.discovery_index is not None:
+            for manifest in self.discover_manifests():
+                for method_name, method_suites in manifest['methods'].items():
+                    for suite_name in method_suites:
+                        suites[suite_name].append(method_name)
+        else:
+            for test_instance in self.discover():
+                for test_method in test_instance.runnable_test_methods():
+                    for suite_name in test_instance.suites(test_method):
+                        suites[suite_name].append(test_method)
         suite_counts = dict((suite_name, "%d tests" % len(suite_members)) for suite_name, suite_members in suites.items())
 
         pp = pprint.PrettyPrinter(indent=2)
@@ -252,10 +489,18 @@ class TestRunner(object):
 
     def list_tests(self, selected_suite_name=None):
         """Lists all tests, optionally scoped to a single suite."""
-        test_list = self.get_tests_for_suite(selected_suite_name)
-        test_method_names = sorted([
-            self.get_test_method_name(test) for test in test_list
-        ])
+        if self.discovery_index is not None:
+            test_list = test_method_names = sorted(
+                '%s %s.%s' % (manifest['module'], manifest['class'], method_name)
+                for manifest in self.discover_manifests()
+                for method_name, method_suites in manifest['methods'].items()
+                if not selected_suite_name or selected_suite_name in method_suites
+            )
+        else:
+            test_list = self.get_tests_for_suite(selected_suite_name)
+            test_method_names = sorted([
+                self.get_test_method_name(test) for test in test_list
+            ])
         for test_method_name in test_method_names:
             print(test_method_name)
 
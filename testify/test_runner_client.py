@@ -4,18 +4,20 @@ See the test_runner_server module.
 """
 from __future__ import absolute_import
 
-try:
-    import simplejson as json  # noqa
-except ImportError:
-    import json
+import threading
 import time
 import logging
 
 import six
 
 from . import test_discovery
+from . import test_runner_wire
 from .test_runner import TestRunner
 
+# Heartbeats are sent from inside the process running the tests, so hold on to
+# this now: tests which patch urlopen or http_client mustn't stop them.
+_HeartbeatConnection = six.moves.http_client.HTTPConnection
+
 
 class TestRunnerClient(TestRunner):
     def __init__(self, *args, **kwargs):
@@ -27,36 +29,160 @@ class TestRunnerClient(TestRunner):
         self.retry_interval = kwargs['options'].retry_interval
         self.retry_backoff = kwargs['options'].retry_backoff
         self.reconnect_retry_limit = kwargs['options'].reconnect_retry_limit
+        self.batch_size = kwargs['options'].batch_size
+        self.batch_seconds = kwargs['options'].batch_seconds
+        self.heartbeat_interval = kwargs['options'].heartbeat_interval
+        self.prefetch = kwargs['options'].prefetch
+        self.prefetch_imports = kwargs['options'].prefetch_imports
 
         super(TestRunnerClient, self).__init__(*args, **kwargs)
 
     def discover(self):
-        finished = False
-        first_connect = True
-        while not finished:
-            class_path, methods, finished = self.get_next_tests(
-                retry_limit=(self.retry_limit if first_connect else self.reconnect_retry_limit),
-                retry_interval=self.retry_interval,
-            )
-            first_connect = False
-            if class_path and methods:
-                module_path, _, class_name = class_path.partition(' ')
+        stop_heartbeats = self.start_heartbeats() if self.heartbeat_interval else None
+        try:
+            finished = False
+            first_connect = True
+            prefetched = None
+            while not finished:
+                if prefetched is not None:
+                    classes, finished = prefetched()
+                    prefetched = None
+                else:
+                    classes, finished = self.get_next_test_batch(
+                        retry_limit=(self.retry_limit if first_connect else self.reconnect_retry_limit),
+                        retry_interval=self.retry_interval,
+                    )
+                first_connect = False
+                for i, (class_path, methods) in enumerate(classes):
+                    if self.prefetch and not finished and i == len(classes) - 1:
+                        # Check out what to run next while we run this.
+                        prefetched = self.start_prefetch()
+
+                    if class_path and methods:
+                        module_path, _, class_name = class_path.partition(' ')
+
+                        klass = test_discovery.import_test_class(module_path, class_name)
+                        yield klass(name_overrides=methods)
+        finally:
+            if stop_heartbeats is not None:
+                stop_heartbeats.set()
+
+    def start_prefetch(self):
+        """Check out the next test cases in a background thread, importing
+        them too with prefetch_imports. Returns a function which waits for
+        the thread, and returns what get_next_test_batch did."""
+        prefetched = []
+
+        def prefetch():
+            try:
+                classes, finished = self.get_next_test_batch(
+                    retry_limit=self.reconnect_retry_limit,
+                    retry_interval=self.retry_interval,
+                    prefetch=True,
+                )
+                prefetched.append((classes, finished))
 
-                klass = test_discovery.import_test_class(module_path, class_name)
-                yield klass(name_overrides=methods)
+                if self.prefetch_imports:
+                    for class_path, methods in classes:
+                        if class_path and methods:
+                            module_path, _, class_name = class_path.partition(' ')
+                            test_discovery.import_test_class(module_path, class_name)
+            except Exception:
+                # If the classes were checked out, discover() will run into any
+                # import error again when it gets to them; if not, we're done.
+                logging.exception("Got error while prefetching tests")
+
+        prefetch_thread = threading.Thread(target=prefetch)
+        prefetch_thread.daemon = True
+        prefetch_thread.start()
+
+        def wait():
+            prefetch_thread.join()
+            if not prefetched:
+                return [], True
+            return prefetched[0]
+        return wait
+
+    def start_heartbeats(self):
+        """Start a thread which sends heartbeats to the server, so it knows
+        we're alive while we run long tests. Returns an Event which stops the
+        thread when set."""
+        stop = threading.Event()
+        heartbeat_thread = threading.Thread(target=self.send_heartbeats, args=(stop,))
+        # Like HTTPReporter's thread, there's no reason to wait for this one before quitting.
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+        return stop
+
+    def send_heartbeats(self, stop):
+        """POST to the server's /heartbeat every heartbeat_interval seconds
+        until `stop` is set, over a keep-alive connection of our own."""
+        path = '/heartbeat?%s' % six.moves.urllib.parse.urlencode([('runner', self.runner_id)])
+        connection = None
+        while not stop.is_set():
+            try:
+                if connection is None:
+                    connection = _HeartbeatConnection(self.connect_addr, timeout=self.heartbeat_interval)
+                connection.request('POST', path, b'')
+                connection.getresponse().read()
+            except Exception as e:
+                # The server may be busy, or gone; either way, get_next_test_batch will find out.
+                logging.debug("Got error %r when sending heartbeat", e)
+                if connection is not None:
+                    connection.close()
+                    connection = None
+            stop.wait(self.heartbeat_interval)
+
+        if connection is not None:
+            connection.close()
 
     def get_next_tests(self, retry_interval, retry_limit):
+        """Check out a single test case: returns (class_path, methods, finished)."""
+        classes, finished = self.get_next_test_batch(retry_interval, retry_limit, batch_size=1, batch_seconds=None)
+        class_path, methods = classes[0] if classes else (None, None)
+        return class_path, methods, finished
+
+    def get_next_test_batch(self, retry_interval, retry_limit, batch_size=None, batch_seconds=None, prefetch=False):
+        """Check out test cases, as many as the server will give us up to
+        batch_size and batch_seconds (default: our options). Returns
+        ([(class_path, methods), ...], finished). With `prefetch`, the server
+        is told we'll only start on them once we're done with what we have.
+        """
+        if batch_size is None and batch_seconds is None:
+            batch_size, batch_seconds = self.batch_size, self.batch_seconds
+
         try:
+            params = [('runner', self.runner_id)]
             if self.revision:
-                url = 'http://%s/tests?runner=%s&revision=%s' % (self.connect_addr, self.runner_id, self.revision)
+                params.append(('revision', self.revision))
+            if batch_size:
+                params.append(('count', batch_size))
+            if batch_seconds:
+                params.append(('budget', batch_seconds))
+            if prefetch:
+                params.append(('prefetch', 1))
+            url = 'http://%s/tests?%s' % (self.connect_addr, six.moves.urllib.parse.urlencode(params))
+            request = six.moves.urllib.request.Request(url, headers={
+                'Accept': ', '.join(test_runner_wire.content_types()),
+                'Accept-Encoding': 'deflate',
+            })
+            response = six.moves.urllib.request.urlopen(request)
+            d = test_runner_wire.decode(
+                response.read(),
+                response.info().get('Content-Type'),
+                response.info().get('Content-Encoding'),
+            )
+            if 'classes' in d:
+                classes = [(c['class'], c['methods']) for c in d['classes']]
+            elif d.get('class'):
+                # An older server, which hands out one class at a time.
+                classes = [(d['class'], d.get('methods'))]
             else:
-                url = 'http://%s/tests?runner=%s' % (self.connect_addr, self.runner_id)
-            response = six.moves.urllib.request.urlopen(url)
-            d = json.loads(response.read().decode('UTF-8'))
-            return (d.get('class'), d.get('methods'), d['finished'])
+                classes = []
+            return classes, d['finished']
         except six.moves.urllib.error.HTTPError as e:
             logging.warning("Got HTTP status %d when requesting tests -- bailing" % (e.code))
-            return None, None, True
+            return [], True
         except six.moves.urllib.error.URLError as e:
             if retry_limit > 0:
                 logging.warning(
@@ -64,9 +190,12 @@ class TestRunnerClient(TestRunner):
                     e, retry_interval, retry_limit,
                 )
                 time.sleep(min(retry_interval, retry_limit))
-                return self.get_next_tests(
+                return self.get_next_test_batch(
                     retry_limit=retry_limit - retry_interval,
                     retry_interval=retry_interval + self.retry_backoff,
+                    batch_size=batch_size,
+                    batch_seconds=batch_seconds,
+                    prefetch=prefetch,
                 )
             else:
-                return None, None, True  # Stop trying if we can't connect to the server.
+                return [], True  # Stop trying if we can't connect to the server.
@@ -0,0 +1,99 @@
+"""
+An append-only journal of what a TestRunnerServer has checked in, so that a
+server which dies mid-run can be restarted with --resume and carry on with
+only the tests whose results it hadn't reported yet.
+
+The journal is a file of JSON objects, one per line. The first line is a
+header with the journal's version; each line after it records one class being
+checked in: the results which were reported, and the methods which were
+requeued (with the failed or faked result which caused it). Classes which were
+checked out but never checked in aren't recorded, and are simply run again.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+
+try:
+    import simplejson as json  # noqa
+except ImportError:
+    import json
+
+JOURNAL_VERSION = 1
+
+
+class ServerJournal(object):
+    """Check-ins recorded at `path`. With resume=True, any check-ins already
+    recorded there are loaded into `events` and new ones are appended;
+    otherwise the journal starts out empty."""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.events = []
+
+        if resume and os.path.exists(path):
+            self.events = self._read()
+            if self.events is None:
+                logging.warning("Journal %s is from a different version of testify, not resuming from it." % path)
+                self.events = []
+                resume = False
+            else:
+                self._truncate_partial_line()
+
+        self.file = open(path, 'a' if resume else 'w')
+        if not resume:
+            self._write({'version': JOURNAL_VERSION})
+
+    def _read(self):
+        """Return the recorded check-ins, or None if the journal has the wrong version."""
+        events = []
+        with open(self.path) as f:
+            for line_number, line in enumerate(f):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Most likely the server died halfway through writing this line.
+                    logging.warning("Skipping unreadable line %d of journal %s." % (line_number + 1, self.path))
+                    continue
+
+                if line_number == 0:
+                    if event.get('version') != JOURNAL_VERSION:
+                        return None
+                else:
+                    events.append(event)
+        return events
+
+    def _truncate_partial_line(self):
+        """Cut off a line the server died halfway through writing, so that
+        what we append doesn't end up on it (and get skipped along with it)."""
+        with open(self.path, 'rb+') as f:
+            contents = f.read()
+            if contents and not contents.endswith(b'\n'):
+                f.truncate(contents.rfind(b'\n') + 1)
+
+    def _write(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        # If the server dies, everything it's checked in should be on disk.
+        self.file.flush()
+
+    def record_check_in(self, class_path, runner, reported, failed, timed_out, failure_count):
+        """Record a class being checked in from `runner`.
+
+        `reported` are the results which were reported, `failed` and
+        `timed_out` are the results of methods which were requeued, and
+        failure_count is how many failures the check-in adds to the run's
+        count towards --failure-limit.
+        """
+        self._write({
+            'class_path': class_path,
+            'runner': runner,
+            'reported': reported,
+            'failed': failed,
+            'timed_out': timed_out,
+            'failure_count': failure_count,
+        })
+
+    def close(self):
+        self.file.close()
+
+# vim: set ts=4 sts=4 sw=4 et:
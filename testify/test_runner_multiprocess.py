@@ -0,0 +1,171 @@
+"""
+Local multi-process test running. The parent process discovers tests as usual,
+then forks a pool of workers which pull whole TestCases off a shared counter,
+run them, and stream their result dicts back to the parent. The parent feeds
+those results to its own test reporters, so every reporter works unchanged.
+"""
+from __future__ import absolute_import
+
+import logging
+import multiprocessing
+
+import six
+
+from . import test_reporter
+from .test_runner import TestRunner
+
+try:
+    _mp = multiprocessing.get_context('fork')
+except AttributeError:
+    # PY2 / PY3 < 3.4 always fork on POSIX.
+    _mp = multiprocessing
+
+_log = logging.getLogger('testify')
+
+# Result dicts which take longer than this to arrive make us check whether
+# any worker died without saying goodbye.
+WORKER_POLL_INTERVAL = 0.5
+
+# The TestReporter callbacks which get forwarded from the workers.
+FORWARDED_EVENTS = (
+    'test_start',
+    'test_complete',
+    'class_setup_start',
+    'class_setup_complete',
+    'class_teardown_start',
+    'class_teardown_complete',
+    'test_case_start',
+    'test_case_complete',
+)
+
+
+class ForwardingReporter(test_reporter.TestReporter):
+    """Stands in for the parent's reporters inside a worker process, putting
+    (worker_id, event name, result dict) tuples onto the results queue.
+    """
+
+    def __init__(self, options, worker_id, event_queue):
+        self.worker_id = worker_id
+        self.event_queue = event_queue
+        super(ForwardingReporter, self).__init__(options)
+
+        for event in FORWARDED_EVENTS:
+            setattr(self, event, self._forwarder(event))
+
+    def _forwarder(self, event):
+        def forward(result):
+            self.event_queue.put((self.worker_id, event, result))
+        return forward
+
+
+class TestRunnerMultiprocess(TestRunner):
+    def __init__(self, *args, **kwargs):
+        self.worker_count = kwargs.pop('workers')
+        super(TestRunnerMultiprocess, self).__init__(*args, **kwargs)
+
+    def run(self):
+        """Discover tests in this process, then fan them out to the workers.
+
+        Test cases are handed out one whole class at a time, so class fixtures
+        run exactly once, on the worker which runs the class's methods.
+        """
+        success = True
+        processes = []
+
+        try:
+            test_cases = list(self.discover())
+
+            # Workers are forked, so they inherit test_cases; only an index into
+            # it needs to be shared.
+            next_index = _mp.Value('i', 0)
+            event_queue = _mp.Queue()
+
+            for worker_id in range(max(1, min(self.worker_count, len(test_cases)))):
+                process = _mp.Process(
+                    target=self._run_worker,
+                    args=(worker_id, test_cases, next_index, event_queue),
+                )
+                process.daemon = True
+                process.start()
+                processes.append(process)
+
+            success = self._collect_results(processes, test_cases, next_index, event_queue)
+
+        except (KeyboardInterrupt, SystemExit):
+            # we'll catch and pass a keyboard interrupt so we can cancel in the middle of a run
+            # but still get a testing summary.
+            for process in processes:
+                process.terminate()
+
+        for process in processes:
+            process.join()
+
+        report = [reporter.report() for reporter in self.test_reporters]
+        return success and all(report)
+
+    def _collect_results(self, processes, test_cases, next_index, event_queue):
+        """Dispatch forwarded results to our reporters until every worker has
+        finished. Returns False if a worker died in the middle of a test case.
+        """
+        success = True
+        running = set(range(len(processes)))
+        current_test_case = {}
+
+        while running:
+            try:
+                worker_id, event, result = event_queue.get(timeout=WORKER_POLL_INTERVAL)
+            except six.moves.queue.Empty:
+                for worker_id in list(running):
+                    if not processes[worker_id].is_alive():
+                        running.discard(worker_id)
+                        if worker_id in current_test_case:
+                            _log.error(
+                                'Worker %d died while running %s (exit code %s).',
+                                worker_id, current_test_case[worker_id], processes[worker_id].exitcode,
+                            )
+                            success = False
+                continue
+
+            if event is None:
+                # This worker has run out of tests.
+                running.discard(worker_id)
+                continue
+
+            if event == 'test_case_start':
+                current_test_case[worker_id] = '%s %s' % (result['method']['module'], result['method']['class'])
+            elif event == 'test_case_complete':
+                current_test_case.pop(worker_id, None)
+            elif event == 'test_complete' and not result['success']:
+                self.failure_count += 1
+                if self.failure_limit and self.failure_count >= self.failure_limit:
+                    # Don't hand out any more test cases.
+                    with next_index.get_lock():
+                        next_index.value = len(test_cases)
+
+            for reporter in self.test_reporters:
+                getattr(reporter, event)(result)
+
+        return success
+
+    def _run_worker(self, worker_id, test_cases, next_index, event_queue):
+        test_reporters = [ForwardingReporter(self.options, worker_id, event_queue)]
+        try:
+            while True:
+                # The parent enforces the limit across all workers, but it
+                # may be a few results behind us.
+                if self.failure_limit and self.failure_count >= self.failure_limit:
+                    break
+
+                with next_index.get_lock():
+                    index = next_index.value
+                    next_index.value += 1
+                if index >= len(test_cases):
+                    break
+
+                self.run_test_case(test_cases[index], test_reporters=test_reporters)
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            event_queue.put((worker_id, None, None))
+
+# vim: set ts=4 sts=4 sw=4 et:
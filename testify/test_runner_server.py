@@ -7,116 +7,302 @@ The server keeps track of the overall status of the run and manages timeouts and
 """
 
 import collections
+import heapq
+import itertools
 import logging
+import threading
 
+import six
+
+from . import test_runner_wire
 from .test_fixtures import FIXTURES_WHICH_CAN_RETURN_UNEXPECTED_RESULTS
 from .test_runner import TestRunner
-import six
+from .test_runner_journal import ServerJournal
 import tornado.httpserver
 import tornado.ioloop
 import tornado.web
 
 _log = logging.getLogger('testify')
 
-try:
-    import simplejson as json  # noqa
-except ImportError:
-    import json
 import logging
 
 import time
 
 
-class Work(collections.namedtuple('Work', ('priority', 'worker', 'runner'))):
-    def __lt__(self, other):
-        return (
-            (self.priority, self.worker.__name__, self.runner) <
-            (other.priority, other.worker.__name__, other.runner)
-        )
+Work = collections.namedtuple('Work', ('priority', 'worker', 'runner', 'prefetch'))
 
+# Once the queue is empty, idle runners are given copies of work other
+# runners are holding up (see TestRunnerServer.speculate). We look for that
+# work whenever a runner goes idle, and every SPECULATION_INTERVAL seconds.
+SPECULATION_INTERVAL = 5
+# A runner is straggling once it has spent STRAGGLER_FACTOR times its
+# estimated run time on a class, or STRAGGLER_MIN_SECONDS, whichever is longer.
+STRAGGLER_FACTOR = 2
+STRAGGLER_MIN_SECONDS = 30
+# Classes are only split if the split-off methods are estimated to take at
+# least this long.
+SPLIT_MIN_SECONDS = 10
+# How often to look for runners which have stopped sending heartbeats.
+HEARTBEAT_CHECK_INTERVAL = 1
+
+
+class TestsByLastRunner(object):
+    """Queued tests, indexed so that the highest-priority test a runner may
+    run (i.e. one it didn't run last) can be found in O(log n).
+
+    Tests are kept in one heap per 'last_runner', plus a heap of the heads of
+    those heaps. Entries in the heap of heads go stale when their heap's head
+    changes, and are skipped as they surface. Ties in priority go to the test
+    queued first.
+    """
 
-class AsyncDelayedQueue(object):
     def __init__(self):
-        self.test_queue = six.moves.queue.PriorityQueue()
-        self.worker_queue = six.moves.queue.PriorityQueue()
+        self.by_last_runner = {}
+        self.heads = []
+        self.sequence = itertools.count()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, priority, test):
+        last_runner = test.get('last_runner')
+        entry = (priority, next(self.sequence), test)
+        tests = self.by_last_runner.setdefault(last_runner, [])
+        heapq.heappush(tests, entry)
+        if tests[0] is entry:
+            heapq.heappush(self.heads, (priority, entry[1], last_runner))
+        self.count += 1
+
+    def _clean_heads(self):
+        while self.heads:
+            _, sequence, last_runner = self.heads[0]
+            tests = self.by_last_runner.get(last_runner)
+            if tests and tests[0][1] == sequence:
+                return
+            heapq.heappop(self.heads)
+
+    def pop_for(self, runner, exclude_last_runner=True):
+        """Remove and return (priority, test) for the best test `runner` may
+        run, or None if there isn't one.
+
+        Unless exclude_last_runner is False, runners can't have tests whose
+        last_runner they are.
+        """
+        self._clean_heads()
+        if not self.heads:
+            return None
+
+        last_runner = self.heads[0][2]
+        if exclude_last_runner and runner is not None and last_runner == runner:
+            # Each last_runner has at most one live head, so the next live
+            # head (if any) is the best test this runner may run.
+            own_head = heapq.heappop(self.heads)
+            self._clean_heads()
+            other_heads = bool(self.heads)
+            if other_heads:
+                last_runner = self.heads[0][2]
+            heapq.heappush(self.heads, own_head)
+            if not other_heads:
+                return None
+
+        tests = self.by_last_runner[last_runner]
+        priority, _, test = heapq.heappop(tests)
+        if tests:
+            heapq.heappush(self.heads, (tests[0][0], tests[0][1], last_runner))
+        else:
+            del self.by_last_runner[last_runner]
+        self.count -= 1
+        return priority, test
+
+
+class AsyncDelayedQueue(object):
+    """Pairs queued tests with queued workers on the IOLoop.
+
+    A worker (a callback taking a priority and a test dict) gets the
+    highest-priority test whose last_runner isn't the worker's runner, unless
+    allow_last_runner() says otherwise. Workers which can't run any queued
+    test wait, in priority then arrival order, until a test they can run is
+    added.
+
+    add_worker and add_test may be called from any thread; pairing happens on
+    the IOLoop.
+    """
+
+    def __init__(self, allow_last_runner=None):
+        self.allow_last_runner = allow_last_runner or (lambda: False)
+        self.new_tests = collections.deque()
+        self.new_workers = collections.deque()
+        self.tests = TestsByLastRunner()
+        self.waiting_workers = []  # A heap of (priority, sequence, Work).
+        self.sequence = itertools.count()
+        self.match_scheduled = False
         self.finalized = False
 
-    def add_worker(self, w_priority, worker, runner=None):
-        """Queue up a worker to receive a test."""
+    def add_worker(self, w_priority, worker, runner=None, prefetch=False):
+        """Queue up a worker to receive a test. With `prefetch`, the worker's
+        runner is still busy, so pop_waiting_worker passes it over."""
         if self.finalized:
             worker(None, None)
             return
 
-        self.worker_queue.put(Work(w_priority, worker, runner))
-        tornado.ioloop.IOLoop.instance().add_callback(self.match)
+        self.new_workers.append(Work(w_priority, worker, runner, prefetch))
+        self._schedule_match()
 
     def add_test(self, t_priority, test):
         """Queue up a test to get given to a worker."""
-        # Priority queues need sortable things, so we'll convert the test
-        # dict to a tuple representation
-        test = tuple(sorted(list(test.items())))
-        self.test_queue.put((t_priority, test))
-        tornado.ioloop.IOLoop.instance().add_callback(self.match)
+        self.new_tests.append((t_priority, test))
+        self._schedule_match()
+
+    def _schedule_match(self):
+        if not self.match_scheduled:
+            self.match_scheduled = True
+            tornado.ioloop.IOLoop.instance().add_callback(self.match)
 
     def match(self):
-        """Try to pair a test to a worker.
-
-        This loops over each queued worker (and each queued test)
-        trying to find a match. It breaks out of the loop as soon as
-        it finds a valid worker-test match, re-queueing anything it
-        skipped. (In the worst case, this is O(n^2), but most of the
-        time no loop iterations beyond the first will be necessary -
-        the vast majority of the time, the first worker will match
-        the first test).
+        """Pair newly queued workers and tests with what's already queued.
+
+        Waiting workers can never run any of the queued tests, so new workers
+        only need to look at queued tests, and new tests only at waiting
+        workers.
         """
-        worker = None
-        runner = None
-        test = None
+        self.match_scheduled = False
+        exclude_last_runner = not self.allow_last_runner()
 
-        skipped_workers = []
-        while worker is None:
-            try:
-                w_priority, worker, runner = self.worker_queue.get_nowait()
-            except six.moves.queue.Empty:
-                break
+        while self.new_workers:
+            work = self.new_workers.popleft()
+            if self.finalized:
+                work.worker(None, None)
+                continue
 
-            while test is None:
-                try:
-                    t_priority, test = self.test_queue.get_nowait()
-                    test = dict(test)
-                except six.moves.queue.Empty:
+            found = self.tests.pop_for(work.runner, exclude_last_runner)
+            if found is None:
+                heapq.heappush(self.waiting_workers, (work.priority, next(self.sequence), work))
+            else:
+                _, test = found
+                work.worker(work.priority, test)
+
+        while self.new_tests:
+            t_priority, test = self.new_tests.popleft()
+
+            skipped_workers = []
+            work = None
+            while self.waiting_workers:
+                _, _, candidate = heapq.heappop(self.waiting_workers)
+                if (
+                        exclude_last_runner and
+                        candidate.runner is not None and
+                        candidate.runner == test.get('last_runner')
+                ):
+                    skipped_workers.append(candidate)
+                else:
+                    work = candidate
                     break
 
-            if test is None:
-                skipped_workers.append(Work(w_priority, worker, runner))
-                worker = None
-                continue
+            for skipped in skipped_workers:
+                heapq.heappush(self.waiting_workers, (skipped.priority, next(self.sequence), skipped))
+
+            if work is None:
+                self.tests.push(t_priority, test)
+            else:
+                work.worker(work.priority, test)
+
+    def pop_waiting_worker(self, can_run):
+        """Remove and return the first waiting Work, in priority then arrival
+        order, which isn't a prefetch and for whose runner can_run(runner) is
+        true, or None. Must be called on the IOLoop."""
+        self.match()
+
+        skipped = []
+        found = None
+        while self.waiting_workers:
+            entry = heapq.heappop(self.waiting_workers)
+            if not entry[2].prefetch and can_run(entry[2].runner):
+                found = entry[2]
+                break
+            skipped.append(entry)
 
-        for skipped in skipped_workers:
-            self.worker_queue.put(skipped)
+        for entry in skipped:
+            heapq.heappush(self.waiting_workers, entry)
+        return found
 
-        if worker is not None:
-            worker(w_priority, test)
-            tornado.ioloop.IOLoop.instance().add_callback(self.match)
+    def pop_nowait(self, runner):
+        """Remove and return (priority, test) for the best test `runner` may
+        run right now, or None. Must be called on the IOLoop."""
+        self.match()
+        return self.tests.pop_for(runner, not self.allow_last_runner())
 
     def empty(self):
         """Returns whether or not we have any pending tests."""
-        return self.test_queue.empty()
+        return not self.new_tests and not self.tests
 
     def waiting(self):
         """Returns whether or not we have any pending workers."""
-        return self.worker_queue.empty()
+        return not self.new_workers and not self.waiting_workers
 
     def finalize(self):
         """Immediately call any pending workers with None, None
         and ensure that any future get() calls do the same."""
         self.finalized = True
+        while self.waiting_workers:
+            _, _, work = heapq.heappop(self.waiting_workers)
+            work.worker(None, None)
+        while self.new_workers:
+            self.new_workers.popleft().worker(None, None)
+
+
+class ReportingQueue(object):
+    """Feeds result dicts to test reporters from a background thread, so a
+    slow reporter doesn't hold up handing out tests.
+
+    At most `maxsize` results wait their turn; beyond that, put() blocks
+    until the reporters catch up. How deep the queue got, and how often and
+    for how long put() blocked, are kept for logging at the end of the run.
+    """
+
+    def __init__(self, test_reporters, maxsize):
+        self.test_reporters = test_reporters
+        self.maxsize = maxsize
+        self.queue = six.moves.queue.Queue(maxsize)
+        self.max_depth = 0
+        self.blocked_count = 0
+        self.blocked_time = 0.0
+
+        self.reporting_thread = threading.Thread(target=self.report_results)
+        # join() waits for whatever's been put, so there's no need to wait for this thread itself.
+        self.reporting_thread.daemon = True
+        self.reporting_thread.start()
+
+    def put(self, result_dict):
         try:
-            while True:
-                _, worker, _ = self.worker_queue.get_nowait()
-                worker(None, None)
-        except six.moves.queue.Empty:
-            pass
+            self.queue.put_nowait(result_dict)
+        except six.moves.queue.Full:
+            start_time = time.time()
+            self.queue.put(result_dict)
+            self.blocked_count += 1
+            self.blocked_time += time.time() - start_time
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def report_results(self):
+        while True:
+            result_dict = self.queue.get()
+            try:
+                for reporter in self.test_reporters:
+                    reporter.test_start(result_dict)
+                    reporter.test_complete(result_dict)
+            except Exception:
+                _log.exception('Reporter failed on the result for %s' % result_dict['method']['full_name'])
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """Wait until every result put so far has been reported."""
+        self.queue.join()
+        _log.info(
+            'Reporting queue reached %d of %d results; handing out tests waited on it %d times, for %.2fs.' % (
+                self.max_depth, self.maxsize, self.blocked_count, self.blocked_time,
+            )
+        )
 
 
 class TestRunnerServer(TestRunner):
@@ -128,20 +314,51 @@ class TestRunnerServer(TestRunner):
         self.shutdown_delay_for_connection_close = kwargs['options'].shutdown_delay_for_connection_close
         self.shutdown_delay_for_outstanding_runners = kwargs['options'].shutdown_delay_for_outstanding_runners
         self.disable_requeueing = kwargs['options'].disable_requeueing
-
-        self.pair_queue = AsyncDelayedQueue()
+        self.disable_speculation = kwargs['options'].disable_speculation
+        self.heartbeat_timeout = kwargs['options'].heartbeat_timeout
+        self.journal_path = kwargs['options'].journal
+        self.reporting_queue_size = kwargs['options'].reporting_queue_size
+        self.resume = kwargs['options'].resume
+        self.journal = None
+
+        # If there's just one runner, it can run tests even if they failed there before.
+        self.pair_queue = AsyncDelayedQueue(allow_last_runner=lambda: len(self.runners) <= 1)
         self.checked_out = {}  # Keyed on class path (module class).
         self.failed_rerun_methods = set()  # Set of (class_path, method) who have failed.
         self.timeout_rerun_methods = set()  # Set of (class_path, method) who were sent to a client but results never came.
         self.previous_run_results = {}  # Keyed on (class_path, method), values are result dictionaries.
         self.runners = set()  # The set of runner_ids who have asked for tests.
         self.runners_outstanding = set()  # The set of runners who have posted results but haven't asked for the next test yet.
+        self.finished_runners = set()  # The set of runners who have been told there are no more tests.
         self.shutting_down = False  # Whether shutdown() has been called.
+        self.method_run_times = {}  # Keyed on class path, estimated seconds per test method.
+        self.splittable_classes = set()  # Class paths without class fixtures, whose methods can be split between runners.
+        self.superseded_leases = set()  # Set of (class_path, runner) whose results are no longer needed.
+        self.heartbeat_times = {}  # Keyed on runner_id, when that runner last sent a heartbeat.
+        self.unstarted_leases = {}  # Keyed on runner_id, class paths it has leases on but hasn't started yet.
 
         super(TestRunnerServer, self).__init__(*args, **kwargs)
 
-    def get_next_test(self, runner_id, on_test_callback, on_empty_callback):
-        """Enqueue a callback (which should take one argument, a test_dict) to be called when the next test is available."""
+        self.reporting_queue = None
+        if self.reporting_queue_size:
+            self.reporting_queue = ReportingQueue(self.test_reporters, self.reporting_queue_size)
+
+    def report_test_result(self, result_dict):
+        """Pass a result on to our test reporters, from the reporting
+        queue's thread if we have one."""
+        if self.reporting_queue is not None:
+            self.reporting_queue.put(result_dict)
+        else:
+            for reporter in self.test_reporters:
+                reporter.test_start(result_dict)
+                reporter.test_complete(result_dict)
+
+    def get_next_test(self, runner_id, on_test_callback, on_empty_callback, prefetch=False):
+        """Enqueue a callback (which should take one argument, a test_dict) to be called when the next test is available.
+
+        With `prefetch`, the runner will only start on the test once it's
+        done with the tests it already has checked out.
+        """
 
         self.runners.add(runner_id)
 
@@ -149,37 +366,152 @@ class TestRunnerServer(TestRunner):
             if not test_dict:
                 return on_empty_callback()
 
-            # if there's just one worker run the test even if it's failed there before
-            if (
-                    test_dict.get('last_runner', None) != runner_id or
-                    len(self.runners) <= 1
-            ):
-                self.check_out_class(runner_id, test_dict)
-                on_test_callback(test_dict)
+            # pair_queue never gives a runner a test it ran last (unless it's
+            # the only runner).
+            if prefetch:
+                self.check_out_class(runner_id, test_dict, delay=self.estimate_runner_backlog(runner_id), started=False)
             else:
-                # Put the test back in the queue, but give the worker a lower priority.
-                self.pair_queue.add_test(0, test_dict)
-                self.pair_queue.add_worker(w_priority + 1, callback, runner=runner_id)
+                self.check_out_class(runner_id, test_dict)
+            on_test_callback(test_dict)
 
-        self.pair_queue.add_worker(0, callback, runner=runner_id)
+        self.pair_queue.add_worker(0, callback, runner=runner_id, prefetch=prefetch)
+        # If there's nothing for this runner to do, maybe it can help someone else.
+        tornado.ioloop.IOLoop.instance().add_callback(self.speculate)
 
-    def report_result(self, runner_id, result):
-        class_path = '%s %s' % (result['method']['module'], result['method']['class'])
+    def get_next_test_batch(self, runner_id, on_tests_callback, on_empty_callback, count=1, budget=None, prefetch=False):
+        """Like get_next_test, but once a test is available, also check out
+        whatever other tests this runner may run right now, up to `count`
+        tests or until their estimated run time would exceed `budget`
+        seconds. on_tests_callback gets a list of test_dicts.
+
+        Each test is still checked out (and timed out) on its own. With
+        `prefetch`, the runner is still busy with the tests it already has
+        checked out, and will only start on these once it's done with those.
+        """
+        def on_test_callback(test_dict):
+            test_dicts = [test_dict]
+            batch_run_time = self.estimate_test_run_time(test_dict)
+            if prefetch:
+                batch_run_time += self.estimate_runner_backlog(runner_id, exclude=test_dict['class_path'])
+
+            while count is None or len(test_dicts) < count:
+                found = self.pair_queue.pop_nowait(runner_id)
+                if found is None:
+                    break
+
+                t_priority, next_test_dict = found
+                run_time = self.estimate_test_run_time(next_test_dict)
+                if budget is not None and batch_run_time + run_time > budget:
+                    self.pair_queue.add_test(t_priority, next_test_dict)
+                    break
+
+                # The runner gets to this test after the rest of the batch.
+                self.check_out_class(runner_id, next_test_dict, delay=batch_run_time, started=False)
+                test_dicts.append(next_test_dict)
+                batch_run_time += run_time
+
+            on_tests_callback(test_dicts)
+
+        self.get_next_test(runner_id, on_test_callback, on_empty_callback, prefetch=prefetch)
+
+    def estimate_test_run_time(self, test_dict):
+        """Estimated seconds to run the methods in a test_dict."""
+        method_count = len([method for method in test_dict['methods'] if method != 'run'])
+        return self.method_run_times.get(test_dict['class_path'], 0) * method_count
+
+    def estimate_runner_backlog(self, runner_id, exclude=None):
+        """Estimated seconds for runner_id to run the methods it has checked
+        out without results yet, except in class path `exclude`."""
+        backlog = 0
+        for class_path, d in self.checked_out.items():
+            lease = d['leases'].get(runner_id)
+            if lease is None or class_path == exclude:
+                continue
+            remaining = [method for method in lease['methods'] if method in d['methods']]
+            backlog += self.method_run_times.get(class_path, 0) * len(remaining)
+        return backlog
+
+    def check_results(self, runner_id, class_path, results):
+        """Raise ValueError unless runner_id can report each of results, in
+        order, for the checked-out class class_path.
+
+        Returns the checked-out class's dict and the results which should be
+        recorded: when a class is leased to more than one runner, results for
+        methods another runner has already reported are dropped, as are all
+        results for a lease which has been superseded.
+        """
         d = self.checked_out.get(class_path)
 
+        if (class_path, runner_id) in self.superseded_leases and not (d and runner_id in d['leases']):
+            if any(result['method']['name'] == 'run' for result in results):
+                # That runner is done with the class.
+                self.superseded_leases.discard((class_path, runner_id))
+            return d, []
+
         if not d:
             raise ValueError("Class %s not checked out." % class_path)
-        if d['runner'] != runner_id:
+        if runner_id not in d['leases']:
             raise ValueError("Class %s checked out by runner %s, not %s" % (class_path, d['runner'], runner_id))
-        if result['method']['name'] not in d['methods']:
-            # If class_teardown failed, the client will send us a result to let us
-            # know. If that happens, don't worry about the apparently un-checked
-            # out test method.
+
+        methods = set(d['methods'])
+        fresh_results = []
+        for result in results:
+            method = result['method']['name']
             if result['method']['fixture_type'] in FIXTURES_WHICH_CAN_RETURN_UNEXPECTED_RESULTS:
+                # If class_teardown failed, the client will send us a result to let us
+                # know. If that happens, don't worry about the apparently un-checked
+                # out test method.
                 pass
+            elif method in methods:
+                methods.remove(method)
+            elif len(d['leases']) > 1 and (method in d['passed_methods'] or method in d['failed_methods']):
+                # Another runner got there first.
+                continue
             else:
-                raise ValueError("Method %s not checked out by runner %s." % (result['method']['name'], runner_id))
+                raise ValueError("Method %s not checked out by runner %s." % (method, runner_id))
+            fresh_results.append(result)
+
+        return d, fresh_results
+
+    def report_results(self, runner_id, results):
+        """Report a batch of results, which may span several classes.
+
+        Each class's results are checked before any of them are recorded, so a
+        class either takes all of its results from the batch or none of them.
+        Returns a list of {'class_path': ..., 'reason': ...} for the classes
+        which were rejected.
+        """
+        results_by_class = collections.OrderedDict()
+        for result in results:
+            class_path = '%s %s' % (result['method']['module'], result['method']['class'])
+            results_by_class.setdefault(class_path, []).append(result)
+
+        rejected = []
+        for class_path, class_results in results_by_class.items():
+            if self.shutting_down:
+                break
 
+            try:
+                d, fresh_results = self.check_results(runner_id, class_path, class_results)
+            except ValueError as e:
+                rejected.append({'class_path': class_path, 'reason': str(e)})
+                continue
+
+            for result in fresh_results:
+                self.record_result(runner_id, class_path, d, result)
+                if self.shutting_down or class_path not in self.checked_out:
+                    break
+
+        return rejected
+
+    def report_result(self, runner_id, result):
+        class_path = '%s %s' % (result['method']['module'], result['method']['class'])
+        d, fresh_results = self.check_results(runner_id, class_path, [result])
+        if fresh_results:
+            self.record_result(runner_id, class_path, d, result)
+
+    def record_result(self, runner_id, class_path, d, result):
+        """Record a result which check_results has accepted."""
         self.activity()
 
         if result['success']:
@@ -192,6 +524,7 @@ class TestRunnerServer(TestRunner):
                 return self.early_shutdown()
 
         d['timeout_time'] = time.time() + self.runner_timeout
+        self.runner_progressed(runner_id, d, result)
 
         # class_teardowns are special.
         if result['method']['fixture_type'] not in FIXTURES_WHICH_CAN_RETURN_UNEXPECTED_RESULTS:
@@ -200,17 +533,67 @@ class TestRunnerServer(TestRunner):
         if not d['methods']:
             self.check_in_class(runner_id, class_path, finished=True)
 
+    def runner_progressed(self, runner_id, d, result):
+        """Note that runner_id has started on class dict `d`, if it hadn't
+        already, and keep the classes it hasn't started on yet from timing out
+        while it works through the ones before them."""
+        now = time.time()
+
+        lease = d['leases'].get(runner_id)
+        if lease is not None and not lease['started']:
+            lease['started'] = True
+            # About when the runner got to this class.
+            lease['start_time'] = now - (result.get('run_time') or 0)
+            self.unstarted_leases.get(runner_id, set()).discard(d['class_path'])
+
+        for class_path in list(self.unstarted_leases.get(runner_id, ())):
+            other_d = self.checked_out.get(class_path)
+            other_lease = other_d and other_d['leases'].get(runner_id)
+            if not other_lease or other_lease['started']:
+                # Checked in, or handed to another runner.
+                self.unstarted_leases[runner_id].discard(class_path)
+                continue
+            other_d['timeout_time'] = max(other_d['timeout_time'], now + self.runner_timeout)
+
     def run(self):
-        class TestsHandler(tornado.web.RequestHandler):
+        # Only ask clients for pretty tracebacks if something's going to show them.
+        wire_capabilities = test_runner_wire.capabilities(omit_pretty=not any(
+            getattr(reporter, 'uses_pretty_exception_info', True) for reporter in self.test_reporters
+        ))
+
+        class WireHandler(tornado.web.RequestHandler):
+            """Reads and writes bodies in whatever encoding was negotiated
+            with the client (see test_runner_wire)."""
+            def set_default_headers(handler):
+                handler.set_header(test_runner_wire.WIRE_HEADER, wire_capabilities)
+
+            def finish_encoded(handler, obj):
+                body, headers = test_runner_wire.encode(
+                    obj,
+                    test_runner_wire.choose_content_type(handler.request.headers.get('Accept')),
+                    compress=test_runner_wire.accepts_deflate(handler.request.headers.get('Accept-Encoding')),
+                )
+                for name, value in headers.items():
+                    handler.set_header(name, value)
+                return handler.finish(body)
+
+            def decode_body(handler):
+                return test_runner_wire.decode(
+                    handler.request.body,
+                    handler.request.headers.get('Content-Type'),
+                    handler.request.headers.get(test_runner_wire.WIRE_HEADER),
+                )
+
+        class TestsHandler(WireHandler):
             @tornado.web.asynchronous
             def get(handler):
                 runner_id = handler.get_argument('runner')
 
                 if self.shutting_down:
-                    self.runners_outstanding.discard(runner_id)
-                    return handler.finish(json.dumps({
+                    self.runner_finished(runner_id)
+                    return handler.finish_encoded({
                         'finished': True,
-                    }))
+                    })
 
                 if self.revision and self.revision != handler.get_argument('revision'):
                     return handler.send_error(
@@ -220,21 +603,34 @@ class TestRunnerServer(TestRunner):
                         ),
                     )
 
-                def callback(test_dict):
+                prefetch = bool(handler.get_argument('prefetch', None))
+                count = handler.get_argument('count', None)
+                count = int(count) if count else None
+                budget = handler.get_argument('budget', None)
+                budget = float(budget) if budget else None
+                if count is None and budget is None:
+                    count = 1
+
+                def callback(test_dicts):
                     self.runners_outstanding.discard(runner_id)
-                    handler.finish(json.dumps({
-                        'class': test_dict['class_path'],
-                        'methods': test_dict['methods'],
+                    handler.finish_encoded({
+                        # The first test, for clients which don't know about batches.
+                        'class': test_dicts[0]['class_path'],
+                        'methods': test_dicts[0]['methods'],
+                        'classes': [
+                            {'class': test_dict['class_path'], 'methods': test_dict['methods']}
+                            for test_dict in test_dicts
+                        ],
                         'finished': False,
-                    }))
+                    })
 
                 def empty_callback():
-                    self.runners_outstanding.discard(runner_id)
-                    handler.finish(json.dumps({
+                    self.runner_finished(runner_id)
+                    handler.finish_encoded({
                         'finished': True,
-                    }))
+                    })
 
-                self.get_next_test(runner_id, callback, empty_callback)
+                self.get_next_test_batch(runner_id, callback, empty_callback, count=count, budget=budget, prefetch=prefetch)
 
             def finish(handler, *args, **kwargs):
                 super(TestsHandler, handler).finish(*args, **kwargs)
@@ -245,14 +641,27 @@ class TestRunnerServer(TestRunner):
                     iol = tornado.ioloop.IOLoop.instance()
                     iol.add_callback(iol.stop)
 
-        class ResultsHandler(tornado.web.RequestHandler):
+        class HeartbeatHandler(WireHandler):
+            def post(handler):
+                self.heartbeat(handler.get_argument('runner'))
+                return handler.finish("kthx")
+
+        class ResultsHandler(WireHandler):
             def post(handler):
                 runner_id = handler.get_argument('runner')
-                self.runners_outstanding.add(runner_id)
-                result = json.loads(handler.request.body.decode('UTF-8'))
+                self.results_posted(runner_id)
+                result = handler.decode_body()
+
+                if isinstance(result, list):
+                    for each_result in result:
+                        test_runner_wire.restore_omitted_fields(each_result)
+                    # Some classes' results may have been recorded even if
+                    # others were rejected, so this mustn't look like an error
+                    # the client could retry.
+                    return handler.finish_encoded({'rejected': self.report_results(runner_id, result)})
 
                 try:
-                    self.report_result(runner_id, result)
+                    self.report_result(runner_id, test_runner_wire.restore_omitted_fields(result))
                 except ValueError as e:
                     return handler.send_error(409, reason=str(e))
 
@@ -269,28 +678,50 @@ class TestRunnerServer(TestRunner):
             # Enqueue all of our tests.
             discovered_tests = []
             try:
-                discovered_tests = self.discover()
+                discovered_tests = self.discover_manifests()
             except Exception as exc:
                 _log.debug("Test discovery blew up!: %r" % exc)
                 raise
-            for test_instance in discovered_tests:
+            run_times = self.estimate_run_times(dict(
+                ('%s.%s' % (manifest['module'], manifest['class']), len(manifest['methods']))
+                for manifest in discovered_tests
+            ))
+            queued_tests = []  # (priority, test_dict)
+            for manifest in discovered_tests:
                 test_dict = {
-                    'class_path': '%s %s' % (test_instance.__module__, test_instance.__class__.__name__),
-                    'methods': [test.__name__ for test in test_instance.runnable_test_methods()],
+                    'class_path': '%s %s' % (manifest['module'], manifest['class']),
+                    'methods': sorted(manifest['methods']),
                 }
+                if manifest['methods']:
+                    self.method_run_times[test_dict['class_path']] = (
+                        run_times['%s.%s' % (manifest['module'], manifest['class'])] / len(manifest['methods'])
+                    )
+                if not manifest.get('class_fixtures', True):
+                    self.splittable_classes.add(test_dict['class_path'])
 
                 if test_dict['methods']:
-                    # When the client has finished running the entire TestCase,
-                    # it will signal us by sending back a result with method
-                    # name 'run'. Add this result to the list we expect to get
-                    # back from the client.
-                    test_dict['methods'].append('run')
-                    self.pair_queue.add_test(0, test_dict)
+                    queued_tests.append((0, test_dict))
+
+            if self.journal_path:
+                self.journal = ServerJournal(self.journal_path, resume=self.resume)
+                queued_tests = self.replay_journal(queued_tests)
+                if not queued_tests:
+                    logging.warning('Every test in journal %s has been reported, shutting down.' % self.journal_path)
+                    tornado.ioloop.IOLoop.instance().add_callback(self.shutdown)
+
+            for priority, test_dict in queued_tests:
+                # When the client has finished running the entire TestCase,
+                # it will signal us by sending back a result with method
+                # name 'run'. Add this result to the list we expect to get
+                # back from the client.
+                test_dict['methods'].append('run')
+                self.pair_queue.add_test(priority, test_dict)
 
             # Start an HTTP server.
             application = tornado.web.Application([
                 (r"/tests", TestsHandler),
                 (r"/results", ResultsHandler),
+                (r"/heartbeat", HeartbeatHandler),
             ])
 
             server = tornado.httpserver.HTTPServer(application)
@@ -305,31 +736,241 @@ class TestRunnerServer(TestRunner):
             self.activity()
             timeout_server()  # Set the first callback.
 
+            def speculate_periodically():
+                if self.shutting_down:
+                    return
+                self.speculate()
+                tornado.ioloop.IOLoop.instance().add_timeout(time.time() + SPECULATION_INTERVAL, speculate_periodically)
+            speculate_periodically()
+
+            def check_heartbeats_periodically():
+                if self.shutting_down:
+                    return
+                self.check_heartbeats()
+                tornado.ioloop.IOLoop.instance().add_timeout(
+                    time.time() + HEARTBEAT_CHECK_INTERVAL,
+                    check_heartbeats_periodically,
+                )
+            check_heartbeats_periodically()
+
             tornado.ioloop.IOLoop.instance().start()
 
         finally:
+            if self.journal is not None:
+                self.journal.close()
+
             # Report what happened, even if something went wrong.
+            if self.reporting_queue is not None:
+                self.reporting_queue.join()
             report = [reporter.report() for reporter in self.test_reporters]
             return all(report)
 
+    def replay_journal(self, queued_tests):
+        """Catch up with the check-ins recorded in our journal by a previous
+        server: report their results again, so this run's reports cover the
+        whole run, and remember which methods were requeued and why, as
+        check_in_class would have. Returns the (priority, test_dict)s from
+        queued_tests which still have methods to run, minus the methods
+        whose results were already reported."""
+        reported_methods = collections.defaultdict(set)  # Keyed on class path.
+        requeued_from = {}  # Keyed on class path, the runner the class was last requeued from.
+
+        for event in self.journal.events:
+            class_path = event['class_path']
+            for result_dict in event['reported']:
+                reported_methods[class_path].add(result_dict['method']['name'])
+                self.report_test_result(result_dict)
+
+            for result_dict in event['failed']:
+                self.failed_rerun_methods.add((class_path, result_dict['method']['name']))
+                self.previous_run_results[(class_path, result_dict['method']['name'])] = result_dict
+            for result_dict in event['timed_out']:
+                self.timeout_rerun_methods.add((class_path, result_dict['method']['name']))
+                self.previous_run_results[(class_path, result_dict['method']['name'])] = result_dict
+            if event['failed'] or event['timed_out']:
+                requeued_from[class_path] = event['runner']
+
+            self.failure_count += event['failure_count']
+
+        remaining_tests = []
+        for priority, test_dict in queued_tests:
+            class_path = test_dict['class_path']
+            methods = [method for method in test_dict['methods'] if method not in reported_methods[class_path]]
+            if not methods:
+                continue
+
+            test_dict = dict(test_dict, methods=methods)
+            if class_path in requeued_from:
+                priority = -1
+                test_dict['last_runner'] = requeued_from[class_path]
+            remaining_tests.append((priority, test_dict))
+
+        return remaining_tests
+
     def activity(self):
         self.last_activity_time = time.time()
 
-    def check_out_class(self, runner, test_dict):
+    def results_posted(self, runner_id):
+        """Note that runner_id has posted results, so shutdown should give it a
+        chance to come back for more tests, unless it's been told there are
+        none."""
+        if runner_id not in self.finished_runners:
+            self.runners_outstanding.add(runner_id)
+
+    def runner_finished(self, runner_id):
+        """Note that runner_id has been told there are no more tests. If that
+        was the answer to a prefetch, it still posts results for what it's
+        running, but won't ask for tests again."""
+        self.finished_runners.add(runner_id)
+        self.runners_outstanding.discard(runner_id)
+
+    def heartbeat(self, runner_id):
+        """Note that runner_id is still alive, even if it's busy running a
+        long test. This doesn't extend runner_timeout for the classes it has
+        checked out."""
+        self.activity()
+        self.heartbeat_times[runner_id] = time.time()
+
+    def check_heartbeats(self):
+        """Treat runners which have sent heartbeats, but not within the last
+        heartbeat_timeout seconds, as dead, rather than waiting out
+        runner_timeout on the classes they have checked out. Runners which
+        never send heartbeats are left to timeout_class."""
+        if not self.heartbeat_timeout or self.shutting_down:
+            return
+
+        now = time.time()
+        for runner, heartbeat_time in list(self.heartbeat_times.items()):
+            if now - heartbeat_time > self.heartbeat_timeout:
+                logging.warning('No heartbeat from runner %s for %ss, requeueing its tests.' % (runner, self.heartbeat_timeout))
+                del self.heartbeat_times[runner]
+                self.drop_runner(runner)
+
+    def drop_runner(self, runner):
+        """Give up on a dead runner's leases. A class is checked in as timed
+        out, unless other runners' leases (see speculate) cover all of its
+        remaining methods, in which case they're left to finish it."""
+        for class_path in list(self.checked_out):
+            d = self.checked_out.get(class_path)
+            if d is None or runner not in d['leases']:
+                continue
+
+            covered = set()
+            for leased_runner, lease in d['leases'].items():
+                if leased_runner != runner:
+                    covered.update(lease['methods'])
+
+            if d['methods'] - set(['run']) <= covered:
+                del d['leases'][runner]
+                self.superseded_leases.add((class_path, runner))
+                if d['runner'] == runner:
+                    # Only the first runner's lease has a timeout running.
+                    d['runner'] = next(iter(d['leases']))
+                    self.timeout_class(d['runner'], class_path)
+            else:
+                self.check_in_class(runner, class_path, timed_out=True)
+
+            if self.shutting_down:
+                return
+
+    def check_out_class(self, runner, test_dict, delay=0, started=True):
+        """Check out a class to a runner. `delay` is how many seconds we
+        expect the runner to take to get to it, added to its timeout. Unless
+        `started`, the runner has other tests to run first: until it reports a
+        result for this class, the class won't time out as long as the runner
+        keeps reporting results for others.
+
+        If the class is already checked out, this is a speculative copy of
+        some of its methods (see speculate), and the runner is given a lease
+        on them alongside the runners which already have the class.
+        """
         self.activity()
 
+        methods = [method for method in test_dict['methods'] if method != 'run']
+        lease = {
+            'methods': methods,  # In the order the runner will run them.
+            'start_time': time.time() + delay,
+            'expected_time': self.method_run_times.get(test_dict['class_path'], 0) * len(methods),
+            'speculated': False,  # Whether an idle runner has been given a copy of this lease.
+            'started': started,  # Whether the runner has started on this lease.
+        }
+
+        if not started:
+            self.unstarted_leases.setdefault(runner, set()).add(test_dict['class_path'])
+
+        d = self.checked_out.get(test_dict['class_path'])
+        if d is not None:
+            d['leases'][runner] = lease
+            return
+
         self.checked_out[test_dict['class_path']] = {
             'runner': runner,
+            'leases': {runner: lease},
             'class_path': test_dict['class_path'],
             'methods': set(test_dict['methods']),
             'failed_methods': {},
             'passed_methods': {},
             'start_time': time.time(),
-            'timeout_time': time.time() + self.runner_timeout,
+            'timeout_time': time.time() + delay + self.runner_timeout,
         }
 
         self.timeout_class(runner, test_dict['class_path'])
 
+    def speculate(self):
+        """Once there's nothing left in the queue, give idle runners copies of
+        work which other runners are holding up, so the run isn't left
+        waiting on one slow (or dead) runner.
+
+        A lease which is taking much longer than estimated has its unfinished
+        methods copied to an idle runner. A lease on a class without class
+        fixtures can have the later half of its not-yet-started methods split
+        off to an idle runner. Either way, the original runner carries on, and
+        the first result for each method wins.
+        """
+        if self.disable_speculation or self.shutting_down or not self.pair_queue.empty():
+            return
+
+        now = time.time()
+        candidates = []  # (estimated seconds saved, class dict, runner, methods, is_straggler)
+        for d in self.checked_out.values():
+            for runner, lease in d['leases'].items():
+                remaining = [method for method in lease['methods'] if method in d['methods']]
+                if not remaining:
+                    continue
+
+                overdue = now - lease['start_time'] - max(
+                    STRAGGLER_FACTOR * lease['expected_time'],
+                    STRAGGLER_MIN_SECONDS,
+                )
+                if not lease['speculated'] and overdue > 0:
+                    candidates.append((overdue, d, runner, remaining, True))
+                elif d['class_path'] in self.splittable_classes:
+                    # The first remaining method may be running: a lease
+                    # is only known to have started once it has a result.
+                    not_started = remaining[1:]
+                    split = not_started[len(not_started) // 2:]
+                    split_time = self.method_run_times.get(d['class_path'], 0) * len(split)
+                    if split and split_time >= SPLIT_MIN_SECONDS:
+                        candidates.append((split_time, d, runner, split, False))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        for _, d, runner, methods, is_straggler in candidates:
+            work = self.pair_queue.pop_waiting_worker(lambda idle_runner: idle_runner not in d['leases'])
+            if work is None:
+                continue
+
+            lease = d['leases'][runner]
+            if is_straggler:
+                lease['speculated'] = True
+            else:
+                lease['methods'] = [method for method in lease['methods'] if method not in methods]
+
+            work.worker(work.priority, {
+                'last_runner': runner,
+                'class_path': d['class_path'],
+                'methods': methods + ['run'],
+            })
+
     def check_in_class(self, runner, class_path, timed_out=False, finished=False, early_shutdown=False):
         if not timed_out:
             self.activity()
@@ -339,15 +980,21 @@ class TestRunnerServer(TestRunner):
 
         if class_path not in self.checked_out:
             raise ValueError("Class path %r not checked out." % class_path)
-        if not early_shutdown and self.checked_out[class_path]['runner'] != runner:
+        if not early_shutdown and runner not in self.checked_out[class_path]['leases']:
             raise ValueError("Class path %r not checked out by runner %r." % (class_path, runner))
 
         d = self.checked_out.pop(class_path)
 
+        if len(d['leases']) > 1 and not early_shutdown:
+            # Any of the runners could still be working on the class.
+            for leased_runner in d['leases']:
+                self.superseded_leases.add((class_path, leased_runner))
+
         passed_methods = list(d['passed_methods'].items())
         failed_methods = list(d['failed_methods'].items())
         tests_to_report = passed_methods[:]
         requeue_methods = []
+        timed_out_results = []
 
         for method, result in failed_methods:
             if self.disable_requeueing:
@@ -372,10 +1019,7 @@ class TestRunnerServer(TestRunner):
                     requeue_methods.append((method, result))
 
         for method, result_dict in tests_to_report:
-            for reporter in self.test_reporters:
-                result_dict['previous_run'] = self.previous_run_results.get((class_path, method), None)
-                reporter.test_start(result_dict)
-                reporter.test_complete(result_dict)
+            result_dict['previous_run'] = self.previous_run_results.get((class_path, method), None)
 
         # Requeue failed tests
         requeue_dict = {
@@ -417,10 +1061,24 @@ class TestRunnerServer(TestRunner):
                     requeue_dict['methods'].append(method)
                     self.timeout_rerun_methods.add((class_path, method))
                     self.previous_run_results[(class_path, method)] = result_dict
+                    timed_out_results.append(result_dict)
                 else:
-                    for reporter in self.test_reporters:
-                        reporter.test_start(result_dict)
-                        reporter.test_complete(result_dict)
+                    tests_to_report.append((method, result_dict))
+
+        if self.journal is not None:
+            self.journal.record_check_in(
+                class_path,
+                runner,
+                reported=[result_dict for _, result_dict in tests_to_report],
+                failed=[result_dict for _, result_dict in requeue_methods],
+                timed_out=timed_out_results,
+                failure_count=len(failed_methods),
+            )
+
+        # Report only once the check-in is journaled: the reporting queue's
+        # thread may be reading these dicts while we carry on.
+        for _, result_dict in tests_to_report:
+            self.report_test_result(result_dict)
 
         if requeue_dict['methods']:
             self.pair_queue.add_test(-1, requeue_dict)
@@ -437,6 +1095,7 @@ class TestRunnerServer(TestRunner):
             'start_time': time.time() - self.runner_timeout,
             'end_time': time.time(),
             'run_time': float(self.runner_timeout),
+            'run_time_ns': int(self.runner_timeout * 1000000000),
             'normalized_run_time': "%.2fs" % (self.runner_timeout),
             'complete': True,  # We've tried running the test.
             'success': False,
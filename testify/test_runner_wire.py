@@ -0,0 +1,130 @@
+"""
+How TestRunnerServer and its clients encode what they send each other.
+
+JSON is always understood. msgpack (when it's installed on both ends) and
+deflate compression are negotiated: clients list what they accept for
+responses in the usual Accept and Accept-Encoding headers, and the server
+lists what it accepts for request bodies in the X-Testify-Wire header of each
+response, as space-separated tokens:
+
+    msgpack      Bodies may be msgpack, with Content-Type application/x-msgpack.
+    deflate      Bodies may be zlib-compressed, with X-Testify-Wire deflate.
+    batch        /results takes a list of results, not just one.
+    omit-pretty  Results needn't include exception_info_pretty, as none of the
+                 server's reporters use it.
+
+A client talking to a server which doesn't send the header (or a server
+talking to a client which doesn't send Accept) uses uncompressed JSON.
+
+Compressed responses have the standard Content-Encoding deflate, but
+compressed request bodies say so in their own X-Testify-Wire header instead:
+tornado doesn't decompress request bodies, and warns about each one with a
+Content-Encoding.
+"""
+from __future__ import absolute_import
+
+import zlib
+
+try:
+    import simplejson as json  # noqa
+except ImportError:
+    import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+WIRE_HEADER = 'X-Testify-Wire'
+
+# Bodies smaller than this aren't worth compressing.
+COMPRESS_MIN_BYTES = 1024
+
+
+def content_types():
+    """The content types we can encode and decode, best first."""
+    if msgpack is not None:
+        return [MSGPACK, JSON]
+    return [JSON]
+
+
+def _header_values(header):
+    return [value.split(';')[0].strip() for value in (header or '').split(',')]
+
+
+def choose_content_type(accept):
+    """The best content type we can encode which an Accept header allows."""
+    accepted = _header_values(accept)
+    for content_type in content_types():
+        if content_type in accepted:
+            return content_type
+    return JSON
+
+
+def accepts_deflate(accept_encoding):
+    return 'deflate' in _header_values(accept_encoding)
+
+
+def capabilities(omit_pretty=False):
+    """The X-Testify-Wire header for a server."""
+    tokens = ['deflate', 'batch']
+    if msgpack is not None:
+        tokens.insert(0, 'msgpack')
+    if omit_pretty:
+        tokens.append('omit-pretty')
+    return ' '.join(tokens)
+
+
+def parse_capabilities(header):
+    """The set of tokens in an X-Testify-Wire header, which may be None."""
+    capabilities = set((header or '').split())
+    if msgpack is None:
+        capabilities.discard('msgpack')
+    return capabilities
+
+
+def encode(obj, content_type=JSON, compress=False, request=False):
+    """Encode obj as content_type, compressing it if asked to and it's big
+    enough to be worth it. Returns (body, headers), for a request body if
+    `request`, or else a response's."""
+    if content_type == MSGPACK:
+        body = msgpack.packb(obj, use_bin_type=True)
+    else:
+        body = json.dumps(obj)
+        if not isinstance(body, bytes):
+            body = body.encode('UTF-8')
+
+    headers = {'Content-Type': content_type}
+    if compress and len(body) >= COMPRESS_MIN_BYTES:
+        body = zlib.compress(body)
+        headers[WIRE_HEADER if request else 'Content-Encoding'] = 'deflate'
+    return body, headers
+
+
+def decode(body, content_type=None, content_encoding=None):
+    """Decode a body sent with the given Content-Type header, and
+    Content-Encoding (or for a request body, X-Testify-Wire) header."""
+    if content_encoding == 'deflate':
+        body = zlib.decompress(body)
+    if _header_values(content_type)[0] == MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body.decode('UTF-8'))
+
+
+def restore_omitted_fields(result):
+    """Fill in fields of a result dict which the client was allowed to omit."""
+    if 'exception_info_pretty' not in result:
+        result['exception_info_pretty'] = result.get('exception_info')
+    return result
+
+
+def omit_fields(result, capabilities):
+    """A copy of a result dict without the fields the server said it doesn't need."""
+    if 'omit-pretty' in capabilities and 'exception_info_pretty' in result:
+        result = dict(result)
+        del result['exception_info_pretty']
+    return result
+
+# vim: set ts=4 sts=4 sw=4 et: